@@ -2,15 +2,25 @@ from flask import Flask
 from source.utils.config import Config
 from source.api.documents import register_routes as register_document_routes
 from source.api.queries import register_routes as register_query_routes
+from source.api.jobs import register_routes as register_job_routes
+from source.api.metrics import register_routes as register_metrics_routes
+from source.services.container import init_services
+from source.utils.observability import configure_logging
 import os
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    configure_logging(app.config['LOG_LEVEL'])
 
-    # Register routes directly (no blueprints)
+    # One set of services (and one Weaviate connection pool) per process, shared by all requests
+    init_services(app, config_class())
+
+    # Register routes directly (no blueprints); metrics first, its hooks assign the request trace id
+    register_metrics_routes(app)
     register_document_routes(app)
     register_query_routes(app)
+    register_job_routes(app)
 
     return app
 
@@ -0,0 +1,40 @@
+from quart import Quart
+from source.utils.config import Config
+from source.api.aio.documents import register_routes as register_document_routes
+from source.api.aio.queries import register_routes as register_query_routes
+from source.api.aio.jobs import register_routes as register_job_routes
+from source.api.aio.metrics import register_routes as register_metrics_routes
+from source.services.container import init_services
+from source.utils.observability import configure_logging
+import os
+
+def create_asgi_app(config_class=Config):
+    """ASGI equivalent of create_app (app.py), with the same routes as async views.
+
+    Queries and ingest wait on the async Gemini and Weaviate clients instead of holding a thread, so one
+    process keeps many requests in flight; parsing and chunking run in the ingest process pool.
+    """
+    app = Quart(__name__)
+    app.config.from_object(config_class)
+    app.config['MAX_CONTENT_LENGTH'] = None  # as in Flask: no limit on upload size (Quart defaults to 16 MB)
+    configure_logging(app.config['LOG_LEVEL'])
+
+    container = init_services(app, config_class())
+
+    @app.after_serving
+    async def close_async_clients():
+        # The async clients belong to the serving event loop, so they are closed in it.
+        await container.aclose()
+
+    register_metrics_routes(app)
+    register_document_routes(app)
+    register_query_routes(app)
+    register_job_routes(app)
+
+    return app
+
+if __name__ == '__main__':
+    app = create_asgi_app()
+    host = os.getenv('FLASK_RUN_HOST', '0.0.0.0')
+    port = int(os.getenv('PORT', 5000))
+    app.run(host=host, port=port)
@@ -0,0 +1,134 @@
+# ./scripts/bench_chunking.py
+"""Benchmarks the native MarkdownChunker against the langchain splitters.
+
+Generates large synthetic plain-text and markdown documents and, for each chunker, reports chunks/sec,
+MB/s, the tracemalloc peak while chunking and how many chunks end on a sentence boundary.
+
+    langchain  the previous chunk_pdf_docx path: MarkdownHeaderTextSplitter, then
+               RecursiveCharacterTextSplitter(separators=['.']) on oversized sections
+    native     MarkdownChunker.spans (offsets only) and split_text (offsets sliced into strings)
+
+    python -m scripts.bench_chunking --mb 1 8 --chunk-size 1000 --json bench_chunking.json
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
+
+from source.utils.chunking import MarkdownChunker
+
+WORDS = ("data vector index query chunk parser document service embedding latency throughput memory "
+         "section header sentence boundary weaviate cache token batch worker process request").split()
+HEADERS = [("#", "Header 1"), ("##", "Header 2"), ("###", "Header 3"), ("####", "Header 4")]
+
+
+def sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 30))]
+    return " ".join(words).capitalize() + rng.choice(".....!?")
+
+
+def paragraph(rng: random.Random) -> str:
+    return " ".join(sentence(rng) for _ in range(rng.randint(2, 12)))
+
+
+def synthetic_text(size: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    parts, total = [], 0
+    while total < size:
+        parts.append(paragraph(rng))
+        total += len(parts[-1]) + 2
+    return "\n\n".join(parts)
+
+
+def synthetic_markdown(size: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    parts, total = [], 0
+    while total < size:
+        if rng.random() < 0.2:
+            parts.append("#" * rng.randint(1, 4) + " " + " ".join(rng.choice(WORDS) for _ in range(3)).title())
+        parts.append(paragraph(rng))
+        total += len(parts[-1]) + 2
+    return "\n\n".join(parts)
+
+
+def langchain_chunker(chunk_size: int, chunk_overlap: int, markdown: bool):
+    text_splitter = RecursiveCharacterTextSplitter(
+        separators=['.'], chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len
+    )
+    if not markdown:
+        return text_splitter.split_text
+
+    def split(text):
+        chunks = []
+        for section in MarkdownHeaderTextSplitter(headers_to_split_on=HEADERS).split_text(text):
+            if len(section.page_content) <= chunk_size:
+                chunks.append(section.page_content)
+            else:
+                chunks.extend(text_splitter.split_text(section.page_content))
+        return chunks
+    return split
+
+
+def measure(fn, text: str, repeat: int) -> dict:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    result = fn(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    chunks = [text[start:end] for start, end in result] if result and isinstance(result[0], tuple) else result
+    ends = sum(1 for chunk in chunks if chunk.rstrip()[-1:] in ".!?")
+    return {
+        "chunks": len(chunks),
+        "seconds": round(best, 4),
+        "chunks_per_s": round(len(chunks) / best),
+        "mb_per_s": round(len(text) / best / 1e6, 2),
+        "peak_mb": round(peak / 1e6, 2),
+        "avg_chars": round(sum(map(len, chunks)) / max(len(chunks), 1)),
+        "sentence_end_pct": round(100 * ends / max(len(chunks), 1), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, nargs="+", default=[1, 8], help="input sizes in MB")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement, best is kept")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for mb in args.mb:
+        size = int(mb * 1_000_000)
+        for kind, text in (("txt", synthetic_text(size)), ("markdown", synthetic_markdown(size))):
+            markdown = kind == "markdown"
+            native = MarkdownChunker(args.chunk_size, args.chunk_overlap)
+            native_tokens = MarkdownChunker(args.chunk_size // 5, args.chunk_overlap // 5, unit="tokens")
+            chunkers = [
+                ("langchain", langchain_chunker(args.chunk_size, args.chunk_overlap, markdown)),
+                ("native spans", lambda t: list(native.spans(t))),
+                ("native split", native.split_text),
+                ("native tokens", native_tokens.split_text),
+            ]
+            print(f"{kind} {len(text) / 1e6:.1f} MB")
+            for name, fn in chunkers:
+                row = {"input": kind, "mb": round(len(text) / 1e6, 2), "chunker": name, **measure(fn, text, args.repeat)}
+                results.append(row)
+                print(f"  {name:<14} {row['chunks']:>7} chunks  {row['chunks_per_s']:>8} chunks/s  "
+                      f"{row['mb_per_s']:>6} MB/s  peak {row['peak_mb']:>7} MB  "
+                      f"avg {row['avg_chars']:>5} chars  {row['sentence_end_pct']:>5}% end on a sentence")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# ./scripts/bench_parse.py
+"""Benchmarks serial vs page-parallel MarkItDown parsing of PDFs.
+
+Builds synthetic PDFs by repeating the pages of test_files/test.pdf and times the serial MarkItDown
+conversion against parse_in_parallel for each worker count.
+
+    python -m scripts.bench_parse --pages 16 64 256 --workers 2 4 8 --json bench_parse.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from markitdown import MarkItDown
+from pypdf import PdfReader, PdfWriter
+
+from source.utils.parallel_parse import PDF, parse_in_parallel, shutdown_pool
+
+SOURCE_PDF = os.path.join("test_files", "test.pdf")
+
+
+def build_pdf(source: str, pages: int, directory: str) -> str:
+    """Writes a PDF of `pages` pages made by cycling through the pages of `source`."""
+    reader = PdfReader(source)
+    writer = PdfWriter()
+    for index in range(pages):
+        writer.add_page(reader.pages[index % len(reader.pages)])
+    path = os.path.join(directory, f"synthetic-{pages}.pdf")
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+
+def timed(fn, repeat: int):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[16, 64, 256], help="synthetic PDF sizes")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4], help="process counts to try")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per measurement, best is kept")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    print(f"cpus: {os.cpu_count()}")
+    files = [("test.pdf", SOURCE_PDF)]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        files += [(f"synthetic-{pages}", build_pdf(SOURCE_PDF, pages, directory)) for pages in args.pages]
+        markitdown = MarkItDown()
+        for name, path in files:
+            pages = len(PdfReader(path).pages)
+            serial, serial_text = timed(lambda: markitdown.convert(path).text_content, args.repeat)
+            row = {"file": name, "pages": pages, "serial_s": round(serial, 3), "parallel": []}
+            print(f"{name:>16} {pages:>5} pages  serial {serial:8.3f}s")
+            for workers in args.workers:
+                # Start the pool outside the measurement; its spawn cost is paid once per process.
+                parse_in_parallel(path, PDF, workers, min_units=2)
+                elapsed, text = timed(lambda: parse_in_parallel(path, PDF, workers, min_units=2), args.repeat)
+                if text is None:  # too few pages to split
+                    continue
+                same = text.split() == serial_text.split()
+                row["parallel"].append({
+                    "workers": workers, "seconds": round(elapsed, 3),
+                    "speedup": round(serial / elapsed, 2), "same_text": same,
+                })
+                print(f"{'':>28}{workers:>3} workers {elapsed:8.3f}s  x{serial / elapsed:5.2f}"
+                      f"{'' if same else '  (text differs)'}")
+            results.append(row)
+    shutdown_pool()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
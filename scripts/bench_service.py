@@ -0,0 +1,278 @@
+# ./scripts/bench_service.py
+"""Load and throughput benchmark of the whole service, with no cloud dependencies.
+
+Starts the real Flask app from create_app on a local threaded server, with the deterministic fake
+embedder (EMBEDDING_BACKEND=fake) and the in-process vector store (VECTOR_BACKEND=local) under a
+temporary directory, and drives it over HTTP:
+
+    ingest  synthetic text documents are uploaded with POST /documents until the corpus reaches each
+            --corpus size, --ingest-concurrency uploads at a time; reports docs/sec, chunks/sec and
+            upload latency percentiles
+    query   at every corpus size and every --concurrency level, --queries POST /queries requests go to
+            random documents; reports queries/sec and p50/p95/p99 latency
+
+The query cache is off unless --query-cache is given, so every query embeds and searches. Add
+--embed-latency-ms to simulate the network time of a real embedding API.
+
+    python -m scripts.bench_service --corpus 50 200 --concurrency 1 4 16 --json bench.json
+    python -m scripts.bench_service --corpus 50 200 --concurrency 1 4 16 --baseline bench.json
+
+--json writes the results with the git commit they were measured on; --baseline compares this run
+with such a file and prints the change of every metric.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from prometheus_client import REGISTRY
+from werkzeug.serving import make_server
+
+from app import create_app
+from scripts.bench_chunking import WORDS, synthetic_text
+from source.utils.config import local_config
+
+# Metrics where a higher value is better; for every other metric lower is better.
+HIGHER_IS_BETTER = ("docs_per_s", "chunks_per_s", "queries_per_s")
+
+
+class Server:
+    """Serves the app on a free localhost port from a background thread."""
+
+    def __init__(self, app):
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        # werkzeug's per-request access log would otherwise dominate the output (and the timings).
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.thread.join()
+
+
+class Client:
+    """One requests session per load-generating thread."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def upload(self, name: str, text: str) -> str:
+        response = self.session.post(
+            f"{self.url}/documents",
+            data={"action": "upload", "content_type": "text/plain", "async": "false"},
+            files={"file": (name, text.encode("utf-8"), "text/plain")},
+        )
+        response.raise_for_status()
+        return response.json()["document_id"]
+
+    def query(self, document_id: str, text: str, limit: int):
+        response = self.session.post(
+            f"{self.url}/queries", json={"document_id": document_id, "query": text, "num_chunks_return": limit}
+        )
+        response.raise_for_status()
+
+
+def timed(fn, *args) -> tuple:
+    """Runs fn(*args) and returns (seconds, error message or None)."""
+    start = time.perf_counter()
+    try:
+        fn(*args)
+        error = None
+    except Exception as e:
+        error = str(e)
+    return time.perf_counter() - start, error
+
+
+def latency_summary(seconds: list) -> dict:
+    if not seconds:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+    return {"p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2),
+            "max_ms": round(max(seconds) * 1000, 2)}
+
+
+def chunks_indexed() -> float:
+    return REGISTRY.get_sample_value("docquery_document_chunks_sum") or 0.0
+
+
+def embedding_calls() -> float:
+    return REGISTRY.get_sample_value("docquery_embedding_request_seconds_count") or 0.0
+
+
+def ingest(client: Client, corpus: list, target: int, concurrency: int, doc_chars: int, seed: int) -> dict:
+    """Uploads documents until `corpus` holds `target` document ids."""
+    count = target - len(corpus)
+    texts = [synthetic_text(doc_chars, seed=seed + len(corpus) + i) for i in range(count)]
+    ids = [None] * count
+    chunks_before = chunks_indexed()
+
+    def upload(i):
+        ids[i] = client.upload(f"bench-{len(corpus) + i}.txt", texts[i])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(lambda i: timed(upload, i), range(count)))
+    elapsed = time.perf_counter() - start
+    corpus.extend(document_id for document_id in ids if document_id)
+    chunks = chunks_indexed() - chunks_before
+    errors = [error for _, error in outcomes if error]
+    return {
+        "phase": "ingest",
+        "corpus": target,
+        "concurrency": concurrency,
+        "docs": count - len(errors),
+        "chunks": int(chunks),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "docs_per_s": round((count - len(errors)) / elapsed, 2),
+        "chunks_per_s": round(chunks / elapsed, 1),
+        **latency_summary([seconds for seconds, error in outcomes if not error]),
+    }
+
+
+def query_load(client: Client, corpus: list, concurrency: int, total: int, limit: int, seed: int) -> dict:
+    """Sends `total` queries to random documents, `concurrency` at a time."""
+    rng = random.Random(seed)
+    work = [(rng.choice(corpus), " ".join(rng.choices(WORDS, k=rng.randint(3, 8)))) for _ in range(total)]
+    # Warm up each connection so connection setup is not measured.
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda item: timed(client.query, item[0], item[1], limit), work[:concurrency]))
+        calls_before = embedding_calls()
+        start = time.perf_counter()
+        outcomes = list(pool.map(lambda item: timed(client.query, item[0], item[1], limit), work))
+        elapsed = time.perf_counter() - start
+    errors = [error for _, error in outcomes if error]
+    return {
+        "phase": "query",
+        "corpus": len(corpus),
+        "concurrency": concurrency,
+        "queries": total,
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "queries_per_s": round((total - len(errors)) / elapsed, 1),
+        # Below 1 when concurrent queries share embedding calls (EMBEDDING_MICROBATCH_*).
+        "embedding_calls_per_query": round((embedding_calls() - calls_before) / total, 3),
+        **latency_summary([seconds for seconds, error in outcomes if not error]),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def row_key(row: dict) -> tuple:
+    return row["phase"], row["corpus"], row["concurrency"]
+
+
+def compare(results: list, baseline_path: str):
+    """Prints the change of every metric against the matching rows of an earlier --json file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {row_key(row): row for row in baseline["results"]}
+    print(f"\nchange against {baseline_path} (commit {baseline.get('commit')}), + is better:")
+    for row in results:
+        old = previous.get(row_key(row))
+        if old is None:
+            continue
+        changes = []
+        for metric in ("docs_per_s", "chunks_per_s", "queries_per_s", "embedding_calls_per_query", "p50_ms", "p95_ms", "p99_ms"):
+            if row.get(metric) is None or not old.get(metric):
+                continue
+            change = (row[metric] - old[metric]) / old[metric] * 100
+            if metric not in HIGHER_IS_BETTER:
+                change = -change
+            changes.append(f"{metric} {change:+.1f}%")
+        print(f"  {row['phase']:<6} corpus {row['corpus']:>5}  c={row['concurrency']:<3} " + "  ".join(changes))
+
+
+def print_row(row: dict):
+    if row["phase"] == "ingest":
+        head = f"{row['docs_per_s']:>8} docs/s  {row['chunks_per_s']:>9} chunks/s"
+    else:
+        head = f"{row['queries_per_s']:>8} q/s  {row['embedding_calls_per_query']:>5} embed calls/q"
+    print(f"  {row['phase']:<6} corpus {row['corpus']:>5}  c={row['concurrency']:<3} {head}  "
+          f"p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms  errors {row['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=int, nargs="+", default=[50, 200], help="corpus sizes in documents")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="concurrent query clients")
+    parser.add_argument("--ingest-concurrency", type=int, default=4, help="concurrent uploads")
+    parser.add_argument("--queries", type=int, default=500, help="queries per concurrency level")
+    parser.add_argument("--doc-chars", type=int, default=20000, help="size of each synthetic document")
+    parser.add_argument("--limit", type=int, default=5, help="num_chunks_return of each query")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated latency per embedding call")
+    parser.add_argument("--query-cache", action="store_true", help="keep the query cache enabled")
+    parser.add_argument("--embedding-cache", action="store_true", help="keep the embedding cache enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--baseline", help="compare with the results of an earlier --json run")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(local_config(
+            directory,
+            FAKE_EMBEDDING_LATENCY_MS=args.embed_latency_ms,
+            EMBEDDING_CACHE_ENABLED=args.embedding_cache,
+            QUERY_CACHE_ENABLED=args.query_cache,
+            LOG_LEVEL=args.log_level,
+        ))
+        client = Client("")
+        corpus = []
+        try:
+            with Server(app) as server:
+                client.url = server.url
+                print(f"cpus: {os.cpu_count()}  serving on {server.url}")
+                for size in sorted(args.corpus):
+                    if size > len(corpus):
+                        results.append(ingest(client, corpus, size, args.ingest_concurrency, args.doc_chars, args.seed))
+                        print_row(results[-1])
+                    for concurrency in args.concurrency:
+                        results.append(query_load(client, corpus, concurrency, args.queries, args.limit, args.seed))
+                        print_row(results[-1])
+        finally:
+            app.extensions["services"].close()
+
+    report = {
+        "commit": git_commit(),
+        "cpus": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("json", "baseline")},
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
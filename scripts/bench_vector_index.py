@@ -0,0 +1,334 @@
+# ./scripts/bench_vector_index.py
+"""Recall / latency / memory benchmark of vector index settings for the chunk collection.
+
+Loads a set of vectors, holds out --queries of them as queries and finds the exact top --k of each by
+brute force. Then, for every combination of settings, it measures recall@k, query latency and the
+memory the index needs (estimated with Weaviate's sizing rules):
+
+    weaviate  with --weaviate-url, e.g. a local instance started with
+                  docker run -p 8080:8080 -p 50051:50051 cr.weaviate.io/semitechnologies/weaviate
+              one throwaway collection per --max-connections / --ef-construction / --quantization
+              combination, built with the same settings code as the service, then queried at every
+              --ef and --rescore (both changed in place, as the service does)
+    stand-in  without --weaviate-url, a NumPy model of each quantizer: the compressed codes are scanned
+              exhaustively and the best --rescore candidates are rescored with the full vectors. This
+              isolates the recall lost to compression; graph settings (ef, max connections) need Weaviate.
+              Latencies are NumPy scan times, only comparable with each other.
+
+Vectors come from --source: 'cache' (the embedding cache, i.e. real chunk embeddings), 'local' (the
+partitions under LOCAL_VECTOR_STORE_PATH) or 'synthetic' (clustered unit vectors).
+
+    python -m scripts.bench_vector_index --source cache --quantization none sq rq bq pq --json vindex.json
+    python -m scripts.bench_vector_index --weaviate-url http://localhost:8080 --ef 64 128 256 --max-connections 16 32
+"""
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlparse
+
+import numpy as np
+
+from scripts.bench_service import git_commit, latency_summary
+from source.services.weaviate_service import VECTOR_NAME, vector_index_config, vector_index_update
+from source.utils.config import Config
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def load_vectors(source: str, rows: int, dims: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if source == "synthetic":
+        clusters = max(1, int(np.sqrt(rows)))
+        centers = rng.standard_normal((clusters, dims))
+        points = centers[rng.integers(clusters, size=rows)] + 0.8 * rng.standard_normal((rows, dims))
+        return normalize(points)
+    if source == "cache":
+        conn = sqlite3.connect(Config.EMBEDDING_CACHE_PATH)
+        blobs = [blob for (blob,) in conn.execute("SELECT vector FROM embeddings")]
+        conn.close()
+        if not blobs:
+            raise SystemExit(f"no embeddings in {Config.EMBEDDING_CACHE_PATH}")
+        # The cache may hold several models; keep the most common dimension.
+        size = Counter(len(blob) for blob in blobs).most_common(1)[0][0]
+        vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for blob in blobs if len(blob) == size])
+    elif source == "local":
+        parts = []
+        for current in glob.glob(os.path.join(Config.LOCAL_VECTOR_STORE_PATH, "*", "CURRENT")):
+            with open(current) as f:
+                state = json.load(f)
+            path = os.path.join(os.path.dirname(current), f"vectors-{state['generation']}.f32")
+            parts.append(np.fromfile(path, dtype=np.float32).reshape(-1, state["dim"]))
+        if not parts:
+            raise SystemExit(f"no partitions under {Config.LOCAL_VECTOR_STORE_PATH}")
+        size = Counter(part.shape[1] for part in parts).most_common(1)[0][0]
+        vectors = np.concatenate([part for part in parts if part.shape[1] == size])
+    else:
+        raise SystemExit(f"unknown --source {source}")
+    if len(vectors) > rows:
+        vectors = vectors[np.sort(rng.choice(len(vectors), size=rows, replace=False))]
+    return normalize(vectors)
+
+
+def exact_top(base: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ base.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+
+def recall(found: list, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(hits) & set(expected)) / len(expected) for hits, expected in zip(found, truth)]))
+
+
+def pq_segments(dims: int, configured: int) -> int:
+    """WEAVIATE_PQ_SEGMENTS, or about what Weaviate picks (a sixth of the dimensions, as a divisor)."""
+    segments = configured or max(1, dims // 6)
+    while dims % segments:
+        segments -= 1
+    return segments
+
+
+def estimated_memory(rows: int, dims: int, quantization: str, max_connections: int, segments: int) -> dict:
+    """Memory the index keeps resident, following Weaviate's sizing guide: the vector cache holds the
+    float32 vectors, or with a quantizer only the codes (full vectors stay on disk for rescoring), and
+    the HNSW graph keeps about 2 * maxConnections 8-byte neighbour ids per object on its base layer."""
+    code_bytes = {"none": 4 * dims, "sq": dims, "rq": dims + 8, "bq": dims / 8, "pq": segments}[quantization]
+    vectors = rows * code_bytes / 2 ** 20
+    graph = rows * max_connections * 2 * 8 / 2 ** 20
+    return {"vectors_mb": round(vectors, 1), "graph_mb": round(graph, 1), "memory_mb": round(vectors + graph, 1)}
+
+
+class StandIn:
+    """Exhaustive search over one quantizer's codes, then exact rescoring of the best candidates."""
+
+    def __init__(self, base: np.ndarray, quantization: str, segments: int, training_limit: int, seed: int):
+        self.base = base
+        self.kind = quantization
+        rng = np.random.default_rng(seed)
+        training = base[rng.choice(len(base), size=min(len(base), training_limit or len(base), 20000), replace=False)]
+        if quantization == "sq":
+            # One 8-bit scale per dimension, trained on a sample.
+            self.low = training.min(axis=0)
+            self.step = (training.max(axis=0) - self.low) / 255 + 1e-12
+            self.codes = np.clip(np.rint((base - self.low) / self.step), 0, 255).astype(np.float32)
+        elif quantization == "rq":
+            # A random rotation spreads the signal over all dimensions, then 8 bits per value with a per-vector range.
+            self.rotation = np.linalg.qr(rng.standard_normal((base.shape[1], base.shape[1])))[0].astype(np.float32)
+            rotated = base @ self.rotation
+            self.low = rotated.min(axis=1, keepdims=True)
+            self.step = (rotated.max(axis=1, keepdims=True) - self.low) / 255 + 1e-12
+            self.codes = np.rint((rotated - self.low) / self.step).astype(np.float32)
+        elif quantization == "bq":
+            self.codes = np.packbits(base > 0, axis=1)
+        elif quantization == "pq":
+            self.segments = segments
+            self.width = base.shape[1] // segments
+            self.centroids = [self._kmeans(training[:, s * self.width:(s + 1) * self.width], rng) for s in range(segments)]
+            self.codes = np.stack([
+                np.argmax(base[:, s * self.width:(s + 1) * self.width] @ self.centroids[s].T
+                          - 0.5 * (self.centroids[s] ** 2).sum(axis=1), axis=1)
+                for s in range(segments)
+            ], axis=1)
+
+    @staticmethod
+    def _kmeans(sample: np.ndarray, rng, centroids: int = 256, iterations: int = 6) -> np.ndarray:
+        centers = sample[rng.choice(len(sample), size=min(centroids, len(sample)), replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centers.T - 0.5 * (centers ** 2).sum(axis=1), axis=1)
+            sums = np.zeros_like(centers)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=len(centers))
+            filled = counts > 0
+            centers[filled] = sums[filled] / counts[filled, None]
+        return centers
+
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        if self.kind == "none":
+            return self.base @ query
+        if self.kind == "sq":
+            scaled = self.step * query
+            return self.codes @ scaled + float(self.low @ query)
+        if self.kind == "rq":
+            rotated = query @ self.rotation
+            return (self.codes @ rotated) * self.step[:, 0] + self.low[:, 0] * rotated.sum()
+        if self.kind == "bq":
+            return -_POPCOUNT[np.bitwise_xor(self.codes, np.packbits(query > 0))].sum(axis=1)
+        tables = np.stack([self.centroids[s] @ query[s * self.width:(s + 1) * self.width] for s in range(self.segments)])
+        return tables[np.arange(self.segments), self.codes].sum(axis=1)
+
+    def search(self, query: np.ndarray, k: int, rescore: int) -> list:
+        scores = self._scores(query)
+        depth = min(len(scores), k if self.kind == "none" else max(k, rescore))
+        candidates = np.argpartition(-scores, depth - 1)[:depth]
+        if self.kind != "none":
+            candidates = candidates[np.argsort(-(self.base[candidates] @ query))][:k]
+        return candidates[:k].tolist()
+
+
+def run_stand_in(base, queries, truth, args) -> list:
+    results = []
+    dims = base.shape[1]
+    for quantization in args.quantization:
+        segments = pq_segments(dims, Config.WEAVIATE_PQ_SEGMENTS)
+        start = time.perf_counter()
+        index = StandIn(base, quantization, segments, Config.WEAVIATE_QUANTIZATION_TRAINING_LIMIT, args.seed)
+        build = time.perf_counter() - start
+        for rescore in (args.rescore if quantization != "none" else [None]):
+            found, seconds = [], []
+            for query in queries:
+                start = time.perf_counter()
+                found.append(index.search(query, args.k, rescore or 0))
+                seconds.append(time.perf_counter() - start)
+            results.append({
+                "backend": "stand-in", "quantization": quantization, "rescore": rescore,
+                "max_connections": None, "ef_construction": None, "ef": None,
+                "build_s": round(build, 2), "recall": round(recall(found, truth), 4),
+                **latency_summary(seconds),
+                **estimated_memory(len(base), dims, quantization, Config.WEAVIATE_HNSW_MAX_CONNECTIONS, segments),
+            })
+            print_row(results[-1])
+    return results
+
+
+def wait_indexed(client, name: str, compressed: bool, timeout: float = 600) -> bool:
+    """Waits until every shard of `name` has indexed its queue (and compressed, with a quantizer)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        shards = [shard for node in client.cluster.nodes(collection=name, output="verbose") for shard in node.shards or []]
+        if shards and all(shard.vector_indexing_status == "READY" and shard.vector_queue_length == 0
+                          and (shard.compressed or not compressed) for shard in shards):
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def run_weaviate(base, queries, truth, args) -> list:
+    import weaviate
+    from weaviate.classes.config import Configure, Reconfigure
+    from weaviate.classes.data import DataObject
+
+    url = urlparse(args.weaviate_url)
+    client = weaviate.connect_to_local(host=url.hostname, port=url.port or 8080, grpc_port=args.grpc_port)
+    results = []
+    dims = base.shape[1]
+    try:
+        for max_connections in args.max_connections:
+            for ef_construction in args.ef_construction:
+                for quantization in args.quantization:
+                    settings = {
+                        "WEAVIATE_HNSW_MAX_CONNECTIONS": max_connections,
+                        "WEAVIATE_HNSW_EF_CONSTRUCTION": ef_construction,
+                        "WEAVIATE_QUANTIZATION": quantization,
+                        # Train on what there is, so small benchmark sets still get compressed.
+                        "WEAVIATE_QUANTIZATION_TRAINING_LIMIT": min(Config.WEAVIATE_QUANTIZATION_TRAINING_LIMIT, len(base)),
+                    }
+                    config = type("BenchConfig", (Config,), settings)
+                    name = f"BenchIndex_{uuid.uuid4().hex[:8]}"
+                    client.collections.create(name=name, vectorizer_config=[
+                        Configure.NamedVectors.none(name=VECTOR_NAME, vector_index_config=vector_index_config(config))
+                    ])
+                    collection = client.collections.get(name)
+                    try:
+                        start = time.perf_counter()
+                        for offset in range(0, len(base), 1000):
+                            response = collection.data.insert_many([
+                                DataObject(properties={}, vector={VECTOR_NAME: vector.tolist()}, uuid=uuid.UUID(int=offset + i + 1))
+                                for i, vector in enumerate(base[offset:offset + 1000])
+                            ])
+                            if response.errors:
+                                raise SystemExit(f"insert failed: {next(iter(response.errors.values())).message}")
+                        compressed = wait_indexed(client, name, compressed=quantization != "none")
+                        build = time.perf_counter() - start
+                        for ef in args.ef:
+                            for rescore in (args.rescore if quantization in ("bq", "sq", "rq") else [None]):
+                                changes = {"ef": ef}
+                                tuned = type("BenchConfig", (config,), {"WEAVIATE_HNSW_EF": ef, "WEAVIATE_QUANTIZATION_RESCORE_LIMIT": rescore or 0})
+                                if rescore:
+                                    changes["quantizer"] = quantization
+                                collection.config.update(vectorizer_config=[
+                                    Reconfigure.NamedVectors.update(name=VECTOR_NAME, vector_index_config=vector_index_update(tuned, changes))
+                                ])
+                                found, seconds = [], []
+                                for query in queries:
+                                    start = time.perf_counter()
+                                    response = collection.query.near_vector(
+                                        near_vector=query.tolist(), target_vector=VECTOR_NAME, limit=args.k, return_properties=[]
+                                    )
+                                    seconds.append(time.perf_counter() - start)
+                                    found.append([obj.uuid.int - 1 for obj in response.objects])
+                                results.append({
+                                    "backend": "weaviate", "quantization": quantization, "rescore": rescore,
+                                    "max_connections": max_connections, "ef_construction": ef_construction, "ef": ef,
+                                    "build_s": round(build, 2), "compressed": compressed,
+                                    "recall": round(recall(found, truth), 4),
+                                    **latency_summary(seconds),
+                                    **estimated_memory(len(base), dims, quantization, max_connections,
+                                                       pq_segments(dims, Config.WEAVIATE_PQ_SEGMENTS)),
+                                })
+                                print_row(results[-1])
+                    finally:
+                        client.collections.delete(name)
+    finally:
+        client.close()
+    return results
+
+
+def print_row(row: dict):
+    graph = "" if row["ef"] is None else f"M={row['max_connections']:<3} efC={row['ef_construction']:<4} ef={row['ef']:<4} "
+    rescore = f"rescore={row['rescore']:<4} " if row["rescore"] else " " * 13
+    print(f"  {row['backend']:<8} {row['quantization']:<4} {graph}{rescore} recall {row['recall']:.4f}  "
+          f"p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  memory {row['memory_mb']} MB "
+          f"(vectors {row['vectors_mb']}, graph {row['graph_mb']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", choices=["cache", "local", "synthetic"], default="synthetic")
+    parser.add_argument("--rows", type=int, default=20000, help="vectors indexed (sampled if the source has more)")
+    parser.add_argument("--dims", type=int, default=Config.EMBEDDING_DIMENSIONS, help="dimensions of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200, help="held-out vectors used as queries")
+    parser.add_argument("-k", type=int, default=10, help="neighbours per query (recall@k)")
+    parser.add_argument("--quantization", nargs="+", default=["none", "sq", "rq", "bq", "pq"])
+    parser.add_argument("--rescore", type=int, nargs="+", default=[50, 200], help="candidates rescored with full vectors")
+    parser.add_argument("--ef", type=int, nargs="+", default=[64, 128, 256], help="weaviate: query-time ef")
+    parser.add_argument("--max-connections", type=int, nargs="+", default=[Config.WEAVIATE_HNSW_MAX_CONNECTIONS])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[Config.WEAVIATE_HNSW_EF_CONSTRUCTION])
+    parser.add_argument("--weaviate-url", help="benchmark a local Weaviate instead of the NumPy stand-in")
+    parser.add_argument("--grpc-port", type=int, default=50051)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.source, args.rows + args.queries, args.dims, args.seed)
+    rng = np.random.default_rng(args.seed)
+    held_out = np.zeros(len(vectors), dtype=bool)
+    held_out[rng.choice(len(vectors), size=min(args.queries, len(vectors) // 10), replace=False)] = True
+    base, queries = vectors[~held_out], vectors[held_out]
+    truth = exact_top(base, queries, args.k)
+    print(f"{args.source}: {len(base)} vectors of {base.shape[1]} dims, {len(queries)} queries, recall@{args.k}")
+
+    run = run_weaviate if args.weaviate_url else run_stand_in
+    results = run(base, queries, truth, args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "settings": {key: value for key, value in vars(args).items() if key != "json"},
+                "rows": len(base),
+                "dims": int(base.shape[1]),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+# ./scripts/bulk_ingest.py
+"""Offline bulk loader: ingests a directory tree through DocumentService, without the HTTP API.
+
+Files go through four pipelined stages connected by bounded queues, each with its own workers:
+
+    parse   parse_file in a process pool (PDF/DOCX to markdown, text and JSON read as is)
+    chunk   chunk_content, split into windows of STREAM_WINDOW_CHUNKS chunks
+    embed   one generate_embeddings call per window
+    write   index_document per window into the configured vector store
+
+Progress is checkpointed per file in a SQLite table, so after a crash or Ctrl-C a rerun skips
+finished files, replaces partially written ones and retries failed ones. Document ids are derived
+from the file path, so a file that changed since it was loaded replaces its old document. A live
+report shows docs/sec, chunks/sec and the busy share of every stage's workers.
+
+    python -m scripts.bulk_ingest archive/ --parse-workers 4 --embed-workers 4 --write-workers 2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+from source.models import Document
+from source.services.container import create_vector_store
+from source.services.document_service import DocumentService, split_hierarchy
+from source.services.embedding_service import EmbeddingService
+from source.utils.config import Config
+from source.utils.hashing import chunk_identities
+
+CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".txt": "text/plain",
+    ".json": "application/json",
+}
+CHECKPOINT_FILE = os.path.join("data", "bulk_ingest.sqlite3")
+_DONE = object()  # end-of-stream marker passed down the queues
+
+
+def parse_in_worker(file_path, content_type, config_values):
+    """Runs in the parse process pool; `config_values` are the upper-case Config attributes."""
+    return DocumentService(None, None, SimpleNamespace(**config_values)).parse_file(file_path, content_type)
+
+
+class Checkpoint:
+    """Per-file ingest state in SQLite (WAL): pending files are 'started', then 'done' or 'failed'."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, document_id TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " status TEXT NOT NULL, chunks INTEGER NOT NULL DEFAULT 0, error TEXT, updated_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self):
+        """Returns {path: (size, mtime_ns, status)} for every file seen by earlier runs."""
+        rows = self._connection().execute("SELECT path, size, mtime_ns, status FROM files")
+        return {path: (size, mtime_ns, status) for path, size, mtime_ns, status in rows}
+
+    def mark(self, doc, status, error=None):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO files (path, document_id, size, mtime_ns, status, chunks, error, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (doc.path, doc.document_id, doc.size, doc.mtime_ns, status, doc.chunks, error, time.time()),
+        )
+        conn.commit()
+
+
+class BulkDocument:
+    """A file on its way through the pipeline; its windows are written independently."""
+
+    def __init__(self, path, content_type, size, mtime_ns, replace):
+        self.path = path
+        self.content_type = content_type
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.replace = replace  # an earlier run may have written (part of) this document
+        self.document_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"bulk-ingest:{path}"))
+        self.text = None
+        self.chunks = 0
+        self.windows = 0
+        self.windows_written = 0
+        self.failed = False
+
+
+class Stage:
+    """`workers` threads that apply `fn` to items from `inbox` and put its results on `outbox` (if any).
+
+    Busy time covers `fn` only, not waiting on either queue, so busy / (workers * wall time) is the
+    stage's utilization: a stage near 100% with a full inbox is the bottleneck.
+    """
+
+    def __init__(self, name, fn, workers, inbox, outbox, on_error, stop):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_error = on_error
+        self.stop = stop
+        self.busy = 0.0
+        self.items = 0
+        self._running = {}  # worker thread -> start of its current item
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def finish(self):
+        """Waits for the inbox to drain, then hands one end marker per worker to the next stage."""
+        for _ in self._threads:
+            self.inbox.put(_DONE)
+        for thread in self._threads:
+            thread.join()
+
+    def busy_time(self):
+        """Seconds spent in `fn` so far, including the items being worked on right now."""
+        now = time.perf_counter()
+        with self._lock:
+            return self.busy + sum(now - started for started in self._running.values())
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                return
+            if self.stop.is_set():
+                continue  # drain without working so upstream puts never block
+            worker = threading.get_ident()
+            with self._lock:
+                self._running[worker] = time.perf_counter()
+            try:
+                results = self.fn(item)
+            except Exception as e:
+                self.on_error(item, e)
+                results = ()
+            with self._lock:
+                self.busy += time.perf_counter() - self._running.pop(worker)
+                self.items += 1
+            for result in results:
+                self.outbox.put(result)
+
+
+class BulkIngest:
+    def __init__(self, config, root, checkpoint, args):
+        self.config = config
+        self.root = os.path.abspath(root)
+        self.checkpoint = checkpoint
+        self.metadata = args.metadata
+        self.stop = threading.Event()
+        self.embedding_service = EmbeddingService(use_gemini=True, model_name=config.HUGGINGFACE_MODEL_NAME, config=config)
+        self.vector_store = create_vector_store(config)
+        self.document_service = DocumentService(self.embedding_service, self.vector_store, config)
+        self._worker_config = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+        self._parse_pool = ProcessPoolExecutor(max_workers=args.parse_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self.counts = {"found": 0, "skipped": 0, "done": 0, "failed": 0, "chunks": 0}
+        self._reporting = threading.Event()
+
+        queues = [queue.Queue(maxsize=args.queue_size) for _ in range(4)]
+        self.stages = [
+            Stage("parse", self._parse, args.parse_workers, queues[0], queues[1], self._fail, self.stop),
+            Stage("chunk", self._chunk, args.chunk_workers, queues[1], queues[2], self._fail, self.stop),
+            Stage("embed", self._embed, args.embed_workers, queues[2], queues[3], self._fail, self.stop),
+            Stage("write", self._write, args.write_workers, queues[3], None, self._fail, self.stop),
+        ]
+
+    # --- stages ---
+
+    def _parse(self, doc):
+        doc.text = self._parse_pool.submit(parse_in_worker, doc.path, doc.content_type, self._worker_config).result()
+        return [doc]
+
+    def _chunk(self, doc):
+        chunks = self.document_service.chunk_content(doc.text, doc.content_type)
+        doc.text = None
+        texts, paths = split_hierarchy(chunks)
+        doc.chunks = len(texts)
+        if doc.replace:
+            self.vector_store.delete_document(doc.document_id)
+        if not texts:
+            self._completed(doc)
+            return []
+        identities = chunk_identities(doc.document_id, texts)
+        size = self.config.STREAM_WINDOW_CHUNKS
+        doc.windows = (len(texts) + size - 1) // size
+        self.checkpoint.mark(doc, "started")
+        return [
+            (doc, start, texts[start:start + size], paths[start:start + size] if paths else None, identities[start:start + size])
+            for start in range(0, len(texts), size)
+        ]
+
+    def _embed(self, window):
+        doc, start, texts, paths, identities = window
+        if doc.failed:
+            return []
+        return [(doc, start, texts, paths, identities, self.embedding_service.generate_embeddings(texts, priority="backfill"))]
+
+    def _write(self, window):
+        doc, start, texts, paths, identities, embeddings = window
+        if doc.failed:
+            return []
+        document = Document(id=doc.document_id, filename=os.path.basename(doc.path), content=texts,
+                            content_type=doc.content_type, metadata=self.metadata or {}, hierarchy_paths=paths)
+        self.vector_store.index_document(document, embeddings, start_index=start, identities=identities)
+        with self._lock:
+            self.counts["chunks"] += len(texts)
+            doc.windows_written += 1
+            finished = doc.windows_written == doc.windows
+        if finished:
+            self._completed(doc)
+        return []
+
+    # --- bookkeeping ---
+
+    def _completed(self, doc):
+        self.checkpoint.mark(doc, "done")
+        with self._lock:
+            self.counts["done"] += 1
+
+    def _fail(self, item, error):
+        doc = item if isinstance(item, BulkDocument) else item[0]
+        with self._lock:
+            if doc.failed:
+                return
+            doc.failed = True
+            self.counts["failed"] += 1
+        print(f"failed {os.path.relpath(doc.path, self.root)}: {error}")
+        try:
+            self.vector_store.delete_document(doc.document_id)
+        except Exception as e:
+            print(f"could not remove partial document {doc.document_id}: {e}")
+        self.checkpoint.mark(doc, "failed", error=str(error))
+
+    def walk(self):
+        """Yields the files under root that are new, changed or unfinished according to the checkpoint."""
+        seen = self.checkpoint.load()
+        for directory, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                content_type = CONTENT_TYPES.get(os.path.splitext(name)[1].lower())
+                if content_type is None or name.startswith("."):
+                    continue
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                previous = seen.get(path)
+                self.counts["found"] += 1
+                if previous == (stat.st_size, stat.st_mtime_ns, "done"):
+                    self.counts["skipped"] += 1
+                    continue
+                yield BulkDocument(path, content_type, stat.st_size, stat.st_mtime_ns, replace=previous is not None)
+
+    # --- driver ---
+
+    def run(self, report_interval):
+        reporter = threading.Thread(target=self._report_loop, args=(report_interval,), daemon=True)
+        self.started = time.perf_counter()
+        for stage in self.stages:
+            stage.start()
+        reporter.start()
+        try:
+            for doc in self.walk():
+                if self.stop.is_set():
+                    break
+                self.stages[0].inbox.put(doc)
+        except KeyboardInterrupt:
+            print("interrupted, skipping the files in flight; rerun to resume")
+            self.stop.set()
+        for stage in self.stages:
+            stage.finish()
+        self._reporting.set()
+        reporter.join()
+        self._parse_pool.shutdown(wait=True, cancel_futures=True)
+        self.vector_store.close()
+        self.embedding_service.close()
+        return self.summary()
+
+    def _report_loop(self, interval):
+        last_time, last = time.perf_counter(), self._snapshot()
+        while not self._reporting.wait(interval):
+            now, current = time.perf_counter(), self._snapshot()
+            elapsed = now - last_time
+            stages = " | ".join(
+                f"{stage.name} {stage.workers}x {100 * (current['busy'][i] - last['busy'][i]) / (stage.workers * elapsed):3.0f}%"
+                f" q{stage.inbox.qsize()}"
+                for i, stage in enumerate(self.stages)
+            )
+            print(f"[{now - self.started:7.1f}s] docs {current['done']} ({(current['done'] - last['done']) / elapsed:.1f}/s)"
+                  f" chunks {current['chunks']} ({(current['chunks'] - last['chunks']) / elapsed:.0f}/s)"
+                  f" failed {current['failed']} | {stages}", flush=True)
+            last_time, last = now, current
+
+    def _snapshot(self):
+        with self._lock:
+            snapshot = dict(self.counts)
+        snapshot["busy"] = [stage.busy_time() for stage in self.stages]
+        return snapshot
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        utilization = {stage.name: round(stage.busy / (stage.workers * elapsed), 3) for stage in self.stages}
+        return {
+            **self.counts,
+            "seconds": round(elapsed, 2),
+            "docs_per_s": round(self.counts["done"] / elapsed, 2),
+            "chunks_per_s": round(self.counts["chunks"] / elapsed, 1),
+            "workers": {stage.name: stage.workers for stage in self.stages},
+            "utilization": utilization,
+            "bottleneck": max(utilization, key=utilization.get),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="directory to ingest (walked recursively)")
+    parser.add_argument("--parse-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--chunk-workers", type=int, default=1)
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--write-workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=16, help="items buffered between two stages")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="SQLite file with per-file progress")
+    parser.add_argument("--metadata", type=json.loads, help="JSON metadata stored with every document")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="seconds between progress lines")
+    parser.add_argument("--json", help="also write the final summary to this file")
+    args = parser.parse_args()
+
+    ingest = BulkIngest(Config(), args.root, Checkpoint(args.checkpoint), args)
+    summary = ingest.run(args.report_interval)
+    print(json.dumps(summary, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
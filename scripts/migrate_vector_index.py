@@ -0,0 +1,186 @@
+# ./scripts/migrate_vector_index.py
+"""Brings the vector index of the Weaviate chunk collection in line with the WEAVIATE_HNSW_* and
+WEAVIATE_QUANTIZATION* settings.
+
+Without --rebuild it prints the live settings next to the configured ones and applies the changes
+Weaviate makes in place (ef, dynamic ef, flat-search cutoff, turning on a quantizer, rescore limits);
+the service does the same when it starts. Max connections, ef construction and switching or removing a
+quantizer are fixed when a collection is created and need a rebuild:
+
+    python -m scripts.migrate_vector_index --dry-run
+    python -m scripts.migrate_vector_index --rebuild Document_v2
+    python -m scripts.migrate_vector_index --rebuild Document_v2 --switch
+
+--rebuild creates the named collection with the configured settings and copies every object with its
+vector. Object ids are kept, so rerunning an interrupted copy overwrites what was already copied. Pause
+uploads while it runs: documents written or deleted meanwhile are not carried over. Afterwards either
+set WEAVIATE_COLLECTION to the new name and restart, or pass --switch to point the alias named
+WEAVIATE_COLLECTION at it (Weaviate 1.32+). While WEAVIATE_COLLECTION is still a plain collection,
+--switch also needs --drop-old: the old collection is deleted and an alias takes its name, so queries
+fail for the moment in between.
+
+WEAVIATE_MULTI_TENANCY is fixed at creation as well; a rebuild reads every tenant of the old collection
+and writes each object into its document's tenant of the new one (or the other way around).
+"""
+import argparse
+import sys
+import time
+
+import weaviate
+from weaviate.classes.config import Reconfigure
+from weaviate.classes.data import DataObject
+
+from source.services.weaviate_service import (
+    FIXED_HNSW_SETTINGS, MUTABLE_HNSW_SETTINGS, VECTOR_NAME, WeaviateService, quantizer_kind, vector_index_changes,
+    vector_index_update,
+)
+from source.utils.config import Config
+from source.utils.hashing import partition_name
+
+
+def resolve(client, name: str) -> tuple:
+    """(collection name, whether `name` is an alias)."""
+    try:
+        alias = client.alias.get(alias_name=name)
+    except Exception:
+        # Weaviate before 1.32 has no aliases.
+        alias = None
+    return (alias.collection, True) if alias is not None else (name, False)
+
+
+def partitions(collection) -> list:
+    """The collection itself, or each of its tenants when it is multi-tenant."""
+    if not collection.config.get().multi_tenancy_config.enabled:
+        return [collection]
+    return [collection.with_tenant(tenant) for tenant in collection.tenants.get()]
+
+
+def describe(config: Config, schema):
+    index_config = schema.vector_config[VECTOR_NAME].vector_index_config
+    changes, fixed = vector_index_changes(config, index_config)
+    if schema.multi_tenancy_config.enabled != config.WEAVIATE_MULTI_TENANCY:
+        fixed.append("WEAVIATE_MULTI_TENANCY")
+    print(f"  {'setting':<34} {'live':>10} {'configured':>10}")
+    for field, attribute in {**MUTABLE_HNSW_SETTINGS, **FIXED_HNSW_SETTINGS}.items():
+        mark = "  (rebuild)" if attribute in fixed else ("  (in place)" if field in changes else "")
+        print(f"  {attribute:<34} {getattr(index_config, field):>10} {getattr(config, attribute):>10}{mark}")
+    mark = "  (rebuild)" if "WEAVIATE_QUANTIZATION" in fixed else ("  (in place)" if "quantizer" in changes else "")
+    print(f"  {'WEAVIATE_QUANTIZATION':<34} {quantizer_kind(index_config):>10} {config.WEAVIATE_QUANTIZATION:>10}{mark}")
+    rescore = getattr(index_config.quantizer, "rescore_limit", None)
+    if rescore is not None:
+        print(f"  {'WEAVIATE_QUANTIZATION_RESCORE_LIMIT':<34} {rescore:>10} {config.WEAVIATE_QUANTIZATION_RESCORE_LIMIT:>10}")
+    mark = "  (rebuild)" if "WEAVIATE_MULTI_TENANCY" in fixed else ""
+    print(f"  {'WEAVIATE_MULTI_TENANCY':<34} {str(schema.multi_tenancy_config.enabled):>10} "
+          f"{str(config.WEAVIATE_MULTI_TENANCY):>10}{mark}")
+    return changes, fixed
+
+
+def copy_objects(source, target, batch_size: int) -> int:
+    """Copies every object of `source` with its properties, vector and id into `target`, into the tenant of
+    its document when `target` is multi-tenant (the target creates tenants on first write)."""
+    multi_tenant = target.config.get().multi_tenancy_config.enabled
+    copied = 0
+    batches = {}
+    started = time.perf_counter()
+
+    def flush(tenant):
+        response = (target.with_tenant(tenant) if multi_tenant else target).data.insert_many(batches.pop(tenant))
+        if response.errors:
+            first = next(iter(response.errors.values())).message
+            raise RuntimeError(f"{len(response.errors)} object(s) failed to copy, e.g. {first}; rerun to resume")
+
+    def flush_all() -> int:
+        flushed = 0
+        for tenant in list(batches):
+            flushed += len(batches[tenant])
+            flush(tenant)
+        return flushed
+
+    for partition in partitions(source):
+        for obj in partition.iterator(include_vector=True):
+            tenant = partition_name(obj.properties["original_document_id"]) if multi_tenant else None
+            batch = batches.setdefault(tenant, [])
+            batch.append(DataObject(properties=obj.properties, vector={VECTOR_NAME: obj.vector[VECTOR_NAME]}, uuid=obj.uuid))
+            if len(batch) == batch_size:
+                flush(tenant)
+                copied += batch_size
+                if copied % (batch_size * 50) == 0:
+                    print(f"  copied {copied} objects ({copied / (time.perf_counter() - started):.0f}/s)")
+            elif sum(map(len, batches.values())) >= batch_size * 10:
+                # Spread over many documents: write the partial batches rather than hold them all.
+                copied += flush_all()
+        copied += flush_all()
+    return copied
+
+
+def count(collection) -> int:
+    return sum(partition.aggregate.over_all(total_count=True).total_count for partition in partitions(collection))
+
+
+def switch(client, name: str, target: str, is_alias: bool, drop_old: bool):
+    if is_alias:
+        client.alias.update(alias_name=name, new_target_collection=target)
+        print(f"alias {name} now points to {target}")
+    elif drop_old:
+        client.collections.delete(name)
+        client.alias.create(alias_name=name, target_collection=target)
+        print(f"deleted collection {name}; alias {name} now points to {target}")
+    else:
+        sys.exit(f"{name} is a collection, not an alias: pass --drop-old to replace it with an alias, "
+                 f"or set WEAVIATE_COLLECTION={target} and restart")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only show what differs")
+    parser.add_argument("--rebuild", metavar="COLLECTION", help="copy into a new collection built with the configured settings")
+    parser.add_argument("--switch", action="store_true", help="after --rebuild, point the WEAVIATE_COLLECTION alias at it")
+    parser.add_argument("--drop-old", action="store_true", help="with --switch: delete the old collection to free its name")
+    args = parser.parse_args()
+    if args.switch and not args.rebuild:
+        parser.error("--switch needs --rebuild")
+
+    config = Config()
+    client = weaviate.connect_to_weaviate_cloud(**WeaviateService._connection_args(config))
+    try:
+        name, is_alias = resolve(client, config.WEAVIATE_COLLECTION)
+        if not client.collections.exists(name):
+            sys.exit(f"collection {name} does not exist; the service creates it with the configured settings")
+        collection = client.collections.get(name)
+        print(f"{config.WEAVIATE_COLLECTION}" + (f" (alias of {name})" if is_alias else "") + f": {count(collection)} objects")
+        changes, fixed = describe(config, collection.config.get())
+        if args.dry_run:
+            return
+
+        if not args.rebuild:
+            if changes:
+                collection.config.update(vectorizer_config=[
+                    Reconfigure.NamedVectors.update(name=VECTOR_NAME, vector_index_config=vector_index_update(config, changes))
+                ])
+                print(f"updated in place: {', '.join(changes)}")
+            if fixed:
+                print(f"{', '.join(fixed)} need --rebuild")
+            return
+
+        if args.rebuild == name:
+            sys.exit("--rebuild needs a new collection name")
+        if client.collections.exists(args.rebuild):
+            print(f"{args.rebuild} exists, resuming the copy into it")
+        else:
+            client.collections.create(name=args.rebuild, **WeaviateService._collection_args(config))
+        target = client.collections.get(args.rebuild)
+        copied = copy_objects(collection, target, config.WEAVIATE_BATCH_SIZE)
+        source_count, target_count = count(collection), count(target)
+        print(f"copied {copied} objects; {name} has {source_count}, {args.rebuild} has {target_count}")
+        if target_count != source_count:
+            sys.exit("object counts differ (were documents written during the copy?); rerun before switching")
+        if args.switch:
+            switch(client, config.WEAVIATE_COLLECTION, args.rebuild, is_alias, args.drop_old)
+        else:
+            print(f"set WEAVIATE_COLLECTION={args.rebuild} (or rerun with --switch) to serve from it")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
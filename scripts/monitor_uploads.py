@@ -1,63 +1,58 @@
 # ./scripts/monitor_uploads.py
-import time
-import os
+"""Watches data/uploads and uploads (or updates) every file dropped there, then moves it to data/processed.
+
+Files are picked up from watchdog create/modify/move events and from a rescan at startup, so files
+dropped while the monitor was down are not missed. A file is only processed once its size and mtime
+have stopped changing for --stable-seconds, then a worker pool hashes and posts it over one pooled
+keep-alive HTTP session. When the server queues the upload as a background job (202), the worker
+polls the job until it finishes, so a file is only marked processed once it is indexed. Which file name was indexed with which content hash and document id is
+kept in a SQLite (WAL) index; an unchanged file is skipped, a changed one is sent as an update.
+
+    python scripts/monitor_uploads.py --workers 8 --stable-seconds 2
+"""
+import argparse
 import hashlib
 import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler, FileCreatedEvent
-import uuid  # Import the uuid module
-
 
-BASE_URL = "http://127.0.0.1:5000"  # Or your deployed URL
+BASE_URL = os.environ.get("MONITOR_BASE_URL", "http://127.0.0.1:5000")  # Or your deployed URL
 UPLOAD_FOLDER = "data/uploads"
 PROCESSED_FOLDER = "data/processed"
-METADATA_FILE = os.path.join(PROCESSED_FOLDER, "processed_files.json")
+INDEX_FILE = os.path.join(PROCESSED_FOLDER, "processed_files.sqlite3")
+LEGACY_METADATA_FILE = os.path.join(PROCESSED_FOLDER, "processed_files.json")
+WORKERS = int(os.environ.get("MONITOR_WORKERS", 8))
+STABLE_SECONDS = float(os.environ.get("MONITOR_STABLE_SECONDS", 2.0))
+REQUEST_TIMEOUT = float(os.environ.get("MONITOR_REQUEST_TIMEOUT", 600))
+JOB_POLL_SECONDS = float(os.environ.get("MONITOR_JOB_POLL_SECONDS", 1.0))
+JOB_TIMEOUT = float(os.environ.get("MONITOR_JOB_TIMEOUT", 3600))  # how long to wait for a queued job
+# Partial downloads / editor swap files; they are picked up once renamed to their final name.
+IGNORED_SUFFIXES = (".part", ".partial", ".tmp", ".crdownload", ".swp", ".download")
+
 
 def calculate_hash(file_path):
     """Calculates the SHA256 hash of a file."""
     hasher = hashlib.sha256()
     with open(file_path, 'rb') as file:
-        while True:
-            chunk = file.read(4096)  # Read in 4KB chunks
-            if not chunk:
-                break
+        for chunk in iter(lambda: file.read(1 << 20), b""):
             hasher.update(chunk)
     return hasher.hexdigest()
 
-def load_processed_files():
-    """Loads the metadata of processed files from the JSON file."""
-    try:
-        with open(METADATA_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
-
-def save_processed_files(processed_files):
-    """Saves the metadata of processed files to the JSON file."""
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(processed_files, f, indent=4)
-
-def upload_file(file_path, content_type, metadata=None, document_id=None, action="upload"):
-    """Uploads or updates a file using the /documents endpoint."""
-    url = f"{BASE_URL}/documents"
-    files = {'file': open(file_path, 'rb')}
-    data = {
-        'action': action,
-        'content_type': content_type,
-    }
-    if metadata:
-        data['metadata'] = json.dumps(metadata)
-    if document_id:
-        data['document_id'] = document_id
-
-    response = requests.post(url, files=files, data=data)
-    files['file'].close()
-    return response
 
 def get_content_type(file_path):
     """Determines the content type based on the file extension."""
     _, ext = os.path.splitext(file_path)
+    ext = ext.lower()
     if ext == ".pdf":
         return "application/pdf"
     elif ext == ".docx":
@@ -70,91 +65,350 @@ def get_content_type(file_path):
         return "application/octet-stream"  # Default fallback
 
 
-class MyEventHandler(FileSystemEventHandler):
+def is_candidate(file_path):
+    name = os.path.basename(file_path)
+    return not name.startswith(".") and not name.lower().endswith(IGNORED_SUFFIXES)
+
+
+class ProcessedIndex:
+    """SQLite (WAL) index of processed files: file name -> content hash and document id.
+
+    Each thread gets its own connection, so workers look up and record files concurrently without
+    rewriting a shared JSON file. Entries of an old processed_files.json are imported once.
+    """
+
+    def __init__(self, path, legacy_json=None):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed ("
+            " filename TEXT PRIMARY KEY, hash TEXT NOT NULL, document_id TEXT NOT NULL, processed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS processed_hash ON processed(hash)")
+        conn.commit()
+        if legacy_json and os.path.exists(legacy_json):
+            self._import_json(legacy_json)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_json(self, legacy_json):
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM processed LIMIT 1").fetchone():
+            return
+        with open(legacy_json) as f:
+            entries = json.load(f)
+        now = time.time()
+        conn.executemany(
+            "INSERT OR IGNORE INTO processed (filename, hash, document_id, processed_at) VALUES (?, ?, ?, ?)",
+            [(e["filename"], e["hash"], e["document_id"], now) for e in entries if e.get("document_id")],
+        )
+        conn.commit()
+        print(f"Imported {len(entries)} entries from {legacy_json}")
+
+    def get(self, filename):
+        """Returns (hash, document_id) recorded for `filename`, or None."""
+        return self._connection().execute(
+            "SELECT hash, document_id FROM processed WHERE filename = ?", (filename,)
+        ).fetchone()
+
+    def record(self, filename, file_hash, document_id):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO processed (filename, hash, document_id, processed_at) VALUES (?, ?, ?, ?)",
+            (filename, file_hash, document_id, time.time()),
+        )
+        conn.commit()
+
+
+def make_session(workers):
+    """A keep-alive session with one connection per worker.
+
+    Only requests the server rejected before doing any work (429 queue full, 503) and failed
+    connects are retried, honouring Retry-After; a POST is never re-sent after a read error.
+    """
+    retry = Retry(
+        total=5, connect=3, read=0, status=5, backoff_factor=0.5,
+        status_forcelist=(429, 503), allowed_methods=None, respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class StabilityTracker:
+    """Debounces file events: a path is released once its size and mtime are unchanged for
+    `stable_seconds` since the last event or change, instead of sleeping a fixed time per file."""
+
+    def __init__(self, stable_seconds):
+        self.stable_seconds = stable_seconds
+        self._pending = {}  # path -> (stat signature, time of last event or change)
+        self._lock = threading.Lock()
+
+    def touch(self, path):
+        signature = self._signature(path)
+        with self._lock:
+            self._pending[path] = (signature, time.monotonic())
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def discard(self, path):
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def stable(self):
+        """Removes and returns the paths that have settled; vanished paths are dropped."""
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            due = [(path, entry) for path, entry in self._pending.items() if now - entry[1] >= self.stable_seconds]
+        for path, entry in due:
+            current = self._signature(path)
+            with self._lock:
+                if self._pending.get(path) is not entry:
+                    continue  # touched again while we were checking
+                if current is None:
+                    del self._pending[path]
+                elif current == entry[0]:
+                    del self._pending[path]
+                    ready.append(path)
+                else:
+                    self._pending[path] = (current, now)
+        return ready
+
+
+class UploadMonitor(FileSystemEventHandler):
+    def __init__(self, base_url, upload_folder, processed_folder, index, workers, stable_seconds):
+        self.base_url = base_url
+        self.upload_folder = os.path.abspath(upload_folder)
+        self.processed_folder = processed_folder
+        self.index = index
+        self.session = make_session(workers)
+        self.tracker = StabilityTracker(stable_seconds)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self._active = set()  # paths a worker is processing
+        self._dirty = set()   # paths that changed again while being processed
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.counts = {"uploaded": 0, "updated": 0, "skipped": 0, "failed": 0}
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    # --- watchdog events (observer thread) ---
+
+    def _watched(self, path):
+        return os.path.dirname(os.path.abspath(path)) == self.upload_folder and is_candidate(path)
+
+    def _schedule(self, path):
+        with self._lock:
+            if path in self._active:
+                self._dirty.add(path)
+                return
+        self.tracker.touch(path)
+
     def on_created(self, event):
-        if not event.is_directory and event.src_path.startswith(UPLOAD_FOLDER):
-            self.process_file(event.src_path)
+        if not event.is_directory and self._watched(event.src_path):
+            self._schedule(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory and self._watched(event.src_path):
+            self._schedule(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        self.tracker.discard(event.src_path)
+        if self._watched(event.dest_path):
+            self._schedule(event.dest_path)
+
+    def rescan(self):
+        """Queues every file already in the upload folder (dropped while the monitor was down)."""
+        count = 0
+        with os.scandir(self.upload_folder) as entries:
+            for entry in entries:
+                if entry.is_file() and is_candidate(entry.path):
+                    self._schedule(entry.path)
+                    count += 1
+        if count:
+            print(f"Startup rescan queued {count} files")
+
+    # --- dispatch and workers ---
+
+    def run(self, poll_interval=0.25):
+        """Hands settled files to the worker pool until stop() is called."""
+        while not self._stop.wait(poll_interval):
+            for path in self.tracker.stable():
+                with self._lock:
+                    if path in self._active:
+                        self._dirty.add(path)
+                        continue
+                    self._active.add(path)
+                self.executor.submit(self._process, path)
 
+    def stop(self):
+        self._stop.set()
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def _process(self, path):
+        try:
+            self.process_file(path)
+        except Exception as e:
+            self._count("failed")
+            print(f"Error processing file {os.path.basename(path)}: {e}")
+        finally:
+            with self._lock:
+                self._active.discard(path)
+                dirty = path in self._dirty
+                self._dirty.discard(path)
+            if dirty and os.path.exists(path):
+                self.tracker.touch(path)
+
+    def upload_file(self, file_path, content_type, metadata=None, document_id=None, action="upload"):
+        """Uploads or updates a file using the /documents endpoint."""
+        data = {'action': action, 'content_type': content_type}
+        if metadata:
+            data['metadata'] = json.dumps(metadata)
+        if document_id:
+            data['document_id'] = document_id
+        with open(file_path, 'rb') as f:
+            return self.session.post(
+                f"{self.base_url}/documents",
+                files={'file': (os.path.basename(file_path), f)},
+                data=data,
+                timeout=REQUEST_TIMEOUT,
+            )
+
+    def wait_for_job(self, status_url):
+        """Polls an ingest job until it finishes; returns None on success, else the reason it failed."""
+        if not status_url:
+            return "202 response without a status_url"
+        deadline = time.monotonic() + JOB_TIMEOUT
+        delay = min(0.1, JOB_POLL_SECONDS)
+        while time.monotonic() < deadline:
+            response = self.session.get(urljoin(self.base_url, status_url), timeout=REQUEST_TIMEOUT)
+            if response.status_code == 404:
+                # Job state lives in the server process; a restart forgets queued jobs.
+                return "job not found (server restarted?)"
+            if response.status_code != 200:
+                return f"job status {response.status_code}: {response.text}"
+            job = response.json()
+            if job.get("status") == "succeeded":
+                return None
+            if job.get("status") == "failed":
+                return job.get("error") or "job failed"
+            time.sleep(delay)
+            delay = min(delay * 2, JOB_POLL_SECONDS)
+        return f"job still running after {JOB_TIMEOUT:.0f} s"
 
     def process_file(self, file_path):
-        """Processes a new file in the upload folder."""
-        if not os.path.exists(file_path):
+        """Uploads a settled file (or updates its document if the content changed) and moves it away."""
+        file_name = os.path.basename(file_path)
+        try:
+            file_hash = calculate_hash(file_path)
+        except FileNotFoundError:
             print(f"File disappeared before processing: {file_path}")
             return
-        time.sleep(1)
-        print(f"New file detected: {file_path}")
-        file_hash = calculate_hash(file_path)
-        file_name = os.path.basename(file_path)
-        content_type = get_content_type(file_path)
-
-        processed_files = load_processed_files()
-        existing_entry = next((entry for entry in processed_files if entry["filename"] == file_name), None)
 
-        if existing_entry and existing_entry["hash"] == file_hash:
+        existing = self.index.get(file_name)
+        if existing and existing[0] == file_hash:
             print(f"File {file_name} already processed (same hash). Skipping.")
+            self._count("skipped")
+            self._move_to_processed(file_path, file_name)
             return
 
-        document_id = None
-        action = "upload"
+        action, document_id = ("update", existing[1]) if existing else ("upload", None)
+        if existing:
+            print(f"File {file_name} updated (different hash). Updating.")
+        response = self.upload_file(file_path, get_content_type(file_path), document_id=document_id, action=action)
 
-        if existing_entry:  # File with same name exists
-            if existing_entry["hash"] != file_hash: #different content.
-                print(f"File {file_name} updated (different hash). Updating.")
-                document_id = existing_entry["document_id"]
-                action = "update"  #Crucial:  Use the "update" action
-            else:  # same content
-                print("skipping")
+        if response.status_code not in (200, 201, 202):
+            self._count("failed")
+            print(f"Error processing file {file_name}. Status: {response.status_code}, Response: {response.text}")
+            return
+        try:
+            returned_document_id = response.json().get('document_id')
+        except ValueError:
+            returned_document_id = None
+        if not returned_document_id:
+            self._count("failed")
+            print(f"Error: document_id not found in response for {file_name}.")
+            return
+        if response.status_code == 202:
+            # Queued: only record the file once the job is indexed, so a failed job is retried later.
+            error = self.wait_for_job(response.json().get('status_url'))
+            if error:
+                self._count("failed")
+                print(f"Error processing file {file_name}: ingest job failed: {error}")
                 return
 
-        # if not document_id:  # Remove: Don't generate UUID here
-        #     document_id=str(uuid.uuid4())
-        response = upload_file(file_path, content_type, document_id=document_id, action=action)
-
-        if response.status_code in (200, 201): #check for the action
-            print(f"File {file_name} processed successfully. Response: {response.status_code}")
-            # Get document_id from response
-            try:
-                response_data = response.json()
-                returned_document_id = response_data.get('document_id')
-                if not returned_document_id:
-                    print("Error: document_id not found in response.")
-                    return  # Or handle the error appropriately
-            except json.JSONDecodeError:
-                print("Error: Could not decode response as JSON.")
-                return
+        self.index.record(file_name, file_hash, returned_document_id)
+        self._count("updated" if existing else "uploaded")
+        print(f"File {file_name} processed successfully. Response: {response.status_code}")
+        self._move_to_processed(file_path, file_name)
+
+    def _move_to_processed(self, file_path, file_name):
+        # Unchanged files are moved too, so the next startup rescan does not hash them again.
+        new_file_path = os.path.join(self.processed_folder, file_name)
+        os.replace(file_path, new_file_path)
 
-            #Update metadata
-            if existing_entry:
-                existing_entry["hash"] = file_hash
-                existing_entry["document_id"] = returned_document_id  # Use returned ID
-            else:
-                processed_files.append({"filename": file_name, "hash": file_hash, "document_id": returned_document_id})  # Use returned ID
-            save_processed_files(processed_files)
-
-            # Move to processed folder
-            new_file_path = os.path.join(PROCESSED_FOLDER, file_name)
-            os.makedirs(PROCESSED_FOLDER,exist_ok=True)
-            os.rename(file_path, new_file_path)
-            print(f"File moved to {new_file_path}")
-        else:
-            print(f"Error processing file {file_name}. Status: {response.status_code}, Response: {response.text}")
 
 def main():
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    os.makedirs(PROCESSED_FOLDER, exist_ok=True)  # Ensure processed folder exists
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=BASE_URL, help="base URL of the API")
+    parser.add_argument("--upload-folder", default=UPLOAD_FOLDER)
+    parser.add_argument("--processed-folder", default=PROCESSED_FOLDER)
+    parser.add_argument("--index", default=INDEX_FILE, help="SQLite index of processed files")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="files uploaded concurrently")
+    parser.add_argument("--stable-seconds", type=float, default=STABLE_SECONDS,
+                        help="how long size and mtime must stay unchanged before a file is processed")
+    args = parser.parse_args()
+
+    os.makedirs(args.upload_folder, exist_ok=True)
+    os.makedirs(args.processed_folder, exist_ok=True)  # Ensure processed folder exists
+    legacy = os.path.join(args.processed_folder, os.path.basename(LEGACY_METADATA_FILE))
+    index = ProcessedIndex(args.index, legacy_json=legacy)
+    monitor = UploadMonitor(args.url, args.upload_folder, args.processed_folder, index, args.workers, args.stable_seconds)
 
-    event_handler = MyEventHandler()
     observer = Observer()
-    observer.schedule(event_handler, UPLOAD_FOLDER, recursive=False)
+    observer.schedule(monitor, args.upload_folder, recursive=False)
     observer.start()
-    print(f"Monitoring {UPLOAD_FOLDER} for new files...")
+    monitor.rescan()
+    print(f"Monitoring {args.upload_folder} for new files with {args.workers} workers...")
 
     try:
-        while True:
-            time.sleep(1)
+        monitor.run()
     except KeyboardInterrupt:
+        pass
+    finally:
         observer.stop()
-    observer.join()
+        observer.join()
+        monitor.stop()
+        print(f"Stopped. {monitor.counts}; {len(monitor.tracker)} files still pending (picked up by the next rescan)")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
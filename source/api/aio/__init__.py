@@ -0,0 +1,7 @@
+"""Async versions of the routes in source/api, served by the ASGI app (asgi.py)."""
+from quart import current_app
+
+
+def get_services():
+    """Returns the services of the ASGI app handling the current request."""
+    return current_app.extensions['services']
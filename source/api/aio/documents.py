@@ -0,0 +1,88 @@
+import logging
+import os
+import uuid
+from quart import request, jsonify, current_app, url_for
+from source.api.aio import get_services
+from source.api.documents import read_upload, wants_async
+from source.services.job_service import JobQueueFull
+from source.utils.file_utils import upload_path
+from source.utils.observability import get_trace_id
+
+logger = logging.getLogger(__name__)
+
+
+def _submit_job(action, file_path, filename, content_type, metadata, document_id=None):
+    """Queues an ingest job and answers 202, or 429 when the queue is full."""
+    try:
+        job = get_services().job_manager.submit(action, file_path, filename, content_type, metadata, document_id=document_id)
+    except JobQueueFull as e:
+        os.remove(file_path)
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '5'}
+    return jsonify({
+        'message': f'Document {action} queued',
+        'job_id': job.id,
+        'document_id': job.document_id,
+        'status_url': url_for('get_job', job_id=job.id),
+    }), 202
+
+
+def register_routes(app):
+
+    @app.route('/documents', methods=['POST'])
+    async def handle_document():
+        """Handles document upload, update, and deletion via a single POST endpoint."""
+        services = get_services()
+        document_service = services.document_service
+        form = await request.form
+        action = form.get('action')
+        document_id = form.get('document_id')
+        run_async = action in ('upload', 'update') and wants_async(form, current_app.config['INGEST_ASYNC_DEFAULT'])
+        if run_async and services.job_manager.queue_depth() >= services.job_manager.max_pending:
+            return jsonify({'error': 'Ingest queue is full, retry later'}), 429, {'Retry-After': '5'}
+
+        if action in ('upload', 'update'):
+            if action == 'update' and not document_id:
+                return jsonify({'error': 'Missing document_id for update'}), 400
+            upload, error = read_upload(form, await request.files)
+            if error:
+                return jsonify({'error': error}), 400
+            file, filename, content_type, metadata = upload
+
+            if action == 'upload' and content_type in ('text/plain', 'application/json') and not run_async:
+                # Plain text and JSON are chunked and indexed straight from the upload stream, no temp file.
+                try:
+                    document_id = await document_service.process_and_index_stream_async(file.stream, filename, content_type, metadata)
+                    return jsonify({'message': 'Document uploaded and processed', 'document_id': document_id}), 201
+                except Exception as e:
+                    logger.exception("%s failed", action)
+                    return jsonify({'error': str(e)}), 500
+
+            file_path = upload_path(current_app.config['UPLOAD_FOLDER'], filename)
+            await file.save(file_path)
+            if run_async:
+                return _submit_job(action, file_path, filename, content_type, metadata, document_id=document_id)
+
+            try:
+                chunks = await services.job_manager.parse_async(file_path, content_type, get_trace_id())
+                if action == 'update':
+                    document_id = await document_service.update_chunks_async(document_id, filename, content_type, metadata, chunks)
+                    return jsonify({'message': 'Document updated and processed', 'document_id': document_id}), 200
+                document_id = await document_service.index_chunks_async(str(uuid.uuid4()), filename, content_type, metadata, chunks)
+                return jsonify({'message': 'Document uploaded and processed', 'document_id': document_id}), 201
+            except Exception as e:
+                logger.exception("%s failed", action)
+                return jsonify({'error': str(e)}), 500
+            finally:
+                os.remove(file_path)
+
+        elif action == 'delete':
+            if not document_id:
+                return jsonify({'error': 'Missing document_id for delete'}), 400
+            try:
+                await document_service.delete_document_async(document_id)
+                return jsonify({'message': f'Document with id {document_id} deleted'}), 200
+            except Exception as e:
+                logger.exception("%s failed", action)
+                return jsonify({'error': str(e)}), 500
+        else:
+            return jsonify({'error': 'Invalid action specified'}), 400
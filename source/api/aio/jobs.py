@@ -0,0 +1,11 @@
+from quart import jsonify
+from source.api.aio import get_services
+
+def register_routes(app):
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    async def get_job(job_id):
+        """Returns the status of an asynchronous upload/update job."""
+        job = get_services().job_manager.get(job_id)
+        if job is None:
+            return jsonify({'error': f'Job {job_id} not found'}), 404
+        return jsonify(job.__dict__), 200
@@ -0,0 +1,25 @@
+from quart import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST
+from source.api.metrics import end_request, finish_request, metrics_body, start_request
+
+
+def register_routes(app):
+    # Async hooks: the trace id is a context variable, and Quart runs sync hooks in another thread's context.
+
+    @app.before_request
+    async def start_trace():
+        start_request(request, g)
+
+    @app.after_request
+    async def finish_trace(response):
+        return finish_request(request, g, response)
+
+    @app.teardown_request
+    async def end_trace(exc):
+        end_request(g)
+
+    if app.config.get("METRICS_ENABLED", True):
+        @app.route('/metrics', methods=['GET'])
+        async def metrics():
+            """Prometheus metrics: stage latencies, chunk counts, embedding batches, cache and Weaviate calls."""
+            return Response(metrics_body(), content_type=CONTENT_TYPE_LATEST)
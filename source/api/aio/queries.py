@@ -0,0 +1,49 @@
+import logging
+from quart import request, jsonify
+from source.api.aio import get_services
+from source.api.queries import (
+    batch_error, batch_requests, batch_responses, is_scoped, query_args, query_error, scope_args, scope_error, scope_response,
+)
+from source.services.scatter_gather import ScopeTooLarge
+
+logger = logging.getLogger(__name__)
+
+def register_routes(app):
+    @app.route('/queries', methods=['POST'])
+    async def query_document_route():
+        data = await request.get_json(silent=True)
+        if not data:
+            return jsonify({'error': 'Missing request body'}), 400
+        scoped = is_scoped(data)
+        error = scope_error(data, get_services().config) if scoped else query_error(data)
+        if error:
+            return jsonify({'error': error}), 400
+
+        document_service = get_services().document_service
+        try:
+            if scoped:
+                return jsonify(scope_response(await document_service.query_scope_async(**scope_args(data)))), 200
+            results = await document_service.query_document_async(**query_args(data))
+            return jsonify([r.__dict__ for r in results]), 200
+        except ScopeTooLarge as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.exception("query failed")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/queries/batch', methods=['POST'])
+    async def query_batch_route():
+        data = await request.get_json(silent=True)
+        config = get_services().config
+        error = batch_error(data, config)
+        if error:
+            return jsonify({'error': error}), 400
+
+        responses, positions, queries = batch_requests(data['queries'], config)
+        document_service = get_services().document_service
+        try:
+            batch_responses(responses, positions, await document_service.query_documents_async(queries))
+        except Exception as e:
+            logger.exception("batch query failed")
+            return jsonify({'error': str(e)}), 500
+        return jsonify({'results': responses}), 200
@@ -1,107 +1,141 @@
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, url_for
 from werkzeug.utils import secure_filename
 import os
 import json
-from source.services.document_service import DocumentService
-from source.services.weaviate_service import WeaviateService
-from source.services.embedding_service import EmbeddingService
-from source.utils.config import Config
+import logging
+from typing import Any, NamedTuple, Optional, Tuple
+from source.services.container import get_services
+from source.services.job_service import JobQueueFull
+from source.utils.file_utils import save_upload
+
+logger = logging.getLogger(__name__)
+
+
+class Upload(NamedTuple):
+    file: Any
+    filename: str
+    content_type: str
+    metadata: Optional[dict]
+
+
+def read_upload(form, files) -> Tuple[Optional[Upload], Optional[str]]:
+    """Validates the file part and metadata of an upload or update form (Flask or Quart).
+
+    Returns the upload, or None and the message of a 400 response.
+    """
+    if 'file' not in files:
+        return None, 'No file part'
+    file = files['file']
+    if file.filename == '':
+        return None, 'No selected file'
+    metadata = form.get('metadata')
+    if metadata:
+        try:
+            metadata = json.loads(metadata)
+        except json.JSONDecodeError:
+            return None, "Invalid metadata format, must be valid JSON"
+    return Upload(file, secure_filename(file.filename), form.get('content_type'), metadata), None
+
+
+def wants_async(form, default: bool) -> bool:
+    value = form.get('async')
+    if value is None:
+        return default
+    return value.lower() in ['true', '1', 't']
+
+
+def _submit_job(action, file_path, filename, content_type, metadata, document_id=None):
+    """Queues an ingest job and answers 202, or 429 when the queue is full."""
+    try:
+        job = get_services().job_manager.submit(action, file_path, filename, content_type, metadata, document_id=document_id)
+    except JobQueueFull as e:
+        os.remove(file_path)
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '5'}
+    return jsonify({
+        'message': f'Document {action} queued',
+        'job_id': job.id,
+        'document_id': job.document_id,
+        'status_url': url_for('get_job', job_id=job.id),
+    }), 202
+
 
 def register_routes(app):
 
     @app.route('/documents', methods=['POST'])
     def handle_document():
         """Handles document upload, update, and deletion via a single POST endpoint."""
-        config = Config()
-        embedding_service = EmbeddingService(use_gemini=True, model_name=config.HUGGINGFACE_MODEL_NAME)
-        weaviate_service = WeaviateService(config)
-        document_service = DocumentService(embedding_service, weaviate_service, config)
+        services = get_services()
+        document_service = services.document_service
         # Determine the action (upload, update, delete)
         action = request.form.get('action')
         document_id = request.form.get('document_id')  # Get document_id from form data
+        run_async = action in ('upload', 'update') and wants_async(request.form, current_app.config['INGEST_ASYNC_DEFAULT'])
+        if run_async and services.job_manager.queue_depth() >= services.job_manager.max_pending:
+            # Reject before the upload is written to disk.
+            return jsonify({'error': 'Ingest queue is full, retry later'}), 429, {'Retry-After': '5'}
 
         if action == 'upload':
-            print("calling upload route")
             # --- Upload Logic ---
-            if 'file' not in request.files:
-                return jsonify({'error': 'No file part'}), 400
-            file = request.files['file']
+            upload, error = read_upload(request.form, request.files)
+            if error:
+                return jsonify({'error': error}), 400
+            file, filename, content_type, metadata = upload
 
-            if file.filename == '':
-                return jsonify({'error': 'No selected file'}), 400
-
-            filename = secure_filename(file.filename)
-            content_type = request.form.get('content_type')  # Get from form data
-            metadata = request.form.get('metadata')
-            if metadata:
+            if content_type in ('text/plain', 'application/json') and not run_async:
+                # Plain text and JSON are chunked and indexed straight from the upload stream, no temp file.
                 try:
-                    metadata = json.loads(metadata)
-                except json.JSONDecodeError:
-                    return jsonify({'error': "Invalid metadata format, must be valid JSON"}), 400
-
-            upload_folder = current_app.config['UPLOAD_FOLDER']
-            os.makedirs(upload_folder, exist_ok=True)
-            file_path = os.path.join(upload_folder, filename)
-            file.save(file_path)
+                    document_id = document_service.process_and_index_stream(file.stream, filename, content_type, metadata)
+                    return jsonify({'message': 'Document uploaded and processed', 'document_id': document_id}), 201
+                except Exception as e:
+                    logger.exception("%s failed", action)
+                    return jsonify({'error': str(e)}), 500
 
-            
+            file_path = save_upload(file, current_app.config['UPLOAD_FOLDER'], filename)
+            if run_async:
+                return _submit_job('upload', file_path, filename, content_type, metadata)
 
             try:
                 document_id = document_service.process_and_index_document(file_path, filename, content_type, metadata)
-                weaviate_service.close()
                 return jsonify({'message': 'Document uploaded and processed', 'document_id': document_id}), 201
             except Exception as e:
+                logger.exception("%s failed", action)
                 return jsonify({'error': str(e)}), 500
             finally:
                 os.remove(file_path)
 
         elif action == 'update':
             # --- Update Logic ---
-            print("calling update route")
             if not document_id:
                 return jsonify({'error': 'Missing document_id for update'}), 400
-            if 'file' not in request.files:
-                return jsonify({'error': 'No file part'}), 400
-            file = request.files['file']
-
-            if file.filename == '':
-                return jsonify({'error': 'No selected file'}), 400
-
-            filename = secure_filename(file.filename)
-            content_type = request.form.get('content_type') # Get from form data
-            metadata = request.form.get('metadata')
-            if metadata:
-                try:
-                    metadata = json.loads(metadata)
-                except json.JSONDecodeError:
-                    return jsonify({'error': "Invalid metadata format, must be valid JSON"}), 400
+            upload, error = read_upload(request.form, request.files)
+            if error:
+                return jsonify({'error': error}), 400
+            file, filename, content_type, metadata = upload
 
-            upload_folder = current_app.config['UPLOAD_FOLDER']
-            os.makedirs(upload_folder, exist_ok=True)
-            file_path = os.path.join(upload_folder, filename)
-            file.save(file_path)
+            file_path = save_upload(file, current_app.config['UPLOAD_FOLDER'], filename)
+            if run_async:
+                return _submit_job('update', file_path, filename, content_type, metadata, document_id=document_id)
 
             try:
                 document_id = document_service.update_document(document_id, file_path, filename, content_type, metadata)
-                weaviate_service.close()
                 return jsonify({'message': 'Document updated and processed', 'document_id': document_id}), 200
             
             except Exception as e:
+                logger.exception("%s failed", action)
                 return jsonify({'error': str(e)}), 500
             finally:
                 os.remove(file_path)
         elif action == 'delete':
             # --- Delete Logic ---
-            print("calling delete document route")
             if not document_id:
                 return jsonify({'error': 'Missing document_id for delete'}), 400
 
 
             try:
                 document_service.delete_document(document_id)
-                weaviate_service.close()
                 return jsonify({'message': f'Document with id {document_id} deleted'}), 200
             except Exception as e:
+                logger.exception("%s failed", action)
                 return jsonify({'error': str(e)}), 500
         else:
-            return jsonify({'error': 'Invalid action specified'}), 400
\ No newline at end of file
+            return jsonify({'error': 'Invalid action specified'}), 400
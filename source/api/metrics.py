@@ -0,0 +1,72 @@
+import logging
+import os
+import re
+import time
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY, generate_latest
+from source.utils.observability import HTTP_REQUEST_SECONDS, get_trace_id, reset_trace_id, set_trace_id
+
+logger = logging.getLogger(__name__)
+
+# A caller-supplied X-Request-ID is reused as the trace id if it looks like an id.
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def _registry():
+    """With PROMETHEUS_MULTIPROC_DIR set (e.g. under gunicorn), every worker writes its metrics there
+    and /metrics aggregates them; otherwise the process-local registry is served."""
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    from prometheus_client import multiprocess
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def start_request(request, g):
+    """Sets the trace id of a request and notes its start time (shared with the ASGI app)."""
+    incoming = request.headers.get("X-Request-ID", "")
+    g.trace_token = set_trace_id(incoming if _REQUEST_ID.match(incoming) else None)
+    g.request_started = time.perf_counter()
+
+
+def finish_request(request, g, response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.labels(endpoint, request.method, str(response.status_code)).observe(elapsed)
+        logger.info("%s %s -> %s in %.1f ms", request.method, request.path, response.status_code, elapsed * 1000)
+    response.headers["X-Request-ID"] = get_trace_id() or ""
+    return response
+
+
+def end_request(g):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        reset_trace_id(token)
+
+
+def metrics_body() -> bytes:
+    return generate_latest(_registry())
+
+
+def register_routes(app):
+
+    @app.before_request
+    def start_trace():
+        start_request(request, g)
+
+    @app.after_request
+    def finish_trace(response):
+        return finish_request(request, g, response)
+
+    @app.teardown_request
+    def end_trace(exc):
+        end_request(g)
+
+    if app.config.get("METRICS_ENABLED", True):
+        @app.route('/metrics', methods=['GET'])
+        def metrics():
+            """Prometheus metrics: stage latencies, chunk counts, embedding batches, cache and Weaviate calls."""
+            return Response(metrics_body(), mimetype=CONTENT_TYPE_LATEST)
@@ -1,38 +1,171 @@
+import logging
+from typing import List, Optional, Tuple
 from flask import request, jsonify, current_app
-from source.services.document_service import DocumentService
-from source.services.weaviate_service import WeaviateService
-from source.services.embedding_service import EmbeddingService
-from source.utils.config import Config
+from source.services.container import get_services
+from source.models import QueryRequest
+from source.services.document_service import QUERY_MODES
+from source.services.scatter_gather import ScopeTooLarge
+
+logger = logging.getLogger(__name__)
+
+
+def query_error(data: dict) -> Optional[str]:
+    """Validates a /queries body; returns the message of a 400 response or None."""
+    if not data.get('document_id'):
+        return 'Missing document_id'
+    return query_text_error(data)
+
+
+def query_text_error(data: dict) -> Optional[str]:
+    if not data.get('query'):
+        return 'Missing query parameter'
+    mode = data.get('mode')  # "vector", "keyword" or "hybrid"; defaults to QUERY_MODE_DEFAULT
+    if mode is not None and mode not in QUERY_MODES:
+        return f"Invalid mode, must be one of {', '.join(QUERY_MODES)}"
+    return None
+
+
+def query_args(data: dict) -> dict:
+    """The DocumentService.query_document arguments of a valid /queries body."""
+    return {
+        'document_id': data['document_id'],
+        'query_text': data['query'],
+        'limit': data.get('num_chunks_return'),
+        'hierarchy_path': data.get('hierarchy_path'),  # JSON documents: only search this subtree, e.g. "company.employees"
+        'mode': data.get('mode'),
+    }
+
+
+def is_scoped(data: dict) -> bool:
+    """Whether a /queries body searches several documents ("document_ids") or the corpus ("scope")."""
+    return 'document_ids' in data or 'scope' in data
+
+
+def scope_error(data: dict, config) -> Optional[str]:
+    document_ids = data.get('document_ids')
+    if 'document_ids' in data:
+        if not isinstance(document_ids, list) or not document_ids or not all(
+                isinstance(document_id, str) and document_id for document_id in document_ids):
+            return 'document_ids must be a non-empty list of document ids'
+        if len(document_ids) > config.QUERY_SCOPE_MAX_DOCUMENTS:
+            return f'At most {config.QUERY_SCOPE_MAX_DOCUMENTS} document_ids per query'
+    elif data.get('scope') != 'corpus':
+        return "Invalid scope, must be 'corpus'"
+    budget = data.get('time_budget_ms')
+    if budget is not None and (isinstance(budget, bool) or not isinstance(budget, (int, float)) or budget <= 0):
+        return 'time_budget_ms must be a positive number'
+    return query_text_error(data)
+
+
+def scope_args(data: dict) -> dict:
+    """The DocumentService.query_scope arguments of a valid scoped /queries body."""
+    return {
+        'document_ids': data.get('document_ids'),  # None: the whole corpus
+        'query_text': data['query'],
+        'limit': data.get('num_chunks_return'),
+        'hierarchy_path': data.get('hierarchy_path'),
+        'mode': data.get('mode'),
+        'time_budget_ms': data.get('time_budget_ms'),
+    }
+
+
+def scope_response(gathered) -> dict:
+    return {
+        'results': [r.__dict__ for r in gathered.results],
+        'partial': gathered.partial,
+        'missing': gathered.missing,
+        'scoring': gathered.scoring,
+    }
+
+
+def batch_error(data, config) -> Optional[str]:
+    items = data.get('queries') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return 'Missing queries list'
+    if len(items) > config.QUERY_BATCH_MAX_ITEMS:
+        return f'At most {config.QUERY_BATCH_MAX_ITEMS} queries per batch'
+    return None
+
+
+def batch_requests(items: list, config) -> Tuple[list, List[int], List[QueryRequest]]:
+    """Turns the items of a /queries/batch body into QueryRequests.
+
+    Invalid items fail on their own instead of failing the whole batch: their error is already in
+    the returned responses, and `positions` maps each request back to its item.
+    """
+    responses = [None] * len(items)
+    positions = []
+    queries = []
+    for i, item in enumerate(items):
+        error = query_error(item) if isinstance(item, dict) else 'Query must be an object'
+        if error:
+            responses[i] = {'error': error}
+        else:
+            positions.append(i)
+            queries.append(QueryRequest(
+                document_id=item['document_id'],
+                query=item['query'],
+                limit=item.get('num_chunks_return'),
+                hierarchy_path=item.get('hierarchy_path'),
+                mode=item.get('mode') or config.QUERY_MODE_DEFAULT,
+            ))
+    return responses, positions, queries
+
+
+def batch_responses(responses: list, positions: List[int], outcomes: list):
+    for i, outcome in zip(positions, outcomes):
+        if isinstance(outcome, Exception):
+            responses[i] = {'error': str(outcome)}
+        else:
+            responses[i] = {'results': [r.__dict__ for r in outcome]}
+
 
 def register_routes(app):
     @app.route('/queries', methods=['POST'])  # Changed to POST
     def query_document_route():
-        print("calling query route")
         # Get document_id and query_text from the request body (JSON)
         data = request.get_json()
 
         if not data:
             return jsonify({'error': 'Missing request body'}), 400
 
-        document_id = data.get('document_id',"")
-        query_text = data.get('query')
-        limit=data.get('num_chunks_return')
-        if not document_id:
-            return jsonify({'error': 'Missing document_id'}), 400
-        if not query_text:
-            return jsonify({'error': 'Missing query parameter'}), 400
+        # One document_id answers with a list of results; document_ids or scope "corpus" with
+        # {"results", "partial", "missing"}.
+        scoped = is_scoped(data)
+        error = scope_error(data, get_services().config) if scoped else query_error(data)
+        if error:
+            return jsonify({'error': error}), 400
 
-        config = Config()
-        embedding_service = EmbeddingService(use_gemini=True, model_name=config.HUGGINGFACE_MODEL_NAME) #Changed to use openai
-        weaviate_service = WeaviateService(config)
-        document_service = DocumentService(embedding_service, weaviate_service, config)
+        document_service = get_services().document_service
 
         try:
-            results = document_service.query_document(document_id, query_text,limit)
-            weaviate_service.close()
+            if scoped:
+                return jsonify(scope_response(document_service.query_scope(**scope_args(data)))), 200
+            results = document_service.query_document(**query_args(data))
             return jsonify([r.__dict__ for r in results]), 200
+        except ScopeTooLarge as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
+            logger.exception("query failed")
             return jsonify({'error': str(e)}), 500
+    @app.route('/queries/batch', methods=['POST'])
+    def query_batch_route():
+        # Body: {"queries": [{"document_id", "query", "num_chunks_return", "hierarchy_path", "mode"}, ...]}
+        data = request.get_json(silent=True)
+        config = get_services().config
+        error = batch_error(data, config)
+        if error:
+            return jsonify({'error': error}), 400
+
+        responses, positions, queries = batch_requests(data['queries'], config)
+        document_service = get_services().document_service
+        try:
+            batch_responses(responses, positions, document_service.query_documents(queries))
+        except Exception as e:
+            logger.exception("batch query failed")
+            return jsonify({'error': str(e)}), 500
+        return jsonify({'results': responses}), 200
+
     @app.route('/')
     def health_check():
         return jsonify({'status': 'alive'}), 200
\ No newline at end of file
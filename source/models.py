@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
 
 @dataclass
 class Document:
@@ -7,6 +8,7 @@ class Document:
     content: str  # Or a path to the content, depending on storage strategy
     content_type: str # "application/pdf", "text/plain", etc.
     metadata: dict  # Any additional metadata
+    hierarchy_paths: Optional[List[List[str]]] = None  # JSON paths covered by each chunk, parallel to content
 
 @dataclass
 class QueryResult:
@@ -14,4 +16,49 @@ class QueryResult:
     snippet: str
     score: float # Similarity score from Weaviate
     metadata: dict
-    chunk_order_key:int
\ No newline at end of file
+    chunk_order_key:int
+
+@dataclass
+class QueryRequest:
+    document_id: str
+    query: str
+    limit: Optional[int] = None
+    hierarchy_path: Optional[str] = None
+    mode: str = "vector"  # "vector", "keyword" or "hybrid"
+
+@dataclass
+class GatheredResults:
+    results: List[QueryResult]
+    partial: bool = False  # some partitions did not answer within the time budget
+    missing: List[str] = field(default_factory=list)  # those partitions: document ids, or tenant / partition names
+    scoring: str = "cosine"  # what `score` is: "cosine" similarity, "bm25", or "rank_fusion" (reciprocal rank, not comparable to BM25)
+
+@dataclass
+class StoredChunk:
+    uuid: str
+    content_hash: Optional[str]  # None for chunks indexed before hashes were stored
+    chunk_sort_key: int
+    filename: Optional[str] = None
+    metadata: Optional[str] = None
+    doc_version: Optional[int] = None  # document version that wrote the chunk; None before versions were stored
+
+@dataclass
+class ChunkDiff:
+    identities: List[Tuple[str, str]]  # (content hash, object id) of every chunk in the new version
+    new_indices: List[int]  # positions of chunks that must be embedded and inserted
+    updates: Dict[str, dict] = field(default_factory=dict)  # object id -> properties to patch on kept chunks
+    removed_uuids: List[str] = field(default_factory=list)
+    stored_version: int = 0  # newest document version among the stored chunks
+    unversioned_uuids: List[str] = field(default_factory=list)  # stored chunks written before versions were stored
+
+@dataclass
+class IngestJob:
+    id: str
+    action: str  # "upload" or "update"
+    document_id: str
+    filename: str
+    status: str = "queued"  # queued -> parsing -> indexing -> succeeded | failed
+    error: Optional[str] = None
+    created_at: float = 0.0
+    finished_at: Optional[float] = None
+    trace_id: Optional[str] = None  # trace id of the request that queued the job, in every log line of it
@@ -0,0 +1,81 @@
+import atexit
+import logging
+import threading
+from flask import current_app
+from source.services.document_service import DocumentService
+from source.services.weaviate_service import WeaviateService
+from source.services.local_vector_store import LocalVectorStore
+from source.services.embedding_service import EmbeddingService
+from source.services.job_service import IngestJobManager
+from source.services.query_cache import QueryCache
+from source.utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def create_vector_store(config: Config):
+    """Builds the vector store selected by `config.VECTOR_BACKEND`."""
+    if config.VECTOR_BACKEND == 'weaviate':
+        return WeaviateService(config)
+    if config.VECTOR_BACKEND == 'local':
+        return LocalVectorStore(config)
+    raise ValueError(f"Unknown VECTOR_BACKEND: {config.VECTOR_BACKEND}")
+
+
+class ServiceContainer:
+    """Owns the services and the ingest job manager shared by every request in a process."""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.embedding_service = EmbeddingService(use_gemini=True, model_name=config.HUGGINGFACE_MODEL_NAME, config=config)
+        self.weaviate_service = create_vector_store(config)
+        self.query_cache = QueryCache(config) if config.QUERY_CACHE_ENABLED else None
+        self.document_service = DocumentService(self.embedding_service, self.weaviate_service, config, query_cache=self.query_cache)
+        self.job_manager = IngestJobManager(self.document_service, config)
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+    def start(self):
+        """Starts background health checks and optionally warms up the services."""
+        self.weaviate_service.start_health_checks(self.config.WEAVIATE_HEALTH_CHECK_INTERVAL)
+        if self.config.WARMUP_ON_STARTUP:
+            self.warm_up()
+
+    def warm_up(self):
+        """Pays the connection and TLS setup costs up front instead of on the first request."""
+        if not self.weaviate_service.is_healthy():
+            logger.warning("warm-up: vector store is not reachable")
+        try:
+            self.embedding_service.generate_embedding("warm-up")
+        except Exception as e:
+            logger.warning("warm-up: embedding call failed: %s", e)
+
+    def close(self):
+        """Closes the shared connections. Safe to call more than once."""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.job_manager.close()
+        self.document_service.close()
+        self.weaviate_service.close()
+        self.embedding_service.close()
+
+    async def aclose(self):
+        """Closes the async clients opened by the ASGI app; runs in its event loop before close()."""
+        await self.weaviate_service.aclose()
+        await self.embedding_service.aclose()
+
+
+def init_services(app, config: Config) -> ServiceContainer:
+    """Creates the process-wide services for `app` and registers them for clean shutdown."""
+    container = ServiceContainer(config)
+    container.start()
+    app.extensions['services'] = container
+    atexit.register(container.close)
+    return container
+
+
+def get_services() -> ServiceContainer:
+    """Returns the services of the app handling the current request."""
+    return current_app.extensions['services']
@@ -1,127 +1,614 @@
-import uuid,time,json
-from source.utils.file_utils import read_and_parse_file
+import asyncio
+import io
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from source.utils.file_utils import read_and_parse_file, iter_text_blocks, PARSED_CONTENT_TYPES, PARSER_VERSION
+from source.services.parse_cache import ParsedDocumentCache, file_sha256
+from source.utils.chunking import iter_text_chunks, iter_json_chunks, batched, MarkdownChunker
 from source.services.embedding_service import EmbeddingService
 from source.services.weaviate_service import WeaviateService
-from source.models import Document
+from source.services.query_cache import QueryCache
+from source.models import Document, StoredChunk, ChunkDiff, GatheredResults, QueryRequest, QueryResult
+from source.services.scatter_gather import deadline_after, remaining
+from source.utils.hashing import chunk_identities
+from source.utils.observability import stage, trace, get_trace_id, configure_logging, DOCUMENT_CHUNKS
 from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
 from source.utils.config import Config
-from typing import List, Dict, Any,Tuple
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+QUERY_MODES = ("vector", "keyword", "hybrid")
+
+# JSON chunks travel through the pipeline as (text, hierarchy paths) pairs, other chunks as plain text.
+Chunk = Union[str, Tuple[str, List[str]]]
+
+
+def split_hierarchy(chunks: List[Chunk]) -> Tuple[List[str], Optional[List[List[str]]]]:
+    """Separates chunk texts from their hierarchy paths (None when the chunks carry no paths)."""
+    if not chunks or isinstance(chunks[0], str):
+        return list(chunks), None
+    return [text for text, _ in chunks], [path for _, path in chunks]
+
 
 class DocumentService:
-    def __init__(self, embedding_service: EmbeddingService, weaviate_service: WeaviateService, config: Config):
+    def __init__(self, embedding_service: EmbeddingService, weaviate_service: WeaviateService, config: Config, query_cache: QueryCache = None):
         self.embedding_service = embedding_service
         self.weaviate_service = weaviate_service
         self.config = config
+        self.query_cache = query_cache
+        self._query_executor = None  # created on first batch query; worker processes never need it
+        self._executor_lock = threading.Lock()
+        self.parse_cache = None
+        if getattr(config, "PARSE_CACHE_ENABLED", False):
+            self.parse_cache = ParsedDocumentCache.shared(config.PARSE_CACHE_PATH, config.PARSE_CACHE_MAX_BYTES)
         self.text_splitter = RecursiveCharacterTextSplitter(
             separators=['.'],
             chunk_size=self.config.CHUNK_SIZE,
             chunk_overlap=self.config.CHUNK_OVERLAP,
             length_function=len
         )
-        
-    # def hierarchical_chunk_json(self, json_data: Any) -> Tuple[List[str], List[str]]:
-    #     """
-    #     Recursively parse hierarchical JSON and produce two lists:
-    #      - chunks: text representations of each leaf node (with their hierarchical path).
-    #      - hierarchy_paths: the hierarchical keys corresponding to each chunk.
-    #     """
-    #     chunks = []
-    #     hierarchy_paths = []
-
-    #     def recursive_parse(data: Any, path: str = ""):
-    #         if isinstance(data, dict):
-    #             for key, value in data.items():
-    #                 new_path = f"{path}.{key}" if path else key
-    #                 if isinstance(value, (dict, list)):
-    #                     recursive_parse(value, new_path)
-    #                 else:
-    #                     chunk = f"{new_path}: {value}"
-    #                     chunks.append(chunk)
-    #                     hierarchy_paths.append(new_path)
-    #         elif isinstance(data, list):
-    #             for idx, item in enumerate(data):
-    #                 new_path = f"{path}[{idx}]"
-    #                 if isinstance(item, (dict, list)):
-    #                     recursive_parse(item, new_path)
-    #                 else:
-    #                     chunk = f"{new_path}: {item}"
-    #                     chunks.append(chunk)
-    #                     hierarchy_paths.append(new_path)
-
-    #     recursive_parse(json_data)
-    #     return chunks, hierarchy_paths
-
-    def chunk_pdf_docx(self,text: str) -> list[str]:    
-        headers_to_split_on = [
+        self.markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=[
             ("#", "Header 1"),
             ("##", "Header 2"),
             ("###", "Header 3"),
             ("####", "Header 4"),
-        ]
-        markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on)
-        md_chunks = markdown_splitter.split_text(text)
+        ])
+        self.markdown_chunker = MarkdownChunker(
+            chunk_size=self.config.CHUNK_SIZE,
+            chunk_overlap=self.config.CHUNK_OVERLAP,
+            unit=self.config.CHUNK_SIZE_UNIT,
+        )
+        
+    def hierarchical_chunk_json(self, stream: BinaryIO) -> Iterator[Tuple[str, List[str]]]:
+        """Streams a JSON document into (chunk, hierarchy paths) pairs.
 
-        final_chunks = []
-        for chunk in md_chunks:
-            if len(chunk.page_content) <= self.config.CHUNK_SIZE:
-                final_chunks.append(chunk.page_content)
-            else:
-                smaller_chunks = self.text_splitter.split_text(chunk.page_content)
-                final_chunks.extend(smaller_chunks)
+        Leaves are read incrementally and packed into chunks of at most CHUNK_SIZE characters, one
+        "path: value" line per leaf; the hierarchy paths are every path the chunk has leaves under.
+        """
+        return iter_json_chunks(stream, self.config.CHUNK_SIZE)
 
-        return final_chunks
+    def chunk_pdf_docx(self, text: str) -> list[str]:
+        """Splits parsed PDF/DOCX markdown into chunks that never cross a header (# to ####).
 
-    
+        The native chunker does it in one pass, packing whole sentences up to CHUNK_SIZE characters or
+        tokens (CHUNK_SIZE_UNIT) and keeping header lines in the chunk they open. CHUNKER=langchain keeps
+        the previous header split + '.' re-split, whose chunks carry no header text.
+        """
+        if self.config.CHUNKER == "langchain":
+            final_chunks = []
+            for chunk in self.markdown_splitter.split_text(text):
+                if len(chunk.page_content) <= self.config.CHUNK_SIZE:
+                    final_chunks.append(chunk.page_content)
+                else:
+                    final_chunks.extend(self.text_splitter.split_text(chunk.page_content))
+            return final_chunks
+        return [text[start:end] for start, end in self.markdown_chunker.spans(text)]
 
-    def process_and_index_document(self, file_path: str, file_name:str, content_type: str, metadata: dict = None,oldid:str=None) -> str:
-        """Reads, parses, chunks, embeds, and indexes a document."""
+    def parse_file(self, file_path: str, content_type: str) -> str:
+        """Reads and parses a file into text (markdown for PDF/DOCX).
+
+        PDF/DOCX output is cached by file content and parser version, so re-uploading the same bytes
+        skips the parser entirely.
+        """
         try:
-            print("file path ",file_path)
-            file_content = read_and_parse_file(file_path, content_type)
+            with stage("parse"):
+                return self._parse_file(file_path, content_type)
         except Exception as e:
-            print(f"Error Processing file: {e}")
+            logger.warning("parsing %s failed: %s", file_path, e)
             raise ValueError(f"Error Processing file: {e}")
 
+    def _parse_file(self, file_path: str, content_type: str) -> str:
+        cache_key = None
+        if self.parse_cache is not None and content_type in PARSED_CONTENT_TYPES:
+            # Range-wise conversion can join text differently at range boundaries, so it is its own version.
+            parser_version = f"{PARSER_VERSION}/parallel={self.config.PARSE_WORKERS > 1}"
+            cache_key = ParsedDocumentCache.make_key(parser_version, content_type, file_sha256(file_path))
+            cached = self.parse_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        text = read_and_parse_file(file_path, content_type, timeout=self.config.PARSER_TIMEOUT,
+                                   fallback_timeout=self.config.FALLBACK_PARSER_TIMEOUT,
+                                   parallel_workers=self.config.PARSE_WORKERS,
+                                   parallel_min_units=self.config.PARSE_PARALLEL_MIN_UNITS,
+                                   max_stalled=self.config.PARSER_MAX_STALLED)
+        if cache_key is not None and text:
+            self.parse_cache.put(cache_key, text)
+        return text
+
+    def chunk_content(self, file_content: str, content_type: str) -> List[Chunk]:
+        """Splits parsed text into chunks using the strategy for its content type."""
+        with stage("chunk"):
+            return self._chunk_content(file_content, content_type)
+
+    def _chunk_content(self, file_content: str, content_type: str) -> List[Chunk]:
+        if (content_type == "application/pdf" or content_type =="application/vnd.openxmlformats-officedocument.wordprocessingml.document"): # seperate chunking for pdf and docx cause most prolly will get markdown chunking.
+            return self.chunk_pdf_docx(file_content)
+        elif (content_type == "text/plain"):
+            return self.text_splitter.split_text(file_content)
+        else:# json case
+            return list(self.hierarchical_chunk_json(io.BytesIO(file_content.encode("utf-8"))))
+
+    def process_and_index_document(self, file_path: str, file_name:str, content_type: str, metadata: dict = None,oldid:str=None) -> str:
+        """Reads, parses, chunks, embeds, and indexes a document."""
         # Generate a unique ID for the document
-        print("oldid ",oldid)
         document_id = str(uuid.uuid4())
         if(oldid is not None):
             document_id=oldid
-        print("id generated")
-        document = Document(id=document_id, filename=file_name, content=file_content, content_type=content_type, metadata=metadata or {})
-        print("chunking")
-        
-        if (content_type == "application/pdf" or content_type =="application/vnd.openxmlformats-officedocument.wordprocessingml.document"): # seperate chunking for pdf and docx cause most prolly will get markdown chunking.
-            chunks = self.chunk_pdf_docx(file_content)
-            document.content = chunks
-        elif (content_type == "text/plain"):
-            chunks = self.text_splitter.split_text(file_content)
-            document.content = chunks
-        else:# json case
-            # chunks, hierarchy_paths=self.hierarchical_chunk_json(json.loads(file_content))
-            # embeddings = [self.embedding_service.generate_embedding(chunk) for chunk in chunks]
-            # self.weaviate_service.index_json_document(document,chunks,hierarchy_paths,embeddings)
-            chunks=[file_content]
-            document.content=chunks
-            
-        print("chunking done")
-        embeddings = [self.embedding_service.generate_embedding(chunk) for chunk in chunks]
-        print("reached before weaviate call")
-        self.weaviate_service.index_document(document, embeddings)
-        return document_id
+        if content_type == "application/json":
+            with open(file_path, "rb") as stream:
+                return self.index_chunks(document_id, file_name, content_type, metadata, self.hierarchical_chunk_json(stream))
+
+        file_content = self.parse_file(file_path, content_type)
+        chunks = self.chunk_content(file_content, content_type)
+        return self.index_chunks(document_id, file_name, content_type, metadata, chunks)
+
+    def index_chunks(self, document_id: str, file_name: str, content_type: str, metadata: dict, chunks: Iterable[Chunk]) -> str:
+        """Embeds and indexes chunks as a new document, STREAM_WINDOW_CHUNKS at a time.
+
+        `chunks` may be a generator: only one window of chunks and embeddings is held in memory.
+        If any window fails, everything already written for the document is removed again.
+        """
+        written = 0
+        try:
+            for document, identities in self._index_windows(document_id, file_name, content_type, metadata, chunks):
+                with stage("embed"):
+                    embeddings = self.embedding_service.generate_embeddings(document.content)
+                with stage("index"):
+                    self.weaviate_service.index_document(document, embeddings, start_index=written, identities=identities)
+                written += len(document.content)
+        except Exception:
+            if self._rolls_back(document_id, written):
+                self.weaviate_service.delete_document(document_id)
+            raise
+        finally:
+            self._invalidate_queries(document_id)
+        return self._indexed(document_id, written)
+
+    def process_and_index_stream(self, stream: BinaryIO, file_name: str, content_type: str, metadata: dict = None) -> str:
+        """Indexes a plain-text or JSON upload straight from its stream: read -> chunk -> embed -> write,
+        one window at a time, without a temp file or the whole document in memory."""
+        return self.index_chunks(str(uuid.uuid4()), file_name, content_type, metadata, self._stream_chunks(stream, content_type))
+
+    def _stream_chunks(self, stream: BinaryIO, content_type: str) -> Iterator[Chunk]:
+        if content_type == "text/plain":
+            blocks = iter_text_blocks(stream, self.config.STREAM_READ_BYTES)
+            return iter_text_chunks(blocks, self.config.CHUNK_SIZE, self.config.CHUNK_OVERLAP)
+        if content_type == "application/json":
+            return self.hierarchical_chunk_json(stream)
+        raise ValueError(f"Streaming ingest is not supported for {content_type}")
 
     def update_document(self, document_id: str, file_path: str, file_name:str, content_type: str, metadata: dict = None) -> str:
-        """Deletes the old document and indexes the new one."""
-        old_id=self.delete_document(document_id)
-        print("deleted document id ",document_id,"\nrenewing new document with ",document_id,"\n",file_path)
-        return self.process_and_index_document(file_path, file_name, content_type, metadata,oldid=old_id)
+        """Re-chunks the new file and applies only the chunk-level changes to the stored document."""
+        file_content = self.parse_file(file_path, content_type)
+        chunks = self.chunk_content(file_content, content_type)
+        return self.update_chunks(document_id, file_name, content_type, metadata, chunks)
+
+    def update_chunks(self, document_id: str, file_name: str, content_type: str, metadata: dict, chunks: List[Chunk]) -> str:
+        """Moves a stored document to a new chunk list, embedding and writing only what changed."""
+        with stage("manifest"):
+            stored = self.weaviate_service.get_chunk_manifest(document_id)
+        if not stored:
+            return self.index_chunks(document_id, file_name, content_type, metadata, chunks)
+
+        document, diff, new_texts = self._plan_update(document_id, file_name, content_type, metadata, chunks, stored)
+        with stage("embed"):
+            embeddings = self.embedding_service.generate_embeddings(new_texts)
+        try:
+            with stage("apply_diff"):
+                return self.weaviate_service.apply_chunk_diff(document, diff, embeddings)
+        finally:
+            # Also on failure: a partially applied diff has still changed what queries return.
+            self._invalidate_queries(document_id)
+
+    def diff_chunks(self, document: Document, stored: List[StoredChunk]) -> ChunkDiff:
+        """Compares the new chunk list of `document` with its stored chunks by content hash."""
+        identities = chunk_identities(document.id, document.content)
+        remaining = {chunk.uuid: chunk for chunk in stored}
+        metadata = str(document.metadata)
+        new_indices = []
+        updates = {}
+        for index, (_, object_id) in enumerate(identities):
+            old = remaining.pop(object_id, None)
+            if old is None:
+                new_indices.append(index)
+                continue
+            patch = {}
+            if old.chunk_sort_key != index:
+                patch["chunk_sort_key"] = index
+            if old.filename != document.filename:
+                patch["filename"] = document.filename
+            if old.metadata != metadata:
+                patch["metadata"] = metadata
+            if patch:
+                updates[object_id] = patch
+        return ChunkDiff(
+            identities=identities, new_indices=new_indices, updates=updates, removed_uuids=list(remaining),
+            stored_version=max((chunk.doc_version or 0 for chunk in stored), default=0),
+            unversioned_uuids=[chunk.uuid for chunk in stored if chunk.doc_version is None],
+        )
 
 
     def delete_document(self, document_id: str):
         """Deletes a document from Weaviate."""
-        return self.weaviate_service.delete_document(document_id)
+        try:
+            return self.weaviate_service.delete_document(document_id)
+        finally:
+            self._invalidate_queries(document_id)
+
+    def _invalidate_queries(self, document_id: str):
+        if self.query_cache is not None:
+            self.query_cache.invalidate_document(document_id)
+
+    def embed_query(self, query_text: str) -> List[float]:
+        """Embeds a query, reusing a cached embedding of the same text when there is one."""
+        with stage("query_embed"):
+            return self._embed_query(query_text)
+
+    def _embed_query(self, query_text: str) -> List[float]:
+        if self.query_cache is None:
+            return self.embedding_service.generate_embedding(query_text)
+        (query_embedding,), missing = self._cached_embeddings([query_text])
+        if query_embedding is None:
+            query_embedding = self.embedding_service.generate_embedding(query_text)
+            self.query_cache.put_embedding(self.embedding_service.model, query_text, query_embedding)
+        return query_embedding
+
+    def embed_queries(self, query_texts: List[str]) -> List[List[float]]:
+        """Embeds many queries with one batched embedding call, reusing cached query embeddings."""
+        with stage("query_embed"):
+            return self._embed_queries(query_texts)
+
+    def _embed_queries(self, query_texts: List[str]) -> List[List[float]]:
+        if self.query_cache is None:
+            return self.embedding_service.generate_embeddings(query_texts, priority="query")
+        embeddings, missing = self._cached_embeddings(query_texts)
+        if missing:
+            fresh = dict(zip(missing, self.embedding_service.generate_embeddings(missing, priority="query")))
+            embeddings = self._fill_embeddings(query_texts, embeddings, fresh)
+        return embeddings
+
+    def _query_pool(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._query_executor is None:
+                self._query_executor = ThreadPoolExecutor(
+                    max_workers=self.config.QUERY_BATCH_CONCURRENCY, thread_name_prefix="query"
+                )
+            return self._query_executor
+
+    def _search(self, query: QueryRequest, query_embedding: Optional[List[float]]) -> List[QueryResult]:
+        with stage("search"):
+            return self._search_store(query, query_embedding)
+
+    def _search_store(self, query: QueryRequest, query_embedding: Optional[List[float]]) -> List[QueryResult]:
+        method, args = self._search_call(query, query_embedding)
+        return getattr(self.weaviate_service, method)(*args, hierarchy_path=query.hierarchy_path)
+
+    def query_documents(self, requests: List[QueryRequest]) -> List[Union[List[QueryResult], Exception]]:
+        """Runs a fan-out of queries at roughly the latency of one.
+
+        Cached results are served directly, the query texts of all other non-keyword queries are embedded
+        in a single batched call and the searches run concurrently (QUERY_BATCH_CONCURRENCY at a time).
+        Returns, per request, either its results or the exception that failed it.
+        """
+        outcomes, generations, pending = self._plan_batch(requests)
+        if not pending:
+            return outcomes
+
+        embedded = [i for i in pending if requests[i].mode != "keyword"]
+        embeddings = dict.fromkeys(pending)
+        if embedded:
+            try:
+                embeddings.update(zip(embedded, self.embed_queries([requests[i].query for i in embedded])))
+            except Exception as e:
+                pending = self._embedding_failed(requests, outcomes, pending, embedded, e)
+
+        trace_id = get_trace_id()
+
+        def search(i):
+            try:
+                with trace(trace_id):
+                    results = self._search(requests[i], embeddings[i])
+            except Exception as e:
+                return e
+            return self._remember(requests[i], generations[i], results)
+
+        for i, outcome in zip(pending, self._query_pool().map(search, pending)):
+            outcomes[i] = outcome
+        return outcomes
+
+    def close(self):
+        with self._executor_lock:
+            if self._query_executor is not None:
+                self._query_executor.shutdown(wait=False)
+                self._query_executor = None
+
+    def query_document(self, document_id: str, query_text: str,limit:int=5, hierarchy_path: str = None, mode: str = None) -> list:
+        """Queries a document (or every document for ""), optionally within one JSON subtree.
+
+        `mode` is "vector" (embed the query, then vector search), "keyword" (BM25 only, no embedding
+        call) or "hybrid" (both, fused by rank); it defaults to QUERY_MODE_DEFAULT.
+        """
+        query = self._query_request(document_id, query_text, limit, hierarchy_path, mode)
+        generation, results = self._cached_results(query)
+        if results is not None:
+            return results
+        results = self._search(query, None if query.mode == "keyword" else self.embed_query(query_text))
+        return self._remember(query, generation, results)
+
+    def _time_budget(self, time_budget_ms: Optional[float]) -> Optional[float]:
+        """Seconds a scoped query may take: QUERY_TIME_BUDGET_MS (0 = none), or less if the request asks."""
+        budgets = [budget for budget in (self.config.QUERY_TIME_BUDGET_MS, time_budget_ms) if budget]
+        return min(budgets) / 1000 if budgets else None
+
+    def query_scope(self, document_ids: Optional[List[str]], query_text: str, limit: int = 5, hierarchy_path: str = None,
+                    mode: str = None, time_budget_ms: float = None) -> GatheredResults:
+        """Queries several documents, or the whole corpus for document_ids None, in one ranking.
+
+        The query is embedded once and the vector store searches the documents' partitions in parallel.
+        The time budget covers both; partitions that have not answered when it runs out are listed in
+        `missing` and the other results come back with `partial` set. Results are not cached, since any
+        document in scope can change them.
+        """
+        mode = self._scope_mode(mode)
+        deadline = deadline_after(self._time_budget(time_budget_ms))
+        query_embedding = None if mode == "keyword" else self.embed_query(query_text)
+        with stage("search"):
+            return self.weaviate_service.query_scope(document_ids, mode, query_text, query_embedding, limit,
+                                                     hierarchy_path, timeout=remaining(deadline))
+
+    # The steps of indexing, updating and querying that do no I/O, shared by the sync and async paths.
+
+    def _index_windows(self, document_id: str, file_name: str, content_type: str, metadata: dict,
+                       chunks: Iterable[Chunk]) -> Iterator[Tuple[Document, list]]:
+        """One Document per STREAM_WINDOW_CHUNKS window of `chunks`, with its chunk identities."""
+        seen = {}
+        for window in batched(chunks, self.config.STREAM_WINDOW_CHUNKS):
+            texts, paths = split_hierarchy(window)
+            document = Document(id=document_id, filename=file_name, content=texts, content_type=content_type, metadata=metadata or {}, hierarchy_paths=paths)
+            yield document, chunk_identities(document_id, texts, seen)
+
+    @staticmethod
+    def _rolls_back(document_id: str, written: int) -> bool:
+        """Whether a failed indexing run left chunks behind that must be deleted again."""
+        if written:
+            logger.warning("indexing %s failed after %d chunks, rolling back", document_id, written)
+        return bool(written)
+
+    @staticmethod
+    def _indexed(document_id: str, written: int) -> str:
+        DOCUMENT_CHUNKS.observe(written)
+        logger.info("indexed %s: %d chunks", document_id, written)
+        return document_id
+
+    def _plan_update(self, document_id: str, file_name: str, content_type: str, metadata: dict, chunks: List[Chunk],
+                     stored: List[StoredChunk]) -> Tuple[Document, ChunkDiff, List[str]]:
+        """The new document, its diff against the stored chunks and the texts that need embeddings."""
+        texts, paths = split_hierarchy(chunks)
+        document = Document(id=document_id, filename=file_name, content=texts, content_type=content_type, metadata=metadata or {}, hierarchy_paths=paths)
+        diff = self.diff_chunks(document, stored)
+        logger.info("updating %s: %d new, %d removed, %d changed chunks",
+                    document_id, len(diff.new_indices), len(diff.removed_uuids), len(diff.updates))
+        return document, diff, [texts[i] for i in diff.new_indices]
+
+    def _query_request(self, document_id: str, query_text: str, limit: int, hierarchy_path: str, mode: str) -> QueryRequest:
+        query = QueryRequest(document_id=document_id, query=query_text, limit=limit, hierarchy_path=hierarchy_path,
+                             mode=mode or self.config.QUERY_MODE_DEFAULT)
+        if query.mode not in QUERY_MODES:
+            raise ValueError(f"Unknown query mode: {query.mode}")
+        return query
+
+    @staticmethod
+    def _search_call(query: QueryRequest, query_embedding: Optional[List[float]]) -> Tuple[str, tuple]:
+        """The vector store method that answers `query` (its _async twin on the event loop) and its arguments."""
+        if query.mode == "keyword":
+            return "query_keyword", (query.document_id, query.query, query.limit)
+        if query.mode == "hybrid":
+            return "query_hybrid", (query.document_id, query.query, query_embedding, query.limit)
+        return "query_document", (query.document_id, query_embedding, query.limit)
+
+    def _scope_mode(self, mode: Optional[str]) -> str:
+        mode = mode or self.config.QUERY_MODE_DEFAULT
+        if mode not in QUERY_MODES:
+            raise ValueError(f"Unknown query mode: {mode}")
+        return mode
+
+    def _cached_results(self, query: QueryRequest) -> Tuple[Optional[int], Optional[List[QueryResult]]]:
+        """The document's cache generation and the cached results of `query` (None, None without a cache).
+        The generation is read before searching, so a result computed while the document changes is never served."""
+        if self.query_cache is None:
+            return None, None
+        generation = self.query_cache.generation(query.document_id)
+        return generation, self.query_cache.get_results(query.document_id, generation, query.query, query.limit,
+                                                        query.hierarchy_path, query.mode)
+
+    def _remember(self, query: QueryRequest, generation: Optional[int], results: List[QueryResult]) -> List[QueryResult]:
+        if self.query_cache is not None:
+            self.query_cache.put_results(query.document_id, generation, query.query, query.limit, results,
+                                         query.hierarchy_path, query.mode)
+        return results
+
+    def _cached_embeddings(self, query_texts: List[str]) -> Tuple[List[Optional[List[float]]], List[str]]:
+        """The cached embedding of every text (None if not cached) and the distinct texts to embed."""
+        model = self.embedding_service.model
+        embeddings = [self.query_cache.get_embedding(model, text) for text in query_texts]
+        missing = list(dict.fromkeys(text for text, embedding in zip(query_texts, embeddings) if embedding is None))
+        return embeddings, missing
+
+    def _fill_embeddings(self, query_texts: List[str], embeddings: List[Optional[List[float]]],
+                         fresh: Dict[str, List[float]]) -> List[List[float]]:
+        model = self.embedding_service.model
+        for text, embedding in fresh.items():
+            self.query_cache.put_embedding(model, text, embedding)
+        return [fresh[text] if embedding is None else embedding for text, embedding in zip(query_texts, embeddings)]
+
+    def _plan_batch(self, requests: List[QueryRequest]) -> Tuple[list, Dict[int, int], List[int]]:
+        """Validates a batch and serves what the cache holds. Returns the outcomes so far, the cache
+        generation of every request still to search, and those requests' indices."""
+        outcomes = [None] * len(requests)
+        generations = {}
+        pending = []
+        for i, query in enumerate(requests):
+            if query.mode not in QUERY_MODES:
+                outcomes[i] = ValueError(f"Unknown query mode: {query.mode}")
+                continue
+            generations[i], cached = self._cached_results(query)
+            if cached is not None:
+                outcomes[i] = cached
+                continue
+            pending.append(i)
+        return outcomes, generations, pending
+
+    @staticmethod
+    def _embedding_failed(requests: List[QueryRequest], outcomes: list, pending: List[int], embedded: List[int],
+                          error: Exception) -> List[int]:
+        """Fails the requests whose query embedding failed; returns the keyword requests that can still run."""
+        for i in embedded:
+            outcomes[i] = error
+        return [i for i in pending if requests[i].mode == "keyword"]
+
+    # Async variants for the ASGI app (asgi.py). They share the steps above, wait on the embedding and
+    # vector store clients without holding a thread, and read and write the query cache (Redis) from
+    # a worker thread.
+
+    async def embed_query_async(self, query_text: str) -> List[float]:
+        with stage("query_embed"):
+            if self.query_cache is None:
+                return await self.embedding_service.generate_embedding_async(query_text)
+            (query_embedding,), missing = await asyncio.to_thread(self._cached_embeddings, [query_text])
+            if query_embedding is None:
+                query_embedding = await self.embedding_service.generate_embedding_async(query_text)
+                await asyncio.to_thread(self.query_cache.put_embedding, self.embedding_service.model, query_text,
+                                        query_embedding)
+            return query_embedding
+
+    async def embed_queries_async(self, query_texts: List[str]) -> List[List[float]]:
+        with stage("query_embed"):
+            if self.query_cache is None:
+                return await self.embedding_service.generate_embeddings_async(query_texts, priority="query")
+            embeddings, missing = await asyncio.to_thread(self._cached_embeddings, query_texts)
+            if missing:
+                fresh = dict(zip(missing, await self.embedding_service.generate_embeddings_async(missing, priority="query")))
+                embeddings = await asyncio.to_thread(self._fill_embeddings, query_texts, embeddings, fresh)
+            return embeddings
+
+    async def _search_async(self, query: QueryRequest, query_embedding: Optional[List[float]]) -> List[QueryResult]:
+        method, args = self._search_call(query, query_embedding)
+        with stage("search"):
+            return await getattr(self.weaviate_service, f"{method}_async")(*args, hierarchy_path=query.hierarchy_path)
+
+    async def query_document_async(self, document_id: str, query_text: str, limit: int = 5, hierarchy_path: str = None,
+                                   mode: str = None) -> list:
+        query = self._query_request(document_id, query_text, limit, hierarchy_path, mode)
+        generation, results = await asyncio.to_thread(self._cached_results, query)
+        if results is not None:
+            return results
+        results = await self._search_async(query, None if query.mode == "keyword" else await self.embed_query_async(query_text))
+        return await asyncio.to_thread(self._remember, query, generation, results)
+
+    async def query_scope_async(self, document_ids: Optional[List[str]], query_text: str, limit: int = 5,
+                                hierarchy_path: str = None, mode: str = None, time_budget_ms: float = None) -> GatheredResults:
+        mode = self._scope_mode(mode)
+        deadline = deadline_after(self._time_budget(time_budget_ms))
+        query_embedding = None if mode == "keyword" else await self.embed_query_async(query_text)
+        with stage("search"):
+            return await self.weaviate_service.query_scope_async(document_ids, mode, query_text, query_embedding, limit,
+                                                                 hierarchy_path, timeout=remaining(deadline))
+
+    async def query_documents_async(self, requests: List[QueryRequest]) -> List[Union[List[QueryResult], Exception]]:
+        """query_documents on the event loop: one batched embedding call, then the searches as tasks,
+        QUERY_BATCH_CONCURRENCY at a time."""
+        outcomes, generations, pending = await asyncio.to_thread(self._plan_batch, requests)
+        if not pending:
+            return outcomes
+
+        embedded = [i for i in pending if requests[i].mode != "keyword"]
+        embeddings = dict.fromkeys(pending)
+        if embedded:
+            try:
+                embeddings.update(zip(embedded, await self.embed_queries_async([requests[i].query for i in embedded])))
+            except Exception as e:
+                pending = self._embedding_failed(requests, outcomes, pending, embedded, e)
+
+        slots = asyncio.Semaphore(self.config.QUERY_BATCH_CONCURRENCY)
+
+        async def search(i):
+            try:
+                async with slots:
+                    results = await self._search_async(requests[i], embeddings[i])
+            except Exception as e:
+                return e
+            return await asyncio.to_thread(self._remember, requests[i], generations[i], results)
+
+        for i, outcome in zip(pending, await asyncio.gather(*(search(i) for i in pending))):
+            outcomes[i] = outcome
+        return outcomes
+
+    async def index_chunks_async(self, document_id: str, file_name: str, content_type: str, metadata: dict,
+                                 chunks: Iterable[Chunk]) -> str:
+        windows = self._index_windows(document_id, file_name, content_type, metadata, chunks)
+        written = 0
+        try:
+            # `chunks` may be a generator that reads and chunks an upload: advance it off the event loop.
+            while (window := await asyncio.to_thread(next, windows, None)) is not None:
+                document, identities = window
+                with stage("embed"):
+                    embeddings = await self.embedding_service.generate_embeddings_async(document.content)
+                with stage("index"):
+                    await self.weaviate_service.index_document_async(document, embeddings, start_index=written, identities=identities)
+                written += len(document.content)
+        except Exception:
+            if self._rolls_back(document_id, written):
+                await self.weaviate_service.delete_document_async(document_id)
+            raise
+        finally:
+            self._invalidate_queries(document_id)
+        return self._indexed(document_id, written)
+
+    async def process_and_index_stream_async(self, stream: BinaryIO, file_name: str, content_type: str,
+                                             metadata: dict = None) -> str:
+        return await self.index_chunks_async(str(uuid.uuid4()), file_name, content_type, metadata,
+                                             self._stream_chunks(stream, content_type))
+
+    async def update_chunks_async(self, document_id: str, file_name: str, content_type: str, metadata: dict,
+                                  chunks: List[Chunk]) -> str:
+        with stage("manifest"):
+            stored = await self.weaviate_service.get_chunk_manifest_async(document_id)
+        if not stored:
+            return await self.index_chunks_async(document_id, file_name, content_type, metadata, chunks)
+
+        document, diff, new_texts = self._plan_update(document_id, file_name, content_type, metadata, chunks, stored)
+        with stage("embed"):
+            embeddings = await self.embedding_service.generate_embeddings_async(new_texts)
+        try:
+            with stage("apply_diff"):
+                return await self.weaviate_service.apply_chunk_diff_async(document, diff, embeddings)
+        finally:
+            self._invalidate_queries(document_id)
+
+    async def delete_document_async(self, document_id: str):
+        try:
+            return await self.weaviate_service.delete_document_async(document_id)
+        finally:
+            self._invalidate_queries(document_id)
+
+def parse_and_chunk(file_path: str, content_type: str, config_values: Dict[str, Any],
+                    trace_id: str = None) -> Tuple[List[Chunk], Dict[str, float]]:
+    """Parses and chunks a file without any network clients, so it can run in a worker process.
 
-    def query_document(self, document_id: str, query_text: str,limit:int=5) -> list:
-        """Generates an embedding for the query and queries Weaviate."""
-        query_embedding = self.embedding_service.generate_embedding(query_text)
-        return self.weaviate_service.query_document(document_id, query_embedding ,limit)
\ No newline at end of file
+    `config_values` holds the upper-case Config attributes as plain values. Returns the chunks and
+    the seconds spent parsing and chunking: metrics recorded in a worker process are not exported,
+    so the caller records them. Log lines carry `trace_id`.
+    """
+    configure_logging(config_values.get("LOG_LEVEL", "INFO"))
+    with trace(trace_id):
+        service = DocumentService(None, None, SimpleNamespace(**config_values))
+        started = time.perf_counter()
+        text = service.parse_file(file_path, content_type)
+        parsed = time.perf_counter()
+        chunks = service.chunk_content(text, content_type)
+        return chunks, {"parse": parsed - started, "chunk": time.perf_counter() - parsed}
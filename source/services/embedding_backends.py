@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import deque
+from typing import List
+from google import genai
+from source.utils.config import Config
+
+
+class GeminiEmbeddingBackend:
+    """Embeds texts with the Gemini embedding API. One call embeds a whole batch."""
+
+    def __init__(self, api_key: str, model: str):
+        self.model = model
+        self.client = genai.Client(api_key=api_key)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        result = self.client.models.embed_content(model=self.model, contents=texts)
+        return [embedding.values for embedding in result.embeddings]
+
+    async def embed_async(self, texts: List[str]) -> List[List[float]]:
+        result = await self.client.aio.models.embed_content(model=self.model, contents=texts)
+        return [embedding.values for embedding in result.embeddings]
+
+    async def aclose(self):
+        await self.client.aio.aclose()
+
+
+class FakeRateLimitError(Exception):
+    """What the fake backend raises over its quota; shaped like the API's 429 errors."""
+
+    code = 429
+
+
+class FakeEmbeddingBackend:
+    """Deterministic offline backend for tests and benchmarks.
+
+    Each token is hashed to a signed dimension, so equal texts always get equal vectors and
+    texts sharing words get similar ones. `latency` and `latency_per_item` (seconds) simulate
+    the cost of a network call, and `rpm` a per-minute quota: calls beyond it raise a 429.
+    """
+
+    _token_pattern = re.compile(r"\w+")
+
+    def __init__(self, dimensions: int = 768, latency: float = 0.0, latency_per_item: float = 0.0, model: str = "fake",
+                 rpm: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.latency_per_item = latency_per_item
+        self.model = f"{model}-{dimensions}"
+        self.client = None
+        self.rpm = rpm
+        self._calls = deque()
+        self._calls_lock = threading.Lock()
+
+    def _check_quota(self):
+        if not self.rpm:
+            return
+        now = time.monotonic()
+        with self._calls_lock:
+            while self._calls and self._calls[0] <= now - 60:
+                self._calls.popleft()
+            if len(self._calls) >= self.rpm:
+                raise FakeRateLimitError("429 RESOURCE_EXHAUSTED: fake embedding quota exceeded")
+            self._calls.append(now)
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for token in self._token_pattern.findall(text.lower()) or [text]:
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dimensions] += 1.0 if (value >> 32) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        self._check_quota()
+        delay = self.latency + self.latency_per_item * len(texts)
+        if delay:
+            time.sleep(delay)
+        return [self._vector(text) for text in texts]
+
+    async def embed_async(self, texts: List[str]) -> List[List[float]]:
+        self._check_quota()
+        delay = self.latency + self.latency_per_item * len(texts)
+        if delay:
+            await asyncio.sleep(delay)
+        return [self._vector(text) for text in texts]
+
+    async def aclose(self):
+        pass
+
+
+def create_embedding_backend(config: Config):
+    """Builds the embedding backend selected by `config.EMBEDDING_BACKEND`."""
+    if config.EMBEDDING_BACKEND == "gemini":
+        return GeminiEmbeddingBackend(api_key=config.GEMINI_API_KEY, model=config.EMBEDDING_MODEL)
+    if config.EMBEDDING_BACKEND == "fake":
+        return FakeEmbeddingBackend(
+            dimensions=config.EMBEDDING_DIMENSIONS,
+            latency=config.FAKE_EMBEDDING_LATENCY_MS / 1000,
+            latency_per_item=config.FAKE_EMBEDDING_LATENCY_PER_ITEM_MS / 1000,
+            rpm=config.FAKE_EMBEDDING_RPM,
+        )
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {config.EMBEDDING_BACKEND}")
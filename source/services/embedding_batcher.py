@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from source.utils.observability import (
+    EMBEDDING_MICROBATCH_CALLERS, EMBEDDING_MICROBATCH_FILL, EMBEDDING_MICROBATCH_WAIT_SECONDS,
+)
+
+
+class _Batch:
+    """Texts collected from several callers for one backend call. Equal texts are sent once."""
+
+    def __init__(self, wakeup: Callable[[], None]):
+        self.texts: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.enqueued: List[float] = []
+        self.result: Future = Future()
+        # Tells the leader the batch is full so it sends it before the window ends.
+        self.wakeup = wakeup
+
+    def add(self, texts: List[str]) -> List[int]:
+        self.enqueued.append(time.perf_counter())
+        slots = []
+        for text in texts:
+            position = self.positions.get(text)
+            if position is None:
+                position = self.positions[text] = len(self.texts)
+                self.texts.append(text)
+            slots.append(position)
+        return slots
+
+    def size_with(self, texts: List[str]) -> int:
+        return len(self.texts) + sum(1 for text in set(texts) if text not in self.positions)
+
+
+class MicroBatcher:
+    """Coalesces small embedding requests from concurrent callers into shared backend calls.
+
+    The first caller to find no open batch becomes its leader: it waits up to `window` seconds (less
+    if the batch reaches `max_size` texts), closes the batch and makes the one backend call for it.
+    Every other caller joining in the meantime just waits for its own vectors. No thread of its own
+    is needed, and threads (embed) and event-loop tasks (embed_async) can share a batch.
+    """
+
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]],
+                 embed_async: Callable[[List[str]], Awaitable[List[List[float]]]], window: float, max_size: int):
+        self._embed = embed
+        self._embed_async = embed_async
+        self.window = window
+        self.max_size = max_size
+        self._open: Optional[_Batch] = None
+        self._lock = threading.Lock()
+
+    def _join(self, texts: List[str], new_wakeup: Callable[[], Callable[[], None]]):
+        """Adds `texts` to the open batch, or opens a new one (with `texts`' caller as its leader).
+        Returns (batch, slots, leader)."""
+        with self._lock:
+            batch = self._open
+            if batch is not None and batch.size_with(texts) > self.max_size:
+                self._close(batch)
+                batch = None
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch(new_wakeup())
+            slots = batch.add(texts)
+            if len(batch.texts) >= self.max_size:
+                self._close(batch)
+            return batch, slots, leader
+
+    def _close(self, batch: _Batch):
+        """Stops `batch` from taking more texts and wakes its leader. Caller holds the lock."""
+        if self._open is batch:
+            self._open = None
+            batch.wakeup()
+
+    def _closed(self, batch: _Batch) -> List[str]:
+        with self._lock:
+            if self._open is batch:
+                self._open = None
+        sent = time.perf_counter()
+        for enqueued in batch.enqueued:
+            EMBEDDING_MICROBATCH_WAIT_SECONDS.observe(sent - enqueued)
+        EMBEDDING_MICROBATCH_CALLERS.observe(len(batch.enqueued))
+        EMBEDDING_MICROBATCH_FILL.observe(len(batch.texts) / self.max_size)
+        return batch.texts
+
+    def _abandon(self, batch: _Batch, error: BaseException):
+        """Fails the whole batch if its leader stops early (e.g. its task is cancelled)."""
+        with self._lock:
+            if self._open is batch:
+                self._open = None
+        if not batch.result.done():
+            batch.result.set_exception(error if isinstance(error, Exception) else RuntimeError("Embedding batch was abandoned"))
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        full = threading.Event()
+        batch, slots, leader = self._join(texts, lambda: full.set)
+        if leader:
+            try:
+                full.wait(self.window)
+                batch.result.set_result(self._embed(self._closed(batch)))
+            except BaseException as e:
+                self._abandon(batch, e)
+                if not isinstance(e, Exception):
+                    raise
+        vectors = batch.result.result()
+        return [vectors[slot] for slot in slots]
+
+    async def embed_async(self, texts: List[str]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        full = asyncio.Event()
+        batch, slots, leader = self._join(texts, lambda: lambda: loop.call_soon_threadsafe(full.set))
+        if leader:
+            try:
+                try:
+                    await asyncio.wait_for(full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+                batch.result.set_result(await self._embed_async(self._closed(batch)))
+            except BaseException as e:
+                self._abandon(batch, e)
+                if not isinstance(e, Exception):
+                    raise
+        vectors = await asyncio.wrap_future(batch.result)
+        return [vectors[slot] for slot in slots]
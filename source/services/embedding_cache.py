@@ -0,0 +1,135 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache in a local SQLite file.
+
+    Entries are keyed by sha256(model name, chunk text) and stored as float32 blobs. The database runs
+    in WAL mode so several gunicorn workers can read and write the same file concurrently. When the
+    table grows past `max_entries`, the least recently used rows are evicted.
+    """
+
+    # Hits only refresh last_used when it is older than this, so hot entries do not cause a write per read.
+    _touch_interval = 60.0
+
+    def __init__(self, path: str, max_entries: int = 200000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._connections = []
+        self._stats_lock = threading.Lock()
+        self._puts_since_eviction = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._stats_lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, List[float]]:
+        """Returns {text: vector} for the texts that are cached."""
+        keys = {self.make_key(model, text): text for text in texts}
+        conn = self._connection()
+        found = {}
+        stale = []
+        now = time.time()
+        key_list = list(keys)
+        # Stay well below SQLite's bound-parameter limit.
+        for start in range(0, len(key_list), 500):
+            part = key_list[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            for key, blob, last_used in rows:
+                found[keys[key]] = array("f", blob).tolist()
+                if now - last_used > self._touch_interval:
+                    stale.append(key)
+        if stale:
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in stale])
+            conn.commit()
+        unique = set(keys.values())
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+        return found
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text]).get(text)
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(self.make_key(model, text), array("f", vector).tobytes(), now) for text, vector in items.items()],
+        )
+        conn.commit()
+        with self._stats_lock:
+            self._puts_since_eviction += len(items)
+            check = self._puts_since_eviction >= max(1, self.max_entries // 100)
+            if check:
+                self._puts_since_eviction = 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Trims the table to 90% of max_entries, dropping least recently used rows first."""
+        conn = self._connection()
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count <= self.max_entries:
+            return
+        excess = count - int(self.max_entries * 0.9)
+        conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        conn.commit()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def close(self):
+        with self._stats_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # Connections can only be closed from their own thread; those go away with the thread.
+                pass
+        self._local.conn = None
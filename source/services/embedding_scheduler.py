@@ -0,0 +1,344 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from source.utils.config import Config
+from source.utils.observability import (
+    EMBEDDING_CONCURRENCY_LIMIT, EMBEDDING_RATE_LIMITED, EMBEDDING_SCHEDULER_WAIT_SECONDS, EMBEDDING_SHARED_RATE,
+)
+
+# Priority classes, most urgent first: interactive queries, then uploads, then bulk backfills.
+PRIORITIES = {"query": 0, "ingest": 1, "backfill": 2}
+
+# How long a waiter sleeps when it can only be unblocked by another caller (which also wakes it).
+_IDLE_WAIT = 1.0
+
+
+class EmbeddingRateLimited(Exception):
+    """Raised when the embedding API kept answering 429 for longer than EMBEDDING_RATE_LIMIT_MAX_WAIT."""
+
+
+def rate_limit_delay(error: BaseException) -> Optional[float]:
+    """The Retry-After delay of a rate-limit error (0 if it has none), or None for any other error."""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code != 429 and "RESOURCE_EXHAUSTED" not in str(error):
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class SharedBudget:
+    """Token bucket and back-off state of one API key, shared by every process on the host.
+
+    Kept in a small SQLite table (WAL mode, like the embedding cache). Calls read it with plain
+    (non-locking) selects; only taking a token under a rate limit, a 429 and the recovery after one
+    write, in short BEGIN IMMEDIATE transactions. `rate` starts at EMBEDDING_RATE_LIMIT_RPM, halves on every 429
+    and creeps back up on successes (AIMD); a 429 also starts a cooldown all processes wait out.
+    """
+
+    def __init__(self, path: str, name: str, rpm: float, burst: float, reserve: float, backoff_base: float):
+        self.path = path
+        self.name = name
+        self.max_rate = rpm / 60.0  # tokens per second, 0 = unlimited
+        self.burst = max(burst, 1.0 + reserve)
+        self.reserve = reserve
+        self.backoff_base = backoff_base
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS budget ("
+            " name TEXT PRIMARY KEY, tokens REAL NOT NULL, rate REAL NOT NULL, updated REAL NOT NULL,"
+            " cooldown_until REAL NOT NULL, strikes INTEGER NOT NULL)"
+        )
+        # Joining processes keep the current (possibly backed-off) rate; a lowered RPM setting applies at once.
+        conn.execute(
+            "INSERT INTO budget VALUES (?, ?, ?, ?, 0, 0) ON CONFLICT(name) DO UPDATE"
+            " SET rate = CASE WHEN rate > 0 THEN MIN(rate, excluded.rate) ELSE excluded.rate END",
+            (name, self.burst, self.max_rate, time.time()),
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def take(self, low_priority: bool) -> float:
+        """Takes one token. Returns 0 on success, else the seconds until one may be available.
+
+        Low-priority callers must leave `reserve` tokens in the bucket, so queries from any process
+        still find a token while uploads and backfills drain it.
+        """
+        conn = self._connection()
+        # Without a rate limit only a cooldown can hold the call back, and reading it takes no lock.
+        cooldown_until, = conn.execute("SELECT cooldown_until FROM budget WHERE name = ?", (self.name,)).fetchone()
+        now = time.time()
+        if cooldown_until > now:
+            return cooldown_until - now
+        if self.max_rate == 0:
+            return 0.0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, rate, updated, cooldown_until = conn.execute(
+                "SELECT tokens, rate, updated, cooldown_until FROM budget WHERE name = ?", (self.name,)
+            ).fetchone()
+            now = time.time()
+            if cooldown_until > now:
+                return cooldown_until - now
+            EMBEDDING_SHARED_RATE.set(rate * 60)
+            tokens = min(self.burst, tokens + (now - updated) * rate)
+            needed = 1.0 + (self.reserve if low_priority else 0.0)
+            wait = 0.0 if tokens >= needed else (needed - tokens) / rate
+            if not wait:
+                tokens -= 1.0
+            conn.execute("UPDATE budget SET tokens = ?, updated = ? WHERE name = ?", (tokens, now, self.name))
+            return wait
+        finally:
+            conn.execute("COMMIT")
+
+    def succeeded(self):
+        """Additive increase: every success adds 2% of the configured rate back, and clears the strikes.
+        Writes only while recovering from a 429."""
+        conn = self._connection()
+        rate, strikes = conn.execute("SELECT rate, strikes FROM budget WHERE name = ?", (self.name,)).fetchone()
+        if rate < self.max_rate or strikes > 0:
+            conn.execute(
+                "UPDATE budget SET rate = MIN(?, rate + ?), strikes = 0 WHERE name = ? AND (rate < ? OR strikes > 0)",
+                (self.max_rate, self.max_rate * 0.02, self.name, self.max_rate),
+            )
+
+    def throttled(self, retry_after: float) -> float:
+        """Multiplicative decrease after a 429: halves the rate, empties the bucket and starts a shared
+        cooldown that doubles with every consecutive 429. Returns this caller's jittered wait."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rate, cooldown_until, strikes = conn.execute(
+                "SELECT rate, cooldown_until, strikes FROM budget WHERE name = ?", (self.name,)
+            ).fetchone()
+            now = time.time()
+            delay = max(retry_after, self.backoff_base * (2 ** min(strikes, 6)))
+            cooldown_until = max(cooldown_until, now + delay)
+            rate = max(self.max_rate / 64, rate / 2)
+            conn.execute(
+                "UPDATE budget SET rate = ?, tokens = 0, updated = ?, cooldown_until = ?, strikes = ? WHERE name = ?",
+                (rate, now, cooldown_until, strikes + 1, self.name),
+            )
+        finally:
+            conn.execute("COMMIT")
+        # Full jitter on top of the cooldown, so waiting callers do not all retry at the same instant.
+        wait = cooldown_until - now
+        return wait + random.uniform(0, wait)
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # Connections can only be closed from their own thread; those go away with the thread.
+                pass
+
+
+class _Ticket:
+    __slots__ = ("level", "started")
+
+    def __init__(self, level: int):
+        self.level = level
+        self.started = time.perf_counter()
+
+
+class EmbeddingScheduler:
+    """Admits embedding calls by priority under a shared rate budget and an adaptive concurrency limit.
+
+    Waiters queue by (priority, arrival); only the head may take a token, so a waiting query always goes
+    before queued ingest work, and one concurrency slot is kept free of lower-priority calls. The
+    concurrency limit (at most EMBEDDING_MAX_CONCURRENCY) grows by about one per round of successful
+    calls, shrinks by 10% when a call takes longer than EMBEDDING_LATENCY_TARGET_MS and halves on a
+    429. Threads use acquire(), event-loop tasks acquire_async(); both share the same queue. The shared
+    budget is read outside the scheduler lock (on a worker thread for acquire_async), while the head of
+    the queue holds a claim that keeps other waiters from being admitted past it.
+    """
+
+    def __init__(self, config: Config, name: str):
+        self.max_concurrency = float(config.EMBEDDING_MAX_CONCURRENCY)
+        self.limit = self.max_concurrency
+        self.latency_target = config.EMBEDDING_LATENCY_TARGET_MS / 1000
+        self.budget = SharedBudget(
+            config.EMBEDDING_BUDGET_PATH, name, rpm=config.EMBEDDING_RATE_LIMIT_RPM,
+            burst=config.EMBEDDING_RATE_BURST, reserve=config.EMBEDDING_QUERY_RESERVE,
+            backoff_base=config.EMBEDDING_RETRY_BASE_DELAY,
+        )
+        self._waiting = []
+        self._in_flight = 0
+        self._claimed = None  # the waiter between its claim and its admission
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        EMBEDDING_CONCURRENCY_LIMIT.set(self.limit)
+
+    def _slots(self, level: int) -> int:
+        slots = int(self.limit)
+        return slots if level == 0 else max(1, slots - 1)
+
+    def _claim(self, entry) -> bool:
+        """Whether `entry` may try for a token now: it heads the queue, a slot is free and no other
+        waiter is between taking a token and being admitted."""
+        with self._lock:
+            if self._claimed is not None or self._waiting[0] is not entry or self._in_flight >= self._slots(entry[0]):
+                return False
+            self._claimed = entry
+            return True
+
+    def _take(self, entry) -> Optional[float]:
+        """Takes a token for a claimed entry and settles the claim. Returns None when admitted, else
+        how long to wait before trying again."""
+        wait = None
+        try:
+            wait = self.budget.take(low_priority=entry[0] > 0)
+        finally:
+            with self._lock:
+                self._claimed = None
+                if wait == 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._in_flight += 1
+                if self._waiting and self._waiting[0] is not entry:
+                    self._waiting[0][2]()
+        return wait or None
+
+    def _try_acquire(self, entry) -> Optional[float]:
+        """Admits `entry` if it is at the head of the queue and a slot and a token are free.
+        Returns None when admitted, else how long to wait before trying again."""
+        if not self._claim(entry):
+            return _IDLE_WAIT
+        return self._take(entry)
+
+    async def _try_acquire_async(self, entry) -> Optional[float]:
+        if not self._claim(entry):
+            return _IDLE_WAIT
+        # The budget lives in SQLite: read it off the event loop.
+        future = asyncio.get_running_loop().run_in_executor(None, self._take, entry)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(self._give_back_if_admitted)
+            raise
+
+    def _give_back_if_admitted(self, future):
+        """Frees the slot a cancelled acquire_async won after its caller stopped waiting."""
+        if not future.cancelled() and future.exception() is None and future.result() is None:
+            with self._lock:
+                self._in_flight -= 1
+                if self._waiting:
+                    self._waiting[0][2]()
+
+    def _enqueue(self, level: int, wake) -> tuple:
+        entry = (level, next(self._sequence), wake)
+        with self._lock:
+            heapq.heappush(self._waiting, entry)
+        return entry
+
+    def _leave(self, entry):
+        """Removes a waiter that gave up (interrupted or cancelled) and wakes the new head."""
+        with self._lock:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+            if self._waiting:
+                self._waiting[0][2]()
+
+    def acquire(self, priority: str) -> _Ticket:
+        level = PRIORITIES[priority]
+        woken = threading.Event()
+        started = time.perf_counter()
+        entry = self._enqueue(level, woken.set)
+        try:
+            while (wait := self._try_acquire(entry)) is not None:
+                woken.wait(wait)
+                woken.clear()
+        except BaseException:
+            self._leave(entry)
+            raise
+        EMBEDDING_SCHEDULER_WAIT_SECONDS.labels(priority).observe(time.perf_counter() - started)
+        return _Ticket(level)
+
+    async def acquire_async(self, priority: str) -> _Ticket:
+        level = PRIORITIES[priority]
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        started = time.perf_counter()
+        entry = self._enqueue(level, lambda: loop.call_soon_threadsafe(woken.set))
+        try:
+            while (wait := await self._try_acquire_async(entry)) is not None:
+                try:
+                    await asyncio.wait_for(woken.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                woken.clear()
+        except BaseException:
+            self._leave(entry)
+            raise
+        EMBEDDING_SCHEDULER_WAIT_SECONDS.labels(priority).observe(time.perf_counter() - started)
+        return _Ticket(level)
+
+    def release(self, ticket: _Ticket, error: BaseException = None) -> Optional[float]:
+        """Frees the ticket's slot and adapts to how the call went (`error` is None on success).
+        After a 429, returns how long the caller should wait before retrying; otherwise None."""
+        retry_after = self._free(ticket, error)
+        if retry_after is not None:
+            return self.budget.throttled(retry_after)
+        if error is None:
+            self.budget.succeeded()
+        return None
+
+    async def release_async(self, ticket: _Ticket, error: BaseException = None) -> Optional[float]:
+        """release() for event-loop callers: the shared budget is updated on a worker thread."""
+        retry_after = self._free(ticket, error)
+        if retry_after is not None:
+            return await asyncio.to_thread(self.budget.throttled, retry_after)
+        if error is None:
+            await asyncio.to_thread(self.budget.succeeded)
+        return None
+
+    def _free(self, ticket: _Ticket, error: Optional[BaseException]) -> Optional[float]:
+        """Frees the slot and adapts the concurrency limit. Returns the Retry-After delay of a 429."""
+        latency = time.perf_counter() - ticket.started
+        retry_after = rate_limit_delay(error) if error is not None else None
+        with self._lock:
+            self._in_flight -= 1
+            if retry_after is not None:
+                self.limit = max(1.0, self.limit / 2)
+            elif error is None:
+                if self.latency_target and latency > self.latency_target:
+                    self.limit = max(1.0, self.limit * 0.9)
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            EMBEDDING_CONCURRENCY_LIMIT.set(self.limit)
+            if self._waiting:
+                self._waiting[0][2]()
+        if retry_after is not None:
+            EMBEDDING_RATE_LIMITED.inc()
+        return retry_after
+
+    def close(self):
+        self.budget.close()
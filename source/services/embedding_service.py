@@ -1,28 +1,204 @@
+import asyncio
+import logging
 import os
-from google import genai
-from google.genai import types
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List
 # from sentence_transformers import SentenceTransformer
+from source.services.embedding_backends import create_embedding_backend
+from source.services.embedding_batcher import MicroBatcher
+from source.services.embedding_cache import EmbeddingCache
+from source.services.embedding_scheduler import PRIORITIES, EmbeddingRateLimited, EmbeddingScheduler
 from source.utils.config import Config
+from source.utils.observability import (
+    EMBEDDING_BATCH_SIZE, EMBEDDING_REQUEST_SECONDS, EMBEDDING_RETRIES, get_trace_id, record_cache, trace,
+)
+
+logger = logging.getLogger(__name__)
+
 class EmbeddingService:
-    def __init__(self, use_gemini=False, model_name=None):
+    def __init__(self, use_gemini=False, model_name=None, backend=None, config: Config = Config):
         self.use_gemini = use_gemini
-        self.client=None
-        if use_gemini:
-            client = genai.Client(api_key=Config.GEMINI_API_KEY)
+        self.config = config
+        self.batch_size = config.EMBEDDING_BATCH_SIZE
+        self.max_retries = config.EMBEDDING_MAX_RETRIES
+        if backend is None and (use_gemini or config.EMBEDDING_BACKEND != "gemini"):
+            backend = create_embedding_backend(config)
+        self.backend = backend
+        self.client = getattr(backend, "client", None)
+        self.model = getattr(backend, "model", model_name)
+        self.cache = None
+        if config.EMBEDDING_CACHE_ENABLED:
+            self.cache = EmbeddingCache(config.EMBEDDING_CACHE_PATH, max_entries=config.EMBEDDING_CACHE_MAX_ENTRIES)
+        # Shared across requests, so the cap on concurrent batches holds for the whole process.
+        self._executor = ThreadPoolExecutor(max_workers=config.EMBEDDING_MAX_CONCURRENCY, thread_name_prefix="embed")
+        # Every backend call, sync or async, takes a rate token and a concurrency slot from here first.
+        self.scheduler = EmbeddingScheduler(config, name=self.model) if backend is not None else None
+        # One batcher per priority class, so a query never waits in a batch scheduled as ingest.
+        self.batchers = {}
+        if backend is not None and getattr(config, "EMBEDDING_MICROBATCH_ENABLED", False):
+            self.batchers = {
+                priority: MicroBatcher(
+                    partial(self._embed_batch, priority=priority), partial(self._embed_batch_async, priority=priority),
+                    window=config.EMBEDDING_MICROBATCH_WINDOW_MS / 1000,
+                    max_size=min(config.EMBEDDING_MICROBATCH_MAX_SIZE, self.batch_size),
+                )
+                for priority in PRIORITIES
+            }
             
-            self.client=client
-            
-        print("embedder initialised")
+        logger.info("embedder initialised (%s)", self.model)
         # else:
         #     self.hf_model = SentenceTransformer(model_name)
             
 
-    def generate_embedding(self, text: str) -> list[float]:
-        if self.use_gemini:
-            result = self.client.models.embed_content(
-                model="text-embedding-004", contents=text
-            )
-            return result.embeddings[0].values
+    def generate_embedding(self, text: str, priority: str = "query") -> list[float]:
+        if self.backend is not None:
+            return self.generate_embeddings([text], priority=priority)[0]
         # else:
         #     return self.hf_model.encode(text).tolist()
 
+    def generate_embeddings(self, texts: List[str], priority: str = "ingest") -> List[List[float]]:
+        """Embeds many texts, `batch_size` per backend call, with up to EMBEDDING_MAX_CONCURRENCY
+        batches in flight. The result is in the same order as `texts`.
+
+        `priority` ('query', 'ingest' or 'backfill') is the scheduling class of the backend calls.
+        """
+        if not texts:
+            return []
+        known = {}
+        if self.cache is not None:
+            known = self.cache.get_many(self.model, texts)
+            record_cache("embedding", hits=len(known), misses=len(set(texts)) - len(known))
+        # Identical chunks (shared boilerplate) are embedded once.
+        missing = list(dict.fromkeys(text for text in texts if text not in known))
+        if missing:
+            fresh = dict(zip(missing, self._embed_uncached(missing, priority)))
+            if self.cache is not None:
+                self.cache.put_many(self.model, fresh)
+            known.update(fresh)
+        return [known[text] for text in texts]
+
+    def _embed_uncached(self, texts: List[str], priority: str) -> List[List[float]]:
+        batcher = self.batchers.get(priority)
+        if batcher is not None and len(texts) < batcher.max_size:
+            # Queries and small documents: share a backend call with concurrent requests.
+            return batcher.embed(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0], priority)
+        trace_id = get_trace_id()
+
+        def embed(batch):
+            with trace(trace_id):
+                return self._embed_batch(batch, priority)
+
+        embeddings = []
+        for vectors in self._executor.map(embed, batches):
+            embeddings.extend(vectors)
+        return embeddings
+
+    def _embed_batch(self, texts: List[str], priority: str = "ingest") -> List[List[float]]:
+        """Embeds one batch, retrying with jittered exponential backoff. Only a failed batch is
+        retried; batches that already succeeded are kept. Rate-limit (429) answers do not use up
+        the retries: the batch waits for the shared cooldown, for up to EMBEDDING_RATE_LIMIT_MAX_WAIT."""
+        attempt, throttled = 0, 0.0
+        while True:
+            ticket = self.scheduler.acquire(priority)
+            try:
+                EMBEDDING_BATCH_SIZE.observe(len(texts))
+                with EMBEDDING_REQUEST_SECONDS.time():
+                    vectors = self.backend.embed(texts)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"Embedding backend returned {len(vectors)} vectors for {len(texts)} texts")
+            except BaseException as e:
+                wait = self.scheduler.release(ticket, e)
+                if not isinstance(e, Exception):
+                    raise
+                attempt, throttled, delay = self._backoff(texts, e, wait, attempt, throttled)
+                time.sleep(delay)
+                continue
+            self.scheduler.release(ticket)
+            return vectors
+
+    def _backoff(self, texts: List[str], error: Exception, rate_limit_wait, attempt: int, throttled: float):
+        """After a failed batch, returns (attempt, seconds throttled so far, seconds to sleep),
+        or raises when the batch should not be tried again."""
+        if rate_limit_wait is not None:
+            throttled += rate_limit_wait
+            if throttled > self.config.EMBEDDING_RATE_LIMIT_MAX_WAIT:
+                raise EmbeddingRateLimited(
+                    f"Embedding API still rate limited after {throttled:.0f}s of back-off"
+                ) from error
+            logger.warning("embedding batch of %d rate limited, waiting %.1fs", len(texts), rate_limit_wait)
+            return attempt, throttled, rate_limit_wait
+        attempt += 1
+        if attempt > self.max_retries:
+            raise error
+        delay = self.config.EMBEDDING_RETRY_BASE_DELAY * (2 ** (attempt - 1))
+        EMBEDDING_RETRIES.inc()
+        logger.warning("embedding batch of %d failed (%s), retry %d/%d", len(texts), error, attempt, self.max_retries)
+        return attempt, throttled, delay + random.uniform(0, delay)
+
+    async def generate_embedding_async(self, text: str, priority: str = "query") -> List[float]:
+        return (await self.generate_embeddings_async([text], priority=priority))[0]
+
+    async def generate_embeddings_async(self, texts: List[str], priority: str = "ingest") -> List[List[float]]:
+        """generate_embeddings for the event loop: backend calls go through the backend's async client
+        and the SQLite cache is read and written from a worker thread."""
+        if not texts:
+            return []
+        known = {}
+        if self.cache is not None:
+            known = await asyncio.to_thread(self.cache.get_many, self.model, texts)
+            record_cache("embedding", hits=len(known), misses=len(set(texts)) - len(known))
+        missing = list(dict.fromkeys(text for text in texts if text not in known))
+        if missing:
+            batcher = self.batchers.get(priority)
+            if batcher is not None and len(missing) < batcher.max_size:
+                vectors = [await batcher.embed_async(missing)]
+            else:
+                batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+                vectors = await asyncio.gather(*(self._embed_batch_async(batch, priority) for batch in batches))
+            fresh = dict(zip(missing, (vector for batch in vectors for vector in batch)))
+            if self.cache is not None:
+                await asyncio.to_thread(self.cache.put_many, self.model, fresh)
+            known.update(fresh)
+        return [known[text] for text in texts]
+
+    async def _embed_batch_async(self, texts: List[str], priority: str = "ingest") -> List[List[float]]:
+        """_embed_batch without blocking the event loop, scheduled with the same budget."""
+        attempt, throttled = 0, 0.0
+        while True:
+            ticket = await self.scheduler.acquire_async(priority)
+            try:
+                EMBEDDING_BATCH_SIZE.observe(len(texts))
+                with EMBEDDING_REQUEST_SECONDS.time():
+                    vectors = await self.backend.embed_async(texts)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"Embedding backend returned {len(vectors)} vectors for {len(texts)} texts")
+            except BaseException as e:
+                wait = await self.scheduler.release_async(ticket, e)
+                if not isinstance(e, Exception):
+                    raise
+                attempt, throttled, delay = self._backoff(texts, e, wait, attempt, throttled)
+                await asyncio.sleep(delay)
+                continue
+            await self.scheduler.release_async(ticket)
+            return vectors
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else {}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self.cache is not None:
+            self.cache.close()
+        if self.scheduler is not None:
+            self.scheduler.close()
+
+    async def aclose(self):
+        """Closes the backend's async client; call from the event loop that used it."""
+        if self.backend is not None:
+            await self.backend.aclose()
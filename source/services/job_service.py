@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Optional
+from source.models import IngestJob
+from source.services.document_service import DocumentService, parse_and_chunk
+from source.utils.config import Config
+from source.utils.observability import get_trace_id, observe_stages, trace
+
+logger = logging.getLogger(__name__)
+
+
+_parse_started = None  # in parse worker processes: queue that receives each job's id as its parse starts
+
+
+def _init_parse_worker(started):
+    global _parse_started
+    _parse_started = started
+
+
+def parse_job(job_id: Optional[str], file_path: str, content_type: str, worker_config: dict, trace_id: str = None):
+    """parse_and_chunk in a parse worker, first telling the parent process that the job left the queue."""
+    if job_id is not None and _parse_started is not None:
+        _parse_started.put(job_id)
+    return parse_and_chunk(file_path, content_type, worker_config, trace_id)
+
+
+class JobQueueFull(Exception):
+    """Raised when the ingest queue is at INGEST_QUEUE_MAX and a new job cannot be accepted."""
+
+
+class IngestJobManager:
+    """Runs uploads and updates in the background.
+
+    Parsing and chunking are CPU-bound and run in a process pool; embedding and indexing are
+    network-bound and run in a thread pool that shares the process-wide services. At most
+    INGEST_QUEUE_MAX jobs are accepted but unfinished at any time. The pools start with the first
+    parse, so a process that never ingests spawns nothing.
+    Job state lives in this process only.
+    """
+
+    def __init__(self, document_service: DocumentService, config: Config):
+        self.document_service = document_service
+        self.config = config
+        self.max_pending = config.INGEST_QUEUE_MAX
+        # Plain values only, so the settings pickle into worker processes whatever the config class is.
+        self._worker_config = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+        self._parse_in_threads = False
+        # Parse workers report the jobs they pick up here, so a job stays "queued" while it waits for one.
+        self._parse_started = None
+        self._parse_pool = None
+        self._index_pool = ThreadPoolExecutor(max_workers=config.INGEST_INDEX_WORKERS, thread_name_prefix="ingest")
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, action: str, file_path: str, filename: str, content_type: str, metadata: dict = None,
+               document_id: str = None) -> IngestJob:
+        """Queues a file for ingest. The job owns `file_path` and deletes it once parsed."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"Ingest queue is full ({self.max_pending} jobs pending)")
+            self._pending += 1
+            job = IngestJob(
+                id=uuid.uuid4().hex,
+                action=action,
+                document_id=document_id or str(uuid.uuid4()),
+                filename=filename,
+                created_at=time.time(),
+                trace_id=get_trace_id(),
+            )
+            self._jobs[job.id] = job
+            self._trim_history()
+
+        try:
+            future = self._submit_parse(file_path, content_type, job.trace_id, job_id=job.id)
+        except Exception as e:
+            self._finish(job, file_path, error=e)
+            raise
+        future.add_done_callback(lambda f: self._on_parsed(job, file_path, content_type, metadata, f))
+        return job
+
+    def _new_parse_pool(self):
+        if multiprocessing.current_process().daemon:
+            # Daemonic processes (e.g. hypercorn workers) cannot have children.
+            logger.warning("running in a daemonic process, parsing in threads instead of processes")
+            self._parse_in_threads = True
+            return ThreadPoolExecutor(max_workers=self.config.INGEST_PARSE_WORKERS, thread_name_prefix="parse")
+        if self._parse_started is None:
+            self._parse_started = multiprocessing.get_context("spawn").SimpleQueue()
+            threading.Thread(target=self._watch_parse_starts, name="parse-starts", daemon=True).start()
+        # spawn, not fork: the parent holds gRPC/HTTP client threads that must not be forked.
+        return ProcessPoolExecutor(
+            max_workers=self.config.INGEST_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_parse_worker, initargs=(self._parse_started,),
+        )
+
+    def _pool(self):
+        with self._lock:
+            if self._parse_pool is None:
+                self._parse_pool = self._new_parse_pool()
+            return self._parse_pool
+
+    def _watch_parse_starts(self):
+        while True:
+            job_id = self._parse_started.get()
+            if job_id is None:
+                return
+            self._mark_started(job_id)
+
+    def _mark_started(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status == "queued":
+                job.status = "parsing"
+
+    def _parse_in_thread(self, job_id: Optional[str], *args):
+        if job_id is not None:
+            self._mark_started(job_id)
+        return parse_and_chunk(*args)
+
+    async def parse_async(self, file_path: str, content_type: str, trace_id: str = None):
+        """Parses and chunks a file in the parse pool, outside the job queue, and returns the chunks.
+        The async upload routes use it to keep parsing off the event loop."""
+        chunks, timings = await asyncio.wrap_future(self._submit_parse(file_path, content_type, trace_id))
+        self._observe(timings)
+        return chunks
+
+    def _observe(self, timings):
+        # Worker processes cannot export their metrics; parse threads have already recorded theirs.
+        if not self._parse_in_threads:
+            observe_stages(timings)
+
+    def _submit_parse(self, file_path: str, content_type: str, trace_id: str = None, job_id: str = None):
+        task = partial(self._parse_in_thread if self._parse_in_threads else parse_job,
+                       job_id, file_path, content_type, self._worker_config, trace_id)
+        try:
+            return self._pool().submit(task)
+        except BrokenProcessPool:
+            # A crashed worker (e.g. OOM on a huge file) breaks the whole pool; start a fresh one.
+            with self._lock:
+                self._parse_pool = self._new_parse_pool()
+            return self._parse_pool.submit(task)
+
+    def _on_parsed(self, job: IngestJob, file_path: str, content_type: str, metadata: dict, future):
+        try:
+            chunks, timings = future.result()
+            self._observe(timings)
+        except Exception as e:
+            self._finish(job, file_path, error=e)
+            return
+        self._remove_file(file_path)
+        try:
+            self._index_pool.submit(self._index, job, content_type, metadata, chunks)
+        except Exception as e:
+            self._finish(job, None, error=e)
+
+    def _index(self, job: IngestJob, content_type: str, metadata: dict, chunks):
+        job.status = "indexing"
+        with trace(job.trace_id):
+            try:
+                if job.action == "update":
+                    self.document_service.update_chunks(job.document_id, job.filename, content_type, metadata, chunks)
+                else:
+                    self.document_service.index_chunks(job.document_id, job.filename, content_type, metadata, chunks)
+            except Exception as e:
+                self._finish(job, None, error=e)
+                return
+            self._finish(job, None)
+
+    def _finish(self, job: IngestJob, file_path: Optional[str], error: Exception = None):
+        if file_path:
+            self._remove_file(file_path)
+        job.status = "failed" if error else "succeeded"
+        job.error = str(error) if error else None
+        job.finished_at = time.time()
+        if error:
+            with trace(job.trace_id):
+                logger.error("ingest job %s failed: %s", job.id, error)
+        else:
+            logger.info("ingest job %s %s %s in %.2f s", job.id, job.action, job.document_id, job.finished_at - job.created_at)
+        with self._lock:
+            self._pending -= 1
+
+    @staticmethod
+    def _remove_file(file_path: str):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    def _trim_history(self):
+        """Forgets the oldest finished jobs beyond JOB_HISTORY_MAX. Caller holds the lock."""
+        excess = len(self._jobs) - self.config.JOB_HISTORY_MAX
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at is not None][:excess]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def close(self):
+        if self._parse_started is not None:
+            self._parse_started.put(None)
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=False, cancel_futures=True)
+        self._index_pool.shutdown(wait=False, cancel_futures=True)
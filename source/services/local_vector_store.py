@@ -0,0 +1,647 @@
+import asyncio
+import heapq
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker
+    fcntl = None
+
+from source.models import Document, GatheredResults, QueryResult, StoredChunk, ChunkDiff
+from source.services.scatter_gather import check_scope, deadline_after, remaining, scatter
+from source.utils.config import Config
+from source.utils.hashing import chunk_identities, partition_name
+from source.utils.ranking import BM25Index, Statistics, merge_statistics, rrf_fuse
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class _IVFIndex:
+    """Inverted-file ANN index: rows are bucketed by nearest k-means centroid and a query only
+    scores the rows in its `nprobe` closest buckets."""
+
+    def __init__(self, vectors: np.ndarray, seed: int = 0, iterations: int = 8):
+        rows = vectors.shape[0]
+        self.rows = rows
+        nlist = max(1, int(np.sqrt(rows)))
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(vectors[np.sort(rng.choice(rows, size=min(rows, nlist * 64), replace=False))])
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            filled = counts > 0
+            centroids[filled] = _normalize(sums[filled])
+        self.centroids = centroids
+
+        labels = np.empty(rows, dtype=np.int32)
+        for start in range(0, rows, 65536):
+            block = np.asarray(vectors[start:start + 65536])
+            labels[start:start + 65536] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = min(nprobe, len(self.lists))
+        closest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[i] for i in closest])
+
+
+class _Snapshot:
+    """Immutable view of a partition. Writers publish a new one; readers never see half a batch."""
+
+    __slots__ = ("vectors", "alive", "records", "by_uuid", "ivf", "paths", "bm25")
+
+    def __init__(self, vectors=None, alive=None, records=None, by_uuid=None, ivf=None):
+        self.vectors = vectors
+        self.alive = alive if alive is not None else np.zeros(0, dtype=bool)
+        self.records = records if records is not None else []
+        self.by_uuid = by_uuid if by_uuid is not None else {}
+        self.ivf = ivf
+        self.paths = None
+        self.bm25 = None
+
+    def keyword_index(self) -> BM25Index:
+        """BM25 index over the chunk texts, built on first keyword query against this snapshot."""
+        if self.bm25 is None:
+            self.bm25 = BM25Index(record["content_chunk"] for record in self.records)
+        return self.bm25
+
+    def rows_under(self, path: str) -> np.ndarray:
+        """Rows holding leaves under the JSON `path`, via a lazily built path -> rows index."""
+        if self.paths is None:
+            paths = {}
+            for row, record in enumerate(self.records):
+                for chunk_path in record.get("hierarchy_paths", ()):
+                    paths.setdefault(chunk_path, []).append(row)
+            self.paths = {chunk_path: np.asarray(rows, dtype=np.int64) for chunk_path, rows in paths.items()}
+        return self.paths.get(path, np.zeros(0, dtype=np.int64))
+
+
+class _Partition:
+    """All chunks of one document: a float32 row file plus an append-only JSON-lines log.
+
+    A write appends rows to the vector file and fsyncs, then appends its log records followed by a
+    `commit` line and fsyncs again. Readers only apply records up to the last commit line, so a
+    crash mid-write leaves the previous state intact and the next writer truncates the torn tail.
+    """
+
+    def __init__(self, root: str, name: str, config: Config):
+        self.path = os.path.join(root, name)
+        self.lock_path = os.path.join(root, ".locks", name + ".lock")
+        self.config = config
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.generation = None
+        self.dim = None
+        self.rows = 0
+        self.log_offset = 0
+        self._stamp = None
+        self.snapshot = _Snapshot()
+
+    def _files(self, generation: int) -> Tuple[str, str]:
+        return (os.path.join(self.path, f"vectors-{generation}.f32"),
+                os.path.join(self.path, f"log-{generation}.jsonl"))
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with open(self.lock_path, "a") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _read_current(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.path, "CURRENT")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _disk_stamp(self):
+        try:
+            current = os.stat(os.path.join(self.path, "CURRENT")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if self.generation is None:
+            return (current, -1)
+        try:
+            return (current, os.path.getsize(self._files(self.generation)[1]))
+        except FileNotFoundError:
+            return (current, 0)
+
+    def refresh(self) -> bool:
+        """Applies batches committed by any process since the last refresh.
+        Returns False if the partition does not exist on disk."""
+        stamp = self._disk_stamp()
+        if stamp is not None and stamp == self._stamp:
+            return True
+        with self._lock:
+            current = self._read_current()
+            if current is None:
+                self._reset()
+                return False
+            if current["generation"] != self.generation:
+                self._reset()
+                self.generation = current["generation"]
+                self.dim = current["dim"]
+            vector_path, log_path = self._files(self.generation)
+            try:
+                with open(log_path, "rb") as f:
+                    f.seek(self.log_offset)
+                    data = f.read()
+            except FileNotFoundError:
+                data = b""
+
+            snapshot = self.snapshot
+            records = None
+            pending = []
+            consumed = 0
+            for line in data.splitlines(keepends=True):
+                if not line.endswith(b"\n"):
+                    break
+                consumed += len(line)
+                record = json.loads(line)
+                if record["op"] != "commit":
+                    pending.append(record)
+                    continue
+                if records is None:
+                    # Copy on write so concurrent readers keep a consistent snapshot.
+                    records = list(snapshot.records)
+                    alive = snapshot.alive.copy()
+                    by_uuid = dict(snapshot.by_uuid)
+                alive = self._apply(pending, records, alive, by_uuid)
+                pending = []
+                self.log_offset += consumed
+                consumed = 0
+
+            if records is not None:
+                self.rows = len(records)
+                vectors = None
+                if self.rows:
+                    vectors = np.memmap(vector_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+                self.snapshot = _Snapshot(vectors, alive, records, by_uuid, snapshot.ivf)
+            # The stamp taken before reading: anything appended since then triggers another refresh.
+            self._stamp = stamp
+            return True
+
+    @staticmethod
+    def _apply(batch: List[dict], records: list, alive: np.ndarray, by_uuid: Dict[str, int]) -> np.ndarray:
+        added = [record for record in batch if record["op"] == "add"]
+        if added:
+            alive = np.concatenate([alive, np.ones(len(added), dtype=bool)])
+        for record in batch:
+            op = record["op"]
+            if op == "add":
+                row = record["row"]
+                previous = by_uuid.get(record["uuid"])
+                if previous is not None:
+                    alive[previous] = False
+                by_uuid[record["uuid"]] = row
+                records.append(record["props"])
+            elif op == "del":
+                row = by_uuid.pop(record["uuid"], None)
+                if row is not None:
+                    alive[row] = False
+            elif op == "set":
+                row = by_uuid.get(record["uuid"])
+                if row is not None:
+                    records[row] = {**records[row], **record["props"]}
+        return alive
+
+    def write(self, uuids: List[str], props: List[dict], vectors: Optional[np.ndarray],
+              deletes: List[str] = (), updates: Dict[str, dict] = None):
+        """Appends one committed batch of inserts, deletes and property updates."""
+        with self._lock, self._file_lock():
+            self._stamp = None
+            if not self.refresh():
+                dim = vectors.shape[1] if vectors is not None and len(vectors) else self.config.EMBEDDING_DIMENSIONS
+                os.makedirs(self.path, exist_ok=True)
+                self._write_current(0, dim)
+                self.refresh()
+            vector_path, log_path = self._files(self.generation)
+
+            # Drop whatever a crashed writer left after the last commit.
+            with open(vector_path, "ab") as f:
+                f.truncate(self.rows * self.dim * 4)
+                if vectors is not None and len(vectors):
+                    f.write(np.ascontiguousarray(_normalize(vectors.astype(np.float32))).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            lines = [{"op": "add", "row": self.rows + i, "uuid": uuid, "props": p}
+                     for i, (uuid, p) in enumerate(zip(uuids, props))]
+            lines += [{"op": "set", "uuid": uuid, "props": p} for uuid, p in (updates or {}).items()]
+            lines += [{"op": "del", "uuid": uuid} for uuid in deletes]
+            lines.append({"op": "commit"})
+            with open(log_path, "ab") as f:
+                f.truncate(self.log_offset)
+                f.write(b"".join(json.dumps(line).encode("utf-8") + b"\n" for line in lines))
+                f.flush()
+                os.fsync(f.fileno())
+            self._stamp = None
+            self.refresh()
+            self._maybe_compact()
+
+    def _write_current(self, generation: int, dim: int):
+        tmp = os.path.join(self.path, "CURRENT.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"generation": generation, "dim": dim}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, "CURRENT"))
+
+    def _maybe_compact(self):
+        """Rewrites the partition without deleted rows once they make up most of it. Caller holds both locks."""
+        snapshot = self.snapshot
+        dead = int(len(snapshot.alive) - snapshot.alive.sum())
+        if dead < 1000 or dead * 2 < len(snapshot.alive):
+            return
+        old_generation = self.generation
+        generation = old_generation + 1
+        vector_path, log_path = self._files(generation)
+        keep = np.flatnonzero(snapshot.alive)
+        row_of = {row: uuid for uuid, row in snapshot.by_uuid.items()}
+        with open(vector_path, "wb") as f:
+            for start in range(0, len(keep), 65536):
+                f.write(np.ascontiguousarray(snapshot.vectors[keep[start:start + 65536]]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(log_path, "wb") as f:
+            for new_row, row in enumerate(keep):
+                line = {"op": "add", "row": new_row, "uuid": row_of[int(row)], "props": snapshot.records[row]}
+                f.write(json.dumps(line).encode("utf-8") + b"\n")
+            f.write(b'{"op": "commit"}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_current(generation, self.dim)
+        for path in self._files(old_generation):
+            os.remove(path)
+        self._stamp = None
+        self.refresh()
+
+    def drop(self):
+        with self._lock, self._file_lock():
+            # CURRENT goes first so other processes see the partition as gone immediately.
+            try:
+                os.remove(os.path.join(self.path, "CURRENT"))
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._reset()
+
+    def search(self, query: np.ndarray, limit: int, hierarchy_path: str = None) -> List[Tuple[float, dict]]:
+        """Returns (cosine similarity, record) for the `limit` best live rows, optionally only rows
+        within the JSON subtree at `hierarchy_path` (always scanned exactly)."""
+        if not self.refresh():
+            return []
+        snapshot = self.snapshot
+        rows = len(snapshot.records)
+        if rows == 0 or limit <= 0:
+            return []
+        candidates = None
+        if hierarchy_path:
+            candidates = snapshot.rows_under(hierarchy_path)
+            if len(candidates) == 0:
+                return []
+            scores = np.asarray(snapshot.vectors[candidates]) @ query
+            scores[~snapshot.alive[candidates]] = -np.inf
+        elif rows >= self.config.LOCAL_ANN_MIN_ROWS:
+            ivf = self._ivf(snapshot)
+            # Rows appended after the index was built are always scanned exactly.
+            candidates = np.unique(np.concatenate([ivf.candidates(query, self.config.LOCAL_ANN_NPROBE),
+                                                   np.arange(ivf.rows, rows)]))
+            scores = np.asarray(snapshot.vectors[candidates]) @ query
+            scores[~snapshot.alive[candidates]] = -np.inf
+        else:
+            scores = np.asarray(snapshot.vectors) @ query
+            scores[~snapshot.alive] = -np.inf
+        return self._top(snapshot, scores, candidates, limit)
+
+    def keyword_statistics(self, query_text: str) -> Statistics:
+        """This partition's share of the BM25 statistics of a query over several partitions."""
+        if not self.refresh() or not self.snapshot.records:
+            return 0, 0.0, {}
+        return self.snapshot.keyword_index().statistics(query_text)
+
+    def keyword_search(self, query_text: str, limit: int, hierarchy_path: str = None,
+                       statistics: Statistics = None) -> List[Tuple[float, dict]]:
+        """Returns (BM25 score, record) for the `limit` best live rows sharing a term with `query_text`,
+        scored with `statistics` (merged over several partitions) when given."""
+        if not self.refresh():
+            return []
+        snapshot = self.snapshot
+        if not snapshot.records or limit <= 0:
+            return []
+        scores = snapshot.keyword_index().scores(query_text, statistics)
+        scores[~snapshot.alive | (scores <= 0)] = -np.inf
+        candidates = None
+        if hierarchy_path:
+            candidates = snapshot.rows_under(hierarchy_path)
+            if len(candidates) == 0:
+                return []
+            scores = scores[candidates]
+        return self._top(snapshot, scores, candidates, limit)
+
+    @staticmethod
+    def _top(snapshot: _Snapshot, scores: np.ndarray, candidates: Optional[np.ndarray], limit: int) -> List[Tuple[float, dict]]:
+        """The `limit` best (score, record) pairs; scores[i] belongs to row candidates[i] (or row i)."""
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for position in top:
+            if scores[position] == -np.inf:
+                break
+            row = int(candidates[position]) if candidates is not None else int(position)
+            results.append((float(scores[position]), snapshot.records[row]))
+        return results
+
+    def _ivf(self, snapshot: _Snapshot) -> _IVFIndex:
+        """Returns the ANN index, (re)building it when the partition grew by more than 20% since."""
+        ivf = snapshot.ivf
+        rows = len(snapshot.records)
+        if ivf is None or rows > ivf.rows * 1.2:
+            with self._lock:
+                ivf = self.snapshot.ivf
+                if ivf is None or rows > ivf.rows * 1.2:
+                    ivf = _IVFIndex(snapshot.vectors)
+                    self.snapshot.ivf = ivf
+        return ivf
+
+
+class LocalVectorStore:
+    """In-process vector store with the same contract as WeaviateService.
+
+    Each document is its own partition under LOCAL_VECTOR_STORE_PATH: float32 vectors in a memory-mapped
+    file, searched by brute force (a NumPy dot product) below LOCAL_ANN_MIN_ROWS rows and through an IVF
+    index above. Writes are crash safe and guarded by a file lock, and every process picks up other
+    processes' commits on its next read, so several workers can share one directory.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.root = config.LOCAL_VECTOR_STORE_PATH
+        os.makedirs(self.root, exist_ok=True)
+        self._partitions = {}
+        self._lock = threading.Lock()
+        self._scatter_executor = None  # created by the first query over several documents
+
+    def _partition(self, document_id: str) -> _Partition:
+        name = partition_name(document_id)
+        with self._lock:
+            partition = self._partitions.get(name)
+            if partition is None:
+                partition = _Partition(self.root, name, self.config)
+                self._partitions[name] = partition
+            return partition
+
+    def _scatter_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._scatter_executor is None:
+                self._scatter_executor = ThreadPoolExecutor(
+                    max_workers=self.config.QUERY_SCATTER_CONCURRENCY, thread_name_prefix="local-scatter"
+                )
+            return self._scatter_executor
+
+    def _all_partitions(self) -> List[_Partition]:
+        names = [name for name in os.listdir(self.root) if not name.startswith(".")]
+        with self._lock:
+            for name in names:
+                if name not in self._partitions:
+                    self._partitions[name] = _Partition(self.root, name, self.config)
+            return [self._partitions[name] for name in names]
+
+    @staticmethod
+    def _props(document: Document, index: int, chunk_hash: str, sort_key: int = None) -> dict:
+        return {
+            "filename": document.filename,
+            "content_type": document.content_type,
+            "content_chunk": document.content[index],
+            "original_document_id": document.id,
+            "chunk_sort_key": index if sort_key is None else sort_key,
+            "metadata": str(document.metadata),
+            "content_hash": chunk_hash,
+            "hierarchy_paths": document.hierarchy_paths[index] if document.hierarchy_paths else [],
+        }
+
+    def index_document(self, document: Document, embeddings: List[List[float]], start_index: int = 0, identities=None) -> str:
+        """Index document chunks with their embeddings in one committed batch."""
+        identities = identities or chunk_identities(document.id, document.content)
+        uuids = [object_id for _, object_id in identities[:len(embeddings)]]
+        props = [self._props(document, i, identities[i][0], sort_key=start_index + i) for i in range(len(embeddings))]
+        vectors = np.asarray(embeddings, dtype=np.float32) if len(embeddings) else None
+        self._partition(document.id).write(uuids, props, vectors)
+        return document.id
+
+    def get_chunk_manifest(self, document_id: str) -> List[StoredChunk]:
+        partition = self._partition(document_id)
+        if not partition.refresh():
+            return []
+        snapshot = partition.snapshot
+        return [
+            StoredChunk(
+                uuid=uuid,
+                content_hash=snapshot.records[row].get("content_hash"),
+                chunk_sort_key=snapshot.records[row].get("chunk_sort_key"),
+                filename=snapshot.records[row].get("filename"),
+                metadata=snapshot.records[row].get("metadata"),
+                doc_version=0,  # updates commit in one batch here, so chunks need no versions
+            )
+            for uuid, row in snapshot.by_uuid.items()
+        ]
+
+    def apply_chunk_diff(self, document: Document, diff: ChunkDiff, embeddings: List[List[float]]) -> str:
+        """Applies inserts, renumbering and deletes as one committed batch, so queries see either the
+        old or the new version of the document."""
+        uuids = [diff.identities[i][1] for i in diff.new_indices]
+        props = [self._props(document, i, diff.identities[i][0]) for i in diff.new_indices]
+        vectors = np.asarray(embeddings, dtype=np.float32) if len(embeddings) else None
+        self._partition(document.id).write(uuids, props, vectors, deletes=diff.removed_uuids, updates=diff.updates)
+        return document.id
+
+    @staticmethod
+    def _results(hits, metadata) -> List[QueryResult]:
+        return [
+            QueryResult(
+                document_id=record["original_document_id"],
+                snippet=record["content_chunk"],
+                score=score,
+                metadata=metadata(score),
+                chunk_order_key=record["chunk_sort_key"],
+            )
+            for score, record in hits
+        ]
+
+    def _fuse(self, vector_hits, keyword_hits, limit: int) -> List[QueryResult]:
+        """Reciprocal rank fusion of the vector and keyword rankings (HYBRID_RRF_K damps the top ranks)."""
+        records = {}
+        rankings = []
+        for hits in (vector_hits, keyword_hits):
+            ranking = []
+            for _, record in hits:
+                key = (record["original_document_id"], record["chunk_sort_key"], record.get("content_hash"))
+                records[key] = record
+                ranking.append(key)
+            rankings.append(ranking)
+        fused = rrf_fuse(rankings, k=self.config.HYBRID_RRF_K)[:limit]
+        return self._results([(score, records[key]) for key, score in fused], lambda score: {"score": score})
+
+    def query_document(self, document_id: str, query_embedding: List[float], limit: int = 6, hierarchy_path: str = None) -> List[QueryResult]:
+        """Query document chunks using vector search, optionally within one JSON subtree"""
+        if document_id == "":
+            return self.query_scope(None, "vector", None, query_embedding, limit, hierarchy_path).results
+        limit = limit or 6
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        hits = self._partition(document_id).search(query, limit, hierarchy_path)
+        return self._results(hits, lambda score: {"distance": 1 - score})
+
+    def query_keyword(self, document_id: str, query_text: str, limit: int = 6, hierarchy_path: str = None) -> List[QueryResult]:
+        """Query document chunks with BM25 over the chunk text; needs no embedding."""
+        if document_id == "":
+            return self.query_scope(None, "keyword", query_text, None, limit, hierarchy_path).results
+        limit = limit or 6
+        hits = self._partition(document_id).keyword_search(query_text, limit, hierarchy_path)
+        return self._results(hits, lambda score: {"score": score})
+
+    def query_hybrid(self, document_id: str, query_text: str, query_embedding: List[float], limit: int = 6,
+                     hierarchy_path: str = None) -> List[QueryResult]:
+        """Query document chunks with BM25 and vector search fused by reciprocal rank fusion.
+
+        Each side contributes its HYBRID_CANDIDATES best chunks; HYBRID_RRF_K damps the weight of top ranks.
+        """
+        if document_id == "":
+            return self.query_scope(None, "hybrid", query_text, query_embedding, limit, hierarchy_path).results
+        limit = limit or 6
+        depth = max(limit, self.config.HYBRID_CANDIDATES)
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        partition = self._partition(document_id)
+        return self._fuse(partition.search(query, depth, hierarchy_path),
+                          partition.keyword_search(query_text, depth, hierarchy_path), limit)
+
+    def query_scope(self, document_ids: Optional[List[str]], mode: str, query_text: str,
+                    query_embedding: Optional[List[float]], limit: int = 6, hierarchy_path: str = None,
+                    timeout: float = None) -> GatheredResults:
+        """Queries several documents, or every document for document_ids None, in one merged ranking.
+
+        Partitions are searched in parallel (QUERY_SCATTER_PER_REQUEST at a time) and merged by score.
+        Vector scores are cosine similarities, and BM25 scores use the term statistics of all searched
+        partitions, so scores compare across documents; hybrid scores are rank-fused. Partitions still
+        searching `timeout` seconds in (or, for BM25, still gathering statistics halfway there) are left
+        out and reported as missing. A corpus of more than
+        QUERY_SCOPE_MAX_DOCUMENTS partitions is refused.
+        """
+        limit = limit or 6
+        deadline = deadline_after(timeout)
+        concurrency = self.config.QUERY_SCATTER_PER_REQUEST
+        if document_ids is None:
+            partitions = {os.path.basename(partition.path): partition for partition in self._all_partitions()}
+            check_scope(len(partitions), self.config.QUERY_SCOPE_MAX_DOCUMENTS)
+        else:
+            partitions = {document_id: self._partition(document_id) for document_id in dict.fromkeys(document_ids)}
+        missing = []
+        statistics = None
+        if mode != "vector":
+            # Statistics get half of the time left, so the partitions that answered can still be searched.
+            found, missing = scatter(self._scatter_pool(), {
+                name: partial(partition.keyword_statistics, query_text) for name, partition in partitions.items()
+            }, deadline_after(None if deadline is None else remaining(deadline) / 2), concurrency)
+            statistics = merge_statistics(found.values())
+            partitions = {name: partitions[name] for name in found}
+        query = None if mode == "keyword" else _normalize(np.asarray(query_embedding, dtype=np.float32))
+        depth = max(limit, self.config.HYBRID_CANDIDATES) if mode == "hybrid" else limit
+
+        def search(partition: _Partition):
+            vector_hits = partition.search(query, depth, hierarchy_path) if query is not None else []
+            keyword_hits = partition.keyword_search(query_text, depth, hierarchy_path, statistics) if mode != "vector" else []
+            return vector_hits, keyword_hits
+
+        found, late = scatter(self._scatter_pool(), {
+            name: partial(search, partition) for name, partition in partitions.items()
+        }, deadline, concurrency)
+        missing += late
+        # Every partition returns at most `depth` hits, so the merge keeps a bounded heap of `depth`.
+        vector_hits = heapq.nlargest(depth, (hit for hits, _ in found.values() for hit in hits), key=lambda hit: hit[0])
+        keyword_hits = heapq.nlargest(depth, (hit for _, hits in found.values() for hit in hits), key=lambda hit: hit[0])
+        if mode == "keyword":
+            results = self._results(keyword_hits, lambda score: {"score": score})
+        elif mode == "hybrid":
+            results = self._fuse(vector_hits, keyword_hits, limit)
+        else:
+            results = self._results(vector_hits, lambda score: {"distance": 1 - score})
+        scoring = {"keyword": "bm25", "hybrid": "rank_fusion"}.get(mode, "cosine")
+        return GatheredResults(results=results, partial=bool(missing), missing=missing, scoring=scoring)
+
+    def query_hierarchical_json(self, document_id: str, query_embedding: List[float],
+                                hierarchy_filter: str = None, limit: int = 6) -> List[QueryResult]:
+        """Query JSON document chunks, restricted to the subtree at `hierarchy_filter` (e.g. "company.employees")."""
+        return self.query_document(document_id, query_embedding, limit, hierarchy_path=hierarchy_filter)
+
+    def delete_document(self, document_id: str):
+        """Delete all chunks associated with a document by dropping its partition"""
+        self._partition(document_id).drop()
+        return document_id
+
+    # Async variants for the ASGI app: searches and writes are CPU and disk work in this process,
+    # so they run in worker threads (NumPy releases the GIL for the heavy parts).
+
+    async def query_document_async(self, *args, **kwargs) -> List[QueryResult]:
+        return await asyncio.to_thread(self.query_document, *args, **kwargs)
+
+    async def query_keyword_async(self, *args, **kwargs) -> List[QueryResult]:
+        return await asyncio.to_thread(self.query_keyword, *args, **kwargs)
+
+    async def query_hybrid_async(self, *args, **kwargs) -> List[QueryResult]:
+        return await asyncio.to_thread(self.query_hybrid, *args, **kwargs)
+
+    async def query_scope_async(self, *args, **kwargs) -> GatheredResults:
+        return await asyncio.to_thread(self.query_scope, *args, **kwargs)
+
+    async def index_document_async(self, *args, **kwargs) -> str:
+        return await asyncio.to_thread(self.index_document, *args, **kwargs)
+
+    async def get_chunk_manifest_async(self, document_id: str) -> List[StoredChunk]:
+        return await asyncio.to_thread(self.get_chunk_manifest, document_id)
+
+    async def apply_chunk_diff_async(self, document: Document, diff: ChunkDiff, embeddings: List[List[float]]) -> str:
+        return await asyncio.to_thread(self.apply_chunk_diff, document, diff, embeddings)
+
+    async def delete_document_async(self, document_id: str):
+        return await asyncio.to_thread(self.delete_document, document_id)
+
+    async def aclose(self):
+        pass
+
+    def is_healthy(self) -> bool:
+        return os.access(self.root, os.W_OK)
+
+    def start_health_checks(self, interval: float):
+        pass
+
+    def close(self):
+        with self._lock:
+            if self._scatter_executor is not None:
+                self._scatter_executor.shutdown(wait=False)
+                self._scatter_executor = None
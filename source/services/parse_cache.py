@@ -0,0 +1,113 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+from source.utils.observability import record_cache
+
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParsedDocumentCache:
+    """Content-addressed cache of parsed markdown in a local SQLite file.
+
+    Entries are keyed by sha256(parser version, content type, file sha256), so a parser upgrade never
+    serves stale output, and stored zlib-compressed. Like EmbeddingCache it runs in WAL mode so all
+    workers on a host share it. When the stored text grows past `max_bytes`, least recently used
+    entries are evicted.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS parsed ("
+            " key TEXT PRIMARY KEY, markdown BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS parsed_last_used ON parsed(last_used)")
+        conn.commit()
+
+    @classmethod
+    def shared(cls, path: str, max_bytes: int) -> "ParsedDocumentCache":
+        """One instance per file per process, so short-lived services (e.g. in ingest workers) reuse it."""
+        with cls._shared_lock:
+            cache = cls._shared.get(path)
+            if cache is None:
+                cache = cls._shared[path] = cls(path, max_bytes)
+            return cache
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(parser_version: str, content_type: str, file_digest: str) -> str:
+        return hashlib.sha256(f"{parser_version}\0{content_type}\0{file_digest}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        conn = self._connection()
+        row = conn.execute("SELECT markdown FROM parsed WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            record_cache("parsed", misses=1)
+            return None
+        self.hits += 1
+        record_cache("parsed", hits=1)
+        conn.execute("UPDATE parsed SET last_used = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, key: str, markdown: str):
+        blob = zlib.compress(markdown.encode("utf-8"))
+        if len(blob) > self.max_bytes:
+            return
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO parsed (key, markdown, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, blob, len(blob), time.time()),
+        )
+        conn.commit()
+        self.evict()
+
+    def evict(self):
+        """Trims the stored size to 90% of max_bytes, dropping least recently used entries first."""
+        conn = self._connection()
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM parsed").fetchone()
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM parsed ORDER BY last_used"):
+            if total <= target:
+                break
+            doomed.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM parsed WHERE key = ?", doomed)
+        conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
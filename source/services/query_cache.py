@@ -0,0 +1,142 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+from source.utils.config import Config
+from source.utils.observability import record_cache
+
+
+class LRUTTLCache:
+    """Thread-safe in-process cache with least-recently-used eviction and a per-entry time to live."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def next_generation(self) -> int:
+        """A number never returned before by this cache."""
+        with self._lock:
+            self._generation += 1
+            return self._generation
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """Shared cache backend so all workers see the same entries and invalidations.
+
+    Needs the optional `redis` package.
+    """
+
+    def __init__(self, url: str, ttl: float, prefix: str = "ringg:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("QUERY_CACHE_REDIS_URL is set but the 'redis' package is not installed") from e
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl or self.ttl)))
+
+    def next_generation(self) -> int:
+        return int(self.client.incr(self.prefix + "generation"))
+
+
+class QueryCache:
+    """Caches query embeddings and query results.
+
+    Result keys include a per-document generation. Writing or deleting a document gives it (and the
+    corpus scope) a new, never reused generation, so every cached result for it becomes unreachable at
+    once, and a search that raced with the write is stored under the old generation and never served.
+
+    Generations are ordinary cache entries with the result TTL, so they stay bounded: once one expires,
+    every result stored under an earlier generation has expired too, and generation 0 is safe to reuse.
+    In the LRU backend a generation is also always newer than the results it hides, so those are evicted
+    first. Without QUERY_CACHE_REDIS_URL each process only sees its own invalidations: writes through
+    another worker or scripts/bulk_ingest.py leave stale results for up to QUERY_CACHE_TTL.
+    """
+
+    CORPUS_SCOPE = ""
+
+    def __init__(self, config: Config, backend=None):
+        self.embedding_ttl = config.QUERY_EMBEDDING_CACHE_TTL
+        self.result_ttl = config.QUERY_CACHE_TTL
+        if backend is None:
+            if config.QUERY_CACHE_REDIS_URL:
+                backend = RedisCacheBackend(config.QUERY_CACHE_REDIS_URL, ttl=config.QUERY_CACHE_TTL)
+            else:
+                backend = LRUTTLCache(config.QUERY_CACHE_MAX_ENTRIES, ttl=config.QUERY_CACHE_TTL)
+        self.backend = backend
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_embedding(self, model: str, query_text: str) -> Optional[List[float]]:
+        embedding = self.backend.get(f"qe:{model}:{self._digest(query_text)}")
+        record_cache("query_embedding", hits=embedding is not None, misses=embedding is None)
+        return embedding
+
+    def put_embedding(self, model: str, query_text: str, embedding: List[float]):
+        self.backend.set(f"qe:{model}:{self._digest(query_text)}", embedding, ttl=self.embedding_ttl)
+
+    def generation(self, document_id: str) -> int:
+        """Current generation of a document's results; pass it back to put_results."""
+        return self.backend.get(f"gen:{document_id}") or 0
+
+    def _result_key(self, document_id: str, generation: int, query_text: str, limit, hierarchy_path: str = None, mode: str = "vector") -> str:
+        scoped = f"{hierarchy_path}\0{query_text}" if hierarchy_path else query_text
+        return f"qr:{document_id}:{generation}:{mode}:{limit}:{self._digest(scoped)}"
+
+    def get_results(self, document_id: str, generation: int, query_text: str, limit, hierarchy_path: str = None, mode: str = "vector") -> Optional[list]:
+        results = self.backend.get(self._result_key(document_id, generation, query_text, limit, hierarchy_path, mode))
+        with self._stats_lock:
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        record_cache("query_results", hits=results is not None, misses=results is None)
+        return results
+
+    def put_results(self, document_id: str, generation: int, query_text: str, limit, results: list, hierarchy_path: str = None, mode: str = "vector"):
+        self.backend.set(self._result_key(document_id, generation, query_text, limit, hierarchy_path, mode), results, ttl=self.result_ttl)
+
+    def invalidate_document(self, document_id: str):
+        """Drops every cached result of `document_id` and of corpus-wide queries."""
+        self.backend.set(f"gen:{document_id}", self.backend.next_generation(), ttl=self.result_ttl)
+        if document_id != self.CORPUS_SCOPE:
+            self.backend.set(f"gen:{self.CORPUS_SCOPE}", self.backend.next_generation(), ttl=self.result_ttl)
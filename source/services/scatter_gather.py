@@ -0,0 +1,100 @@
+import asyncio
+import itertools
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from source.utils.observability import QUERY_SCATTER_MISSING, QUERY_SCATTER_PARTITIONS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ScopeTooLarge(Exception):
+    """Raised when a query's scope spans more partitions than QUERY_SCOPE_MAX_DOCUMENTS."""
+
+
+def deadline_after(timeout: Optional[float]) -> Optional[float]:
+    """The time.monotonic() deadline `timeout` seconds from now (None: no deadline)."""
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left before `deadline`, never negative (None: no deadline)."""
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def check_scope(partitions: int, limit: int):
+    """Raises ScopeTooLarge when a query would search more than `limit` partitions."""
+    if partitions > limit:
+        raise ScopeTooLarge(f"Query scope spans {partitions} partitions, more than the {limit} allowed; use document_ids")
+
+
+def _collect(names: List[str], futures: dict, done) -> Tuple[Dict[str, T], List[str]]:
+    """Results of the finished futures and the other task names, in task order. Raises the first
+    error when nothing succeeded, so a failing backend is an error rather than an empty answer."""
+    results = {}
+    errors = []
+    for future in done:
+        name = futures[future]
+        if future.cancelled():
+            continue
+        error = future.exception()
+        if error is None:
+            results[name] = future.result()
+        else:
+            logger.warning("search of partition %s failed: %s", name, error)
+            errors.append(error)
+    if errors and not results:
+        raise errors[0]
+    missing = [name for name in names if name not in results]
+    QUERY_SCATTER_PARTITIONS.observe(len(names))
+    if missing:
+        QUERY_SCATTER_MISSING.inc(len(missing))
+    return results, missing
+
+
+def scatter(executor: Executor, tasks: Dict[str, Callable[[], T]], deadline: Optional[float],
+            concurrency: int) -> Tuple[Dict[str, T], List[str]]:
+    """Runs the tasks on `executor`, at most `concurrency` at a time, until `deadline`.
+
+    Tasks are handed to the executor as earlier ones finish, so one request never fills a shared
+    executor's queue. Returns {name: result} of the tasks that finished in time and the names of those
+    that did not (or failed); tasks not started by the deadline never run.
+    """
+    queue = iter(tasks.items())
+    futures = {}
+    running = set()
+    while True:
+        for name, task in itertools.islice(queue, max(1, concurrency) - len(running)):
+            future = executor.submit(task)
+            futures[future] = name
+            running.add(future)
+        if not running:
+            break
+        done, running = wait(running, timeout=remaining(deadline), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+    for future in running:
+        future.cancel()
+    return _collect(list(tasks), futures, [future for future in futures if future.done()])
+
+
+async def scatter_async(tasks: Dict[str, Callable[[], Awaitable[T]]], deadline: Optional[float],
+                        concurrency: int) -> Tuple[Dict[str, T], List[str]]:
+    """scatter on the event loop, with at most `concurrency` tasks in flight."""
+    if not tasks:
+        return {}, []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(task):
+        async with slots:
+            return await task()
+
+    futures = {asyncio.ensure_future(run(task)): name for name, task in tasks.items()}
+    done, not_done = await asyncio.wait(futures, timeout=remaining(deadline))
+    for future in not_done:
+        future.cancel()
+    return _collect(list(tasks), futures, done)
@@ -1,177 +1,1133 @@
+import asyncio
+import heapq
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from functools import partial
 import weaviate
 from weaviate import WeaviateClient
-from weaviate.classes.config import Configure, Property, DataType
-from weaviate.classes.query import Filter,MetadataQuery
+from weaviate.classes.config import Configure, Property, DataType, Reconfigure, Tokenization
+from weaviate.classes.query import Filter,MetadataQuery,HybridFusion,Sort
+from weaviate.classes.data import DataObject
 
-from weaviate.classes.init import Auth# from weaviate.classes.init import Auth
+from weaviate.classes.init import Auth, AdditionalConfig, Timeout
+from weaviate.config import ConnectionConfig
+from weaviate.util import generate_uuid5
 
-from typing import List, Dict, Any
-from source.models import Document, QueryResult  # Assuming these are defined
+from typing import List, Dict, Any, Optional, Tuple, Union
+from source.models import Document, GatheredResults, QueryResult, StoredChunk, ChunkDiff  # Assuming these are defined
+from source.services.scatter_gather import check_scope, deadline_after, scatter, scatter_async
+from source.utils.hashing import chunk_identities, partition_name
+from source.utils.ranking import rrf_fuse
 from source.utils.config import Config  # Assuming this is defined
+from source.utils.observability import weaviate_call
+
+logger = logging.getLogger(__name__)
+
+VECTOR_NAME = "chunk_vectors"
+CONTENT_HASH_PROPERTY = Property(
+    name="content_hash", data_type=DataType.TEXT, tokenization=Tokenization.FIELD, index_searchable=False
+)
+# Every JSON path a chunk covers ([] for other content types), kept out of the stringified metadata
+# so a subtree filter is one inverted-index lookup.
+HIERARCHY_PATHS_PROPERTY = Property(
+    name="hierarchy_paths", data_type=DataType.TEXT_ARRAY, tokenization=Tokenization.FIELD, index_searchable=False
+)
+# Chunk-diff updates write their chunks under a new doc_version, mark removed chunks with the version
+# that retires them (retired_version, 0: live) and give kept chunks their new position and metadata as
+# a pending_patch that applies from update_version on. While a document is being updated, its record in
+# the <collection>Versions collection names the active version and queries only see that version;
+# switching the record is the single write that makes an update visible. Chunks with a nonzero
+# retired_version or update_version are unsettled: only a search that meets one looks the record up.
+VERSION_PROPERTIES = [
+    Property(name="doc_version", data_type=DataType.INT),
+    Property(name="retired_version", data_type=DataType.INT),
+    Property(name="update_version", data_type=DataType.INT),
+    Property(name="pending_patch", data_type=DataType.TEXT, index_filterable=False, index_searchable=False),
+]
+ADDED_PROPERTIES = [CONTENT_HASH_PROPERTY, HIERARCHY_PATHS_PROPERTY, *VERSION_PROPERTIES]
+SETTLE_PROPERTIES = ["doc_version", "retired_version", "update_version", "pending_patch"]
+RESULT_PROPERTIES = ["filename", "content_chunk", "chunk_sort_key", "original_document_id", *SETTLE_PROPERTIES]
+
+QUANTIZERS = ("none", "pq", "bq", "sq", "rq")
+# HNSW settings by Config attribute: the first can be changed on a live collection, the second only by a rebuild.
+MUTABLE_HNSW_SETTINGS = {
+    "ef": "WEAVIATE_HNSW_EF",
+    "dynamic_ef_min": "WEAVIATE_HNSW_DYNAMIC_EF_MIN",
+    "dynamic_ef_max": "WEAVIATE_HNSW_DYNAMIC_EF_MAX",
+    "dynamic_ef_factor": "WEAVIATE_HNSW_DYNAMIC_EF_FACTOR",
+    "flat_search_cutoff": "WEAVIATE_HNSW_FLAT_SEARCH_CUTOFF",
+}
+FIXED_HNSW_SETTINGS = {
+    "max_connections": "WEAVIATE_HNSW_MAX_CONNECTIONS",
+    "ef_construction": "WEAVIATE_HNSW_EF_CONSTRUCTION",
+}
+
+
+def _quantizer_args(config: Config, kind: str) -> dict:
+    """Arguments of Configure/Reconfigure.VectorIndex.Quantizer.<kind>; a 0 setting leaves Weaviate's default."""
+    rescore_limit = config.WEAVIATE_QUANTIZATION_RESCORE_LIMIT or None
+    training_limit = config.WEAVIATE_QUANTIZATION_TRAINING_LIMIT or None
+    if kind == "pq":
+        return dict(segments=config.WEAVIATE_PQ_SEGMENTS or None, centroids=config.WEAVIATE_PQ_CENTROIDS,
+                    training_limit=training_limit)
+    if kind == "bq":
+        return dict(rescore_limit=rescore_limit)
+    if kind in ("sq", "rq"):
+        return dict(rescore_limit=rescore_limit, training_limit=training_limit)
+    raise ValueError(f"Unknown WEAVIATE_QUANTIZATION: {kind}")
+
+
+def vector_index_config(config: Config):
+    """The HNSW index of a new collection, with the WEAVIATE_HNSW_* and WEAVIATE_QUANTIZATION* settings.
+    With a quantizer, searches run on compressed vectors and rescore candidates with the full ones."""
+    kind = config.WEAVIATE_QUANTIZATION
+    quantizer = None
+    if kind != "none":
+        quantizer = getattr(Configure.VectorIndex.Quantizer, kind)(**_quantizer_args(config, kind))
+    return Configure.VectorIndex.hnsw(
+        quantizer=quantizer,
+        **{field: getattr(config, attribute) for field, attribute in {**MUTABLE_HNSW_SETTINGS, **FIXED_HNSW_SETTINGS}.items()},
+    )
+
+
+def quantizer_kind(index_config) -> str:
+    """'none', 'pq', 'bq', 'sq' or 'rq' for the HNSW config of a live collection."""
+    quantizer = index_config.quantizer
+    # The client returns _PQConfig, _BQConfig, _SQConfig or _RQConfig.
+    return "none" if quantizer is None else type(quantizer).__name__.strip("_").replace("Config", "").lower()
+
+
+def vector_index_changes(config: Config, index_config) -> Tuple[Dict[str, Any], List[str]]:
+    """Compares the HNSW config of a live collection with `config`.
+
+    Returns the differing settings Weaviate changes in place ({field: new value}, with "quantizer" for a
+    quantizer to enable or retune) and the Config names of differing settings that need a rebuild.
+    """
+    changes = {
+        field: getattr(config, attribute) for field, attribute in MUTABLE_HNSW_SETTINGS.items()
+        if getattr(index_config, field) != getattr(config, attribute)
+    }
+    fixed = [attribute for field, attribute in FIXED_HNSW_SETTINGS.items() if getattr(index_config, field) != getattr(config, attribute)]
+    kind, current = config.WEAVIATE_QUANTIZATION, quantizer_kind(index_config)
+    if kind != current:
+        # A quantizer can be turned on for an existing index, but not switched or turned off.
+        if current == "none":
+            changes["quantizer"] = kind
+        else:
+            fixed.append("WEAVIATE_QUANTIZATION")
+    elif (kind in ("bq", "sq", "rq") and config.WEAVIATE_QUANTIZATION_RESCORE_LIMIT
+          and index_config.quantizer.rescore_limit != config.WEAVIATE_QUANTIZATION_RESCORE_LIMIT):
+        changes["quantizer"] = kind
+    return changes, fixed
+
+
+def vector_index_update(config: Config, changes: Dict[str, Any]):
+    """The Reconfigure argument applying `changes` from vector_index_changes."""
+    quantizer = None
+    kind = changes.get("quantizer")
+    if kind is not None:
+        quantizer = getattr(Reconfigure.VectorIndex.Quantizer, kind)(**_quantizer_args(config, kind))
+    return Reconfigure.VectorIndex.hnsw(
+        quantizer=quantizer, **{field: value for field, value in changes.items() if field != "quantizer"}
+    )
+
+
+def _is_missing_tenant(error: Exception) -> bool:
+    """Weaviate rejects reads of a tenant that does not exist (a document never indexed, or deleted)."""
+    return "tenant not found" in str(error).lower()
+
+
+class IndexingError(Exception):
+    """Raised when chunks of a document are still missing after all write retries."""
+
+    def __init__(self, document_id: str, failures: Dict[int, str]):
+        self.document_id = document_id
+        self.failures = failures
+        first = "; ".join(f"chunk {i}: {msg}" for i, msg in sorted(failures.items())[:3])
+        super().__init__(f"Failed to index {len(failures)} chunk(s) of document {document_id}: {first}")
+
+
+class _UnsettledResults(Exception):
+    """A search without version filters met chunks of unfinished updates of these documents."""
+
+    def __init__(self, document_ids: List[str]):
+        self.document_ids = document_ids
+        super().__init__(f"unsettled chunks of {len(document_ids)} document(s)")
+
 
 class WeaviateService:
     def __init__(self, config: Config):
-        self.class_name = "Document"  
+        self.class_name = config.WEAVIATE_COLLECTION
+        self.config = config
+        self._reconnect_lock = threading.Lock()
+        self._stop_health_checks = threading.Event()
+        self._health_thread = None
+        self._batch_executor = ThreadPoolExecutor(max_workers=config.WEAVIATE_BATCH_CONCURRENCY, thread_name_prefix="weaviate-batch")
+        self._scatter_executor = ThreadPoolExecutor(max_workers=config.QUERY_SCATTER_CONCURRENCY, thread_name_prefix="weaviate-scatter")
         self.client = self._init_client(config)
-        self._create_collection()  
+        # Whether every document is its own tenant; _create_collection reads it from the live collection.
+        self.multi_tenant = config.WEAVIATE_MULTI_TENANCY
+        self.versions_name = f"{self.class_name}Versions"
+        self._create_collection()
+        # Collection handles are local objects bound to the client, so one is enough for the process.
+        self.collection = self.client.collections.get(self.class_name)
+        self.versions = self.client.collections.get(self.versions_name)
+        # The async client (ASGI app) is opened on first use, inside the event loop that serves requests.
+        self.async_client = None
+        self._async_collection = None
+        self._async_versions = None
+        self._async_connect_lock = asyncio.Lock()
+
+    @staticmethod
+    def _connection_args(config: Config) -> dict:
+        if not config.WEAVIATE_URL:
+            raise ValueError("WEAVIATE_URL is not configured")
+
+        # Connect to a remote Weaviate instance
+        auth_cred = None
+        if config.WEAVIATE_API_KEY:
+            auth_cred = Auth.api_key(config.WEAVIATE_API_KEY)
+        return dict(
+            cluster_url=config.WEAVIATE_URL,
+            auth_credentials=auth_cred,
+            additional_config=AdditionalConfig(
+                connection=ConnectionConfig(
+                    session_pool_connections=config.WEAVIATE_POOL_CONNECTIONS,
+                    session_pool_maxsize=config.WEAVIATE_POOL_MAXSIZE,
+                ),
+                timeout=Timeout(query=config.WEAVIATE_QUERY_TIMEOUT, insert=config.WEAVIATE_INSERT_TIMEOUT),
+            ),
+        )
 
     def _init_client(self, config: Config) -> WeaviateClient:
         """Initializes the Weaviate client with appropriate authentication."""
+        return weaviate.connect_to_weaviate_cloud(**self._connection_args(config))
 
-        if config.WEAVIATE_URL:
-            # Connect to a remote Weaviate instance
-            if config.WEAVIATE_API_KEY:
-                auth_cred = Auth.api_key(config.WEAVIATE_API_KEY)
-            client = weaviate.connect_to_weaviate_cloud(
-                cluster_url=config.WEAVIATE_URL,
-                auth_credentials=auth_cred,
-            )
+    async def _collection_async(self):
+        """The collection handle of the async client, connecting it on first use (and after a drop)."""
+        if self._async_collection is not None and self.async_client.is_connected():
+            return self._async_collection
+        async with self._async_connect_lock:
+            if self.async_client is None:
+                self.async_client = weaviate.use_async_with_weaviate_cloud(**self._connection_args(self.config))
+            if not self.async_client.is_connected():
+                await self.async_client.connect()
+            self._async_collection = self.async_client.collections.get(self.class_name)
+            self._async_versions = self.async_client.collections.get(self.versions_name)
+            return self._async_collection
+
+    def _partition(self, document_id: str):
+        """The collection handle holding a document's chunks: its tenant when documents are partitioned.
+        For document_id "" (all documents) on a partitioned collection, use query_scope instead."""
+        if self.multi_tenant:
+            return self.collection.with_tenant(partition_name(document_id))
+        return self.collection
+
+    async def _partition_async(self, document_id: str):
+        collection = await self._collection_async()
+        return collection.with_tenant(partition_name(document_id)) if self.multi_tenant else collection
+
+    def _ensure_connected(self):
+        """Reopens the connection pool if it was dropped (local check, no round trip)."""
+        if self.client.is_connected():
+            return
+        with self._reconnect_lock:
+            if not self.client.is_connected():
+                logger.warning("weaviate connection lost, reconnecting")
+                self.client.connect()
+
+    def is_healthy(self) -> bool:
+        """Checks that the Weaviate instance is reachable, reconnecting once if it is not."""
+        try:
+            self._ensure_connected()
+            if self.client.is_live():
+                return True
+        except Exception as e:
+            logger.warning("weaviate health check failed: %s", e)
+        try:
+            with self._reconnect_lock:
+                self._force_reconnect()
+            return self.client.is_live()
+        except Exception as e:
+            logger.error("weaviate reconnect failed: %s", e)
+            return False
+
+    def _force_reconnect(self):
+        """Drops the current connection pool and opens a fresh one."""
+        try:
+            self.client.close()
+        except Exception:
+            pass
+        self.client.connect()
+
+    def start_health_checks(self, interval: float):
+        """Runs is_healthy() every `interval` seconds on a daemon thread, off the request path."""
+        if interval <= 0 or self._health_thread is not None:
+            return
+
+        def run():
+            while not self._stop_health_checks.wait(interval):
+                self.is_healthy()
 
-        return client
+        self._health_thread = threading.Thread(target=run, name="weaviate-health", daemon=True)
+        self._health_thread.start()
+
+    @staticmethod
+    def _collection_args(config: Config) -> dict:
+        """Properties and vector index of the chunk collection (also used by scripts/migrate_vector_index.py)."""
+        return dict(
+            properties=[
+                Property(
+                    name="filename", data_type=DataType.TEXT
+                ),
+                Property(
+                    name="content_type", data_type=DataType.TEXT
+                ),
+                Property(
+                    name="content_chunk", data_type=DataType.TEXT
+                ),
+                Property(
+                    name="chunk_sort_key", data_type=DataType.INT
+                ),
+                Property(
+                    name="original_document_id", data_type=DataType.TEXT
+                ),
+                Property(
+                    name="metadata", data_type=DataType.TEXT
+                ),
+                *ADDED_PROPERTIES,
+            ],
+            vectorizer_config=[Configure.NamedVectors.none(
+                name=VECTOR_NAME,
+                vector_index_config=vector_index_config(config)
+            )],
+            # Tenants appear with a document's first write and are loaded again when it is queried.
+            multi_tenancy_config=Configure.multi_tenancy(
+                enabled=config.WEAVIATE_MULTI_TENANCY, auto_tenant_creation=True, auto_tenant_activation=True,
+            ) if config.WEAVIATE_MULTI_TENANCY else None,
+        )
+
+    @staticmethod
+    def _versions_args() -> dict:
+        """The per-document version records of updates in progress; they hold no vectors."""
+        return dict(
+            properties=[
+                Property(name="document_id", data_type=DataType.TEXT, tokenization=Tokenization.FIELD),
+                Property(name="active_version", data_type=DataType.INT),
+                Property(name="pending_version", data_type=DataType.INT),
+            ],
+            vectorizer_config=Configure.Vectorizer.none(),
+        )
+
+    def _alias_target(self) -> str:
+        """The collection WEAVIATE_COLLECTION points to when it is an alias, else the name itself."""
+        try:
+            alias = self.client.alias.get(alias_name=self.class_name)
+        except Exception:
+            # Weaviate before 1.32 has no aliases.
+            return self.class_name
+        return alias.collection if alias is not None else self.class_name
 
     def _create_collection(self):
         """Creates the Weaviate collection if it doesn't exist."""
-        if not self.client.collections.exists(self.class_name):
-            self.client.collections.create(
-                name=self.class_name,
-                properties=[
-                    Property(
-                        name="filename", data_type=DataType.TEXT
-                    ),
-                    Property(
-                        name="content_type", data_type=DataType.TEXT
-                    ),
-                    Property(
-                        name="content_chunk", data_type=DataType.TEXT
-                    ),
-                    Property(
-                        name="chunk_sort_key", data_type=DataType.INT
-                    ),
-                    Property(
-                        name="original_document_id", data_type=DataType.TEXT
-                    ),
-                    Property(
-                        name="metadata", data_type=DataType.TEXT
-                    ),
-                ],
-                vectorizer_config=[Configure.NamedVectors.none(
-                    name="chunk_vectors",
-                    vector_index_config=Configure.VectorIndex.hnsw() 
-                )]
-            )
+        name = self._alias_target()
+        if not self.client.collections.exists(name):
+            self.client.collections.create(name=name, **self._collection_args(self.config))
+        else:
+            self._migrate_collection(name)
+        if not self.client.collections.exists(self.versions_name):
+            self.client.collections.create(name=self.versions_name, **self._versions_args())
+
+    def _migrate_collection(self, name: str):
+        """Adds properties introduced after the collection was first created and applies the vector
+        index settings Weaviate can change in place. Settings that need a rebuild are only reported."""
+        collection = self.client.collections.get(name)
+        schema = collection.config.get()
+        self.multi_tenant = schema.multi_tenancy_config.enabled
+        if self.multi_tenant != self.config.WEAVIATE_MULTI_TENANCY:
+            logger.warning("%s was created with multi-tenancy %s, unlike WEAVIATE_MULTI_TENANCY; serving it as is. "
+                           "Run scripts/migrate_vector_index.py --rebuild to change it",
+                           name, "on" if self.multi_tenant else "off")
+        existing = {prop.name for prop in schema.properties}
+        for prop in ADDED_PROPERTIES:
+            if prop.name not in existing:
+                logger.info("adding %s property to %s", prop.name, name)
+                collection.config.add_property(prop)
+
+        changes, fixed = vector_index_changes(self.config, schema.vector_config[VECTOR_NAME].vector_index_config)
+        if fixed:
+            logger.warning("%s of %s differ from the configuration but are fixed once the collection exists; "
+                           "run scripts/migrate_vector_index.py --rebuild to apply them", ", ".join(fixed), name)
+        if changes:
+            logger.info("updating vector index of %s: %s", name, changes)
+            collection.config.update(vectorizer_config=[
+                Reconfigure.NamedVectors.update(name=VECTOR_NAME, vector_index_config=vector_index_update(self.config, changes))
+            ])
+
+    def _chunk_object(self, document: Document, index: int, embedding: List[float], identity, sort_key: int = None,
+                      version: int = 0) -> DataObject:
+        chunk_hash, object_id = identity
+        return DataObject(
+            properties={
+                "filename": document.filename,
+                "content_type": document.content_type,
+                "content_chunk": document.content[index],
+                "original_document_id": document.id,
+                "chunk_sort_key": index if sort_key is None else sort_key,
+                "metadata": str(document.metadata),
+                "content_hash": chunk_hash,
+                "hierarchy_paths": document.hierarchy_paths[index] if document.hierarchy_paths else [],
+                "doc_version": version,
+                "retired_version": 0,
+                "update_version": version,
+                "pending_patch": "",
+            },
+            vector={VECTOR_NAME: embedding},
+            # Ids derive from the content, so retries are idempotent (a re-sent object overwrites
+            # itself) and unchanged chunks keep their id across document versions.
+            uuid=object_id,
+        )
             
-    def index_document(self, document: Document, embeddings: List[List[float]]) -> str:
-        """Index document chunks with their embeddings"""
-        collection = self.client.collections.get(self.class_name)
-        try:
-            for i, embedding in enumerate(embeddings):
-                print(i)
-                print(embedding[0:5])
-                collection.data.insert(
-                    properties={
-                        "filename": document.filename,
-                        "content_type": document.content_type,
-                        "content_chunk": document.content[i],
-                        "original_document_id": document.id,
-                        "chunk_sort_key": i,
-                        "metadata": str(document.metadata),
-                    },
-                    vector=embedding,
-                )
-        except Exception as e:
-            print(e)
+    def index_document(self, document: Document, embeddings: List[List[float]], start_index: int = 0, identities=None) -> str:
+        """Index document chunks with their embeddings using bulk inserts.
 
+        Chunks are sent WEAVIATE_BATCH_SIZE per insert_many call with up to WEAVIATE_BATCH_CONCURRENCY
+        calls in flight. Failed objects are retried; if any chunk is still missing after the retries,
+        the chunks written by this call are removed again and IndexingError is raised.
+        When a document is written in slices, `start_index` is the sort key of the first chunk and
+        `identities` the slice's (content hash, object id) pairs.
+        """
+        self._ensure_connected()
+        self._write_objects(document.id, self._chunk_objects(document, embeddings, start_index, identities))
         return document.id
-    # def index_json_document(self, document: Document, chunks,hierarchy_paths, embeddings: List[List[float]]) -> str:
-    #     """
-    #     Process a JSON document using hierarchical chunking.
-    #     The method updates the document's content and metadata (storing hierarchy paths)
-    #     then indexes the document chunks using the provided embeddings.
-    #     """
-    #     chunks, hierarchy_paths 
-    #     document.content = chunks
-    #     # Extend or initialize metadata to include hierarchical paths.
-    #     if document.metadata is None:
-    #         document.metadata = {}
-    #     document.metadata["hierarchy_paths"] = hierarchy_paths
-    #     return self.index_document(document, embeddings)
-    def query_document(self, document_id: str, query_embedding: List[float], limit: int = 6) -> List[QueryResult]:
-        """Query document chunks using vector search"""
-        collection = self.client.collections.get(self.class_name)
-        print("got collection")
-        response=[]
-        if(document_id != ""):
-            response = collection.query.near_vector(
-                near_vector=query_embedding,
-                return_metadata=MetadataQuery(distance=True,score=True),
-                limit=limit,
-                # certainty=0.5,
-                filters=Filter.by_property("original_document_id").equal(document_id),
-                return_properties=["filename", "content_chunk", "chunk_sort_key", "original_document_id"]
+
+    # Bulk writes. The batching, retry and rollback decisions below do no I/O and are shared by the
+    # sync methods and their async twins, which differ only in the client calls.
+
+    def _chunk_objects(self, document: Document, embeddings: List[List[float]], start_index: int = 0,
+                       identities=None) -> List[DataObject]:
+        identities = identities or chunk_identities(document.id, document.content)
+        return [
+            self._chunk_object(document, i, embedding, identities[i], sort_key=start_index + i)
+            for i, embedding in enumerate(embeddings)
+        ]
+
+    def _batches(self, pending: List[int]) -> List[List[int]]:
+        batch_size = self.config.WEAVIATE_BATCH_SIZE
+        return [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    @staticmethod
+    def _batch_failures(response, indices: List[int]) -> Dict[int, str]:
+        """{chunk index: error} of the objects an insert_many call of objects[indices] rejected."""
+        return {indices[pos]: error.message for pos, error in response.errors.items()}
+
+    def _retry_delay(self, document_id: str, failures: Dict[int, str], attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying the failed objects, or None when the retries are used up."""
+        logger.warning("%d chunk(s) of document %s failed to index (attempt %d)", len(failures), document_id, attempt + 1)
+        return 0.25 * (2 ** attempt) if attempt < self.config.WEAVIATE_MAX_RETRIES else None
+
+    @staticmethod
+    def _indexing_error(document_id: str, objects: List[DataObject], failures: Dict[int, str]) -> IndexingError:
+        return IndexingError(
+            document_id,
+            {objects[i].properties["chunk_sort_key"]: message for i, message in failures.items()},
+        )
+
+    @staticmethod
+    def _id_slices(object_ids: List[str]) -> List[List[str]]:
+        """`object_ids` in slices of 1000, one delete_many call each."""
+        return [object_ids[start:start + 1000] for start in range(0, len(object_ids), 1000)]
+
+    def _write_objects(self, document_id: str, objects: List[DataObject]):
+        """Bulk-inserts objects with per-object retries; rolls back and raises IndexingError on failure."""
+        collection = self._partition(document_id)
+        pending = list(range(len(objects)))
+        for attempt in range(self.config.WEAVIATE_MAX_RETRIES + 1):
+            failures = {}
+            for batch_failures in self._batch_executor.map(lambda batch: self._insert_batch(collection, objects, batch), self._batches(pending)):
+                failures.update(batch_failures)
+            if not failures:
+                return
+            pending = sorted(failures)
+            delay = self._retry_delay(document_id, failures, attempt)
+            if delay is not None:
+                time.sleep(delay)
+
+        self._delete_objects(collection, [obj.uuid for obj in objects])
+        raise self._indexing_error(document_id, objects, failures)
+
+    @classmethod
+    def _delete_objects(cls, collection, object_ids: List[str]):
+        for ids in cls._id_slices(object_ids):
+            try:
+                with weaviate_call("delete_many"):
+                    collection.data.delete_many(where=Filter.by_id().contains_any(ids))
+            except Exception as e:
+                logger.error("failed to delete %d object(s): %s", len(ids), e)
+                raise
+
+    # Version records. A document has one only while an update of it is in progress (or was cut short).
+
+    @staticmethod
+    def _head_id(document_id: str) -> str:
+        return generate_uuid5(document_id)
+
+    def _head(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """The version record of a document being updated, or None."""
+        with weaviate_call("fetch_object_by_id"):
+            obj = self.versions.query.fetch_object_by_id(self._head_id(document_id))
+        return obj.properties if obj is not None else None
+
+    def _put_head(self, document_id: str, active: int, pending: int):
+        with weaviate_call("insert_many"):
+            response = self.versions.data.insert_many([DataObject(
+                properties={"document_id": document_id, "active_version": active, "pending_version": pending},
+                uuid=self._head_id(document_id),
+            )])
+        if response.errors:
+            raise IndexingError(document_id, {0: next(iter(response.errors.values())).message})
+
+    def _drop_head(self, document_id: str):
+        with weaviate_call("delete_by_id"):
+            self.versions.data.delete_by_id(self._head_id(document_id))
+
+    @staticmethod
+    def _versions_filter(document_ids: List[str]):
+        return Filter.by_id().contains_any([WeaviateService._head_id(d) for d in document_ids])
+
+    @staticmethod
+    def _versions_found(objects) -> Dict[str, int]:
+        return {obj.properties["document_id"]: obj.properties["active_version"] for obj in objects}
+
+    def _active_versions(self, document_ids: List[str]) -> Dict[str, int]:
+        """{document id: active version} of the given documents that are being updated."""
+        with weaviate_call("fetch_objects"):
+            response = self.versions.query.fetch_objects(
+                filters=self._versions_filter(document_ids), limit=len(document_ids),
+                return_properties=["document_id", "active_version"],
             )
-        else:
-            response = collection.query.near_vector(
-                near_vector=query_embedding,
-                return_metadata=MetadataQuery(distance=True,score=True),
-                limit=limit,
-                # certainty=0.5,
-                # filters=Filter.by_property("original_document_id").equal(document_id),
-                return_properties=["filename", "content_chunk", "chunk_sort_key", "original_document_id"]
+        return self._versions_found(response.objects)
+
+    async def _active_versions_async(self, document_ids: List[str]) -> Dict[str, int]:
+        await self._collection_async()
+        with weaviate_call("fetch_objects"):
+            response = await self._async_versions.query.fetch_objects(
+                filters=self._versions_filter(document_ids), limit=len(document_ids),
+                return_properties=["document_id", "active_version"],
             )
-        # print(response)
+        return self._versions_found(response.objects)
+
+    @staticmethod
+    def _visible(properties: dict, active: int) -> bool:
+        """Whether a chunk belongs to `active`, the same test as _version_filter."""
+        retired = properties.get("retired_version") or 0
+        return (properties.get("doc_version") or 0) <= active and (retired == 0 or retired > active)
+
+    @staticmethod
+    def _unsettled(properties: dict) -> bool:
+        """Whether a chunk was written, retired or changed by an update that has not finished."""
+        return bool(properties.get("retired_version") or properties.get("update_version"))
+
+    @staticmethod
+    def _settled_properties(properties: dict, active: Optional[int]) -> dict:
+        """A chunk's properties as of version `active`: with its pending patch once that version is active."""
+        updated = properties.get("update_version") or 0
+        if active is None or not 0 < updated <= active or not properties.get("pending_patch"):
+            return properties
+        return {**properties, **json.loads(properties["pending_patch"])}
+
+    @staticmethod
+    def _cursor(collection, properties: List[str], page_size: int = 1000):
+        """Every object of `collection` (a tenant), paged with Weaviate's cursor."""
+        after = None
+        while True:
+            with weaviate_call("fetch_objects"):
+                response = collection.query.fetch_objects(limit=page_size, after=after, return_properties=properties)
+            yield from response.objects
+            if len(response.objects) < page_size:
+                return
+            after = response.objects[-1].uuid
+
+    def _document_objects(self, collection, document_id: str, properties: List[str], page_size: int = 1000):
+        """Every stored chunk of a document. Offset paging stops at QUERY_MAXIMUM_RESULTS (10k by default),
+        so a tenant, which holds only its document, is read with the cursor. The cursor cannot be filtered,
+        so in the shared collection the document's chunks are paged by chunk_sort_key instead: each page
+        starts at the last sort key of the one before, past the chunks with that key already returned."""
+        try:
+            if self.multi_tenant:
+                yield from self._cursor(collection, properties, page_size)
+                return
+            doc = Filter.by_property("original_document_id").equal(document_id)
+            last, returned = None, 0
+            while True:
+                with weaviate_call("fetch_objects"):
+                    response = collection.query.fetch_objects(
+                        filters=doc if last is None else Filter.all_of([
+                            doc, Filter.by_property("chunk_sort_key").greater_or_equal(last),
+                        ]),
+                        sort=Sort.by_property("chunk_sort_key"),
+                        offset=returned,
+                        limit=page_size,
+                        return_properties=[*properties, "chunk_sort_key"],
+                    )
+                yield from response.objects
+                if len(response.objects) < page_size:
+                    return
+                key = response.objects[-1].properties["chunk_sort_key"]
+                ties = sum(1 for obj in response.objects if obj.properties["chunk_sort_key"] == key)
+                returned = returned + ties if key == last else ties
+                last = key
+        except Exception as e:
+            if not _is_missing_tenant(e):
+                raise
+
+    def get_chunk_manifest(self, document_id: str) -> List[StoredChunk]:
+        """Lists the stored chunks of a document (id, content hash, position) without vectors or text.
+        Chunks of an update that did not finish are left out."""
+        self._ensure_connected()
+        head = self._head(document_id)
+        active = head["active_version"] if head is not None else None
+        manifest = []
+        for obj in self._document_objects(self._partition(document_id), document_id, [
+            "content_hash", "chunk_sort_key", "filename", "metadata", *SETTLE_PROPERTIES,
+        ]):
+            if active is not None and not self._visible(obj.properties, active):
+                continue
+            properties = self._settled_properties(obj.properties, active)
+            manifest.append(StoredChunk(
+                uuid=str(obj.uuid),
+                content_hash=properties.get("content_hash"),
+                chunk_sort_key=properties.get("chunk_sort_key"),
+                filename=properties.get("filename"),
+                metadata=properties.get("metadata"),
+                doc_version=properties.get("doc_version"),
+            ))
+        return manifest
+
+    def _patch(self, collection, properties: Dict[str, dict]):
+        """Updates the properties of several objects, {uuid: properties}."""
+        def update(item):
+            with weaviate_call("update"):
+                collection.data.update(uuid=item[0], properties=item[1])
+
+        list(self._batch_executor.map(update, properties.items()))
+
+    @staticmethod
+    def _settle_patch(properties: dict, active: int) -> dict:
+        """The write that settles a chunk changed by an update: its pending patch applied if the update's
+        version became active, dropped if it did not."""
+        updated = properties.get("update_version") or 0
+        patch = json.loads(properties.get("pending_patch") or "{}") if 0 < updated <= active else {}
+        return {**patch, "update_version": 0, "pending_patch": ""}
+
+    def _recover(self, collection, document_id: str, active: int):
+        """Undoes or finishes what an earlier, unfinished update of a document left behind. If its version
+        never became active, its chunks are deleted and the chunks it retired or changed are restored; if
+        it got past its switch, the chunks it retired are deleted and its changes are applied."""
+        stale, patches = [], {}
+        for obj in self._document_objects(collection, document_id, SETTLE_PROPERTIES):
+            retired = obj.properties.get("retired_version") or 0
+            if (obj.properties.get("doc_version") or 0) > active or 0 < retired <= active:
+                stale.append(str(obj.uuid))
+            elif self._unsettled(obj.properties):
+                patches[str(obj.uuid)] = {"retired_version": 0, **self._settle_patch(obj.properties, active)}
+        self._delete_objects(collection, stale)
+        self._patch(collection, patches)
+
+    def apply_chunk_diff(self, document: Document, diff: ChunkDiff, embeddings: List[List[float]]) -> str:
+        """Moves a stored document to the chunk list in `document.content`, touching only what changed.
+
+        New chunks are written under the next document version, removed chunks are marked as retired by
+        it and kept chunks get their new position and metadata as a patch pending on it, while the
+        document's version record keeps queries on the current version. Rewriting the record is the
+        switch: one write after which queries see exactly the new version. The chunks are settled after
+        that (patches applied, removed chunks deleted) and the record is dropped with them. An update cut
+        short is cleaned up by the next.
+        """
+        self._ensure_connected()
+        collection = self._partition(document.id)
+        head = self._head(document.id)
+        active = head["active_version"] if head is not None else diff.stored_version
+        version = max(diff.stored_version, active, (head or {}).get("pending_version") or 0) + 1
+        # Chunks stored before versions existed have none; the version filter needs them to be 0.
+        self._patch(collection, {uuid: {"doc_version": 0, "retired_version": 0} for uuid in diff.unversioned_uuids})
+        self._put_head(document.id, active, version)
+        if head is not None:
+            self._recover(collection, document.id, active)
+
+        objects = [
+            self._chunk_object(document, index, embedding, diff.identities[index], version=version)
+            for index, embedding in zip(diff.new_indices, embeddings)
+        ]
+        try:
+            self._write_objects(document.id, objects)
+        except IndexingError:
+            self._drop_head(document.id)
+            raise
+        self._patch(collection, {
+            **{uuid: {"update_version": version, "pending_patch": json.dumps(patch)} for uuid, patch in diff.updates.items()},
+            **{uuid: {"retired_version": version} for uuid in diff.removed_uuids},
+        })
+        self._put_head(document.id, version, version)
+
+        self._patch(collection, {
+            **{obj.uuid: {"update_version": 0} for obj in objects},
+            **{uuid: {**patch, "update_version": 0, "pending_patch": ""} for uuid, patch in diff.updates.items()},
+        })
+        self._delete_objects(collection, diff.removed_uuids)
+        self._drop_head(document.id)
+        return document.id
+
+    @staticmethod
+    def _insert_batch(collection, objects: List[DataObject], indices: List[int]) -> Dict[int, str]:
+        """Inserts objects[indices] in one insert_many call and returns {chunk index: error} for failures."""
+        try:
+            with weaviate_call("insert_many"):
+                response = collection.data.insert_many([objects[i] for i in indices])
+        except Exception as e:
+            return {i: str(e) for i in indices}
+        return WeaviateService._batch_failures(response, indices)
+
+    @staticmethod
+    def _version_filter(active: int):
+        """Chunks of document version `active`: written by it or before, and not retired by then."""
+        retired = Filter.by_property("retired_version")
+        return Filter.all_of([
+            Filter.by_property("doc_version").less_or_equal(active),
+            Filter.any_of([retired.equal(0), retired.greater_than(active)]),
+        ])
+
+    def _visibility_filter(self, document_id: Union[str, List[str]], versions: Optional[Dict[str, int]]):
+        """Hides the chunks of unfinished updates; `versions` holds the documents being updated."""
+        if not versions:
+            return None
+        if self.multi_tenant or (isinstance(document_id, str) and document_id != ""):
+            # The search covers a single document.
+            return self._version_filter(next(iter(versions.values())))
+        doc = Filter.by_property("original_document_id")
+        return Filter.any_of([
+            Filter.all_of([doc.not_equal(d) for d in versions]),
+            *(Filter.all_of([doc.equal(d), self._version_filter(active)]) for d, active in versions.items()),
+        ])
+
+    def _query_filters(self, document_id: Union[str, List[str]], hierarchy_path: str = None,
+                       versions: Optional[Dict[str, int]] = None):
+        conditions = []
+        if isinstance(document_id, list):
+            conditions.append(Filter.by_property("original_document_id").contains_any(document_id))
+        # A tenant only holds its own document's chunks, so it needs no document filter.
+        elif(document_id != "" and not self.multi_tenant):
+            conditions.append(Filter.by_property("original_document_id").equal(document_id))
+        if hierarchy_path:
+            conditions.append(Filter.by_property(HIERARCHY_PATHS_PROPERTY.name).contains_any([hierarchy_path]))
+        visibility = self._visibility_filter(document_id, versions)
+        if visibility is not None:
+            conditions.append(visibility)
+        return Filter.all_of(conditions) if conditions else None
+
+    @classmethod
+    def _query_results(cls, response, score, versions: Optional[Dict[str, int]] = None) -> List[QueryResult]:
+        """Results of a search. A search without `versions` that met unsettled chunks raises
+        _UnsettledResults; with them, chunks changed by an update read as of its document's active version."""
+        if versions is None:
+            unsettled = {obj.properties["original_document_id"] for obj in response.objects if cls._unsettled(obj.properties)}
+            if unsettled:
+                raise _UnsettledResults(sorted(unsettled))
         results = []
         for obj in response.objects:
+            properties = cls._settled_properties(obj.properties, (versions or {}).get(obj.properties["original_document_id"]))
             results.append(QueryResult(
-                document_id=obj.properties["original_document_id"],
-                snippet=obj.properties["content_chunk"],
-                score=1-obj.metadata.distance       , 
-                # Convert distance to similarity score
+                document_id=properties["original_document_id"],
+                snippet=properties["content_chunk"],
+                score=score(obj.metadata),
                 metadata=obj.metadata,
-                chunk_order_key=obj.properties["chunk_sort_key"]
+                chunk_order_key=properties["chunk_sort_key"]
             ))
-        print(len(results))
         return results
-    # def query_hierarchical_json(self, document_id: str, query_embedding: List[float],
-    #                             hierarchy_filter: str = None, limit: int = 6) -> List[QueryResult]:
-    #     """
-    #     Query JSON document chunks with optional hierarchical filtering.
-    #     If a hierarchy_filter is provided, it will further restrict the search
-    #     to chunks whose metadata (containing the hierarchy paths) includes the filter text.
-    #     """
-    #     collection = self.client.collections.get(self.class_name)
-    #     # Build filter: first, ensure we only search within the document.
-    #     filter_obj = Filter.by_property("original_document_id").equal(document_id)
-    #     # If a hierarchy filter is specified, add an extra condition on the metadata.
-    #     if hierarchy_filter:
-    #         # Assumes that the 'metadata' field (stored as string) includes the hierarchy paths.
-    #         filter_obj = filter_obj.and_(Filter.by_property("metadata").contains(hierarchy_filter))
-    #     response = collection.query.near_vector(
-    #         near_vector=query_embedding,
-    #         return_metadata=MetadataQuery(distance=True, score=True),
-    #         limit=limit,
-    #         filters=filter_obj,
-    #         return_properties=["filename", "content_chunk", "chunk_sort_key", "original_document_id"]
-    #     )
-    #     results = []
-    #     for obj in response.objects:
-    #         results.append(QueryResult(
-    #             document_id=obj.properties["original_document_id"],
-    #             snippet=obj.properties["content_chunk"],
-    #             score=1 - obj.metadata.distance,
-    #             metadata=obj.metadata,
-    #             chunk_order_key=obj.properties["chunk_sort_key"]
-    #         ))
-    #     return results
-    def delete_document(self, document_id: str):
-        """Delete all chunks associated with a document"""
-        collection = self.client.collections.get(self.class_name)
-        collection.data.delete_many(
-            where=Filter.by_property("original_document_id").equal(document_id)
+
+    def _near_vector_args(self, document_id: str, query_embedding: List[float], limit: int, hierarchy_path: str = None,
+                          versions: Optional[Dict[str, int]] = None) -> dict:
+        return dict(
+            near_vector=query_embedding,
+            return_metadata=MetadataQuery(distance=True,score=True),
+            limit=limit,
+            # certainty=0.5,
+            filters=self._query_filters(document_id, hierarchy_path, versions),
+            return_properties=RESULT_PROPERTIES,
         )
+
+    def _bm25_args(self, document_id: str, query_text: str, limit: int, hierarchy_path: str = None,
+                   versions: Optional[Dict[str, int]] = None) -> dict:
+        return dict(
+            query=query_text,
+            query_properties=["content_chunk"],
+            return_metadata=MetadataQuery(score=True),
+            limit=limit,
+            filters=self._query_filters(document_id, hierarchy_path, versions),
+            return_properties=RESULT_PROPERTIES,
+        )
+
+    def _hybrid_args(self, document_id: str, query_text: str, query_embedding: List[float], limit: int,
+                     hierarchy_path: str = None, versions: Optional[Dict[str, int]] = None) -> dict:
+        return dict(
+            query=query_text,
+            vector=query_embedding,
+            target_vector=VECTOR_NAME,
+            query_properties=["content_chunk"],
+            alpha=self.config.HYBRID_ALPHA,
+            fusion_type=HybridFusion.RANKED,
+            return_metadata=MetadataQuery(score=True),
+            limit=limit,
+            filters=self._query_filters(document_id, hierarchy_path, versions),
+            return_properties=RESULT_PROPERTIES,
+        )
+
+    @staticmethod
+    def _search_partition(operation: str, search):
+        """Runs one search; a document without a tenant has no chunks (None)."""
+        try:
+            with weaviate_call(operation):
+                return search()
+        except Exception as e:
+            if _is_missing_tenant(e):
+                return None
+            raise
+
+    def _search(self, collection, mode: str, document_id: Union[str, List[str]], query_text: str,
+                query_embedding: Optional[List[float]], limit: int, hierarchy_path: str = None,
+                versions: Optional[Dict[str, int]] = None) -> List[QueryResult]:
+        """One search of `collection`: a document's tenant, or the shared collection filtered to document_id.
+        `versions` are the active versions of the documents being updated (see _settled)."""
+        if mode == "keyword":
+            args = self._bm25_args(document_id, query_text, limit, hierarchy_path, versions)
+            response = self._search_partition("bm25", lambda: collection.query.bm25(**args))
+            score = lambda metadata: metadata.score
+        elif mode == "hybrid":
+            args = self._hybrid_args(document_id, query_text, query_embedding, limit, hierarchy_path, versions)
+            response = self._search_partition("hybrid", lambda: collection.query.hybrid(**args))
+            score = lambda metadata: metadata.score
+        else:
+            args = self._near_vector_args(document_id, query_embedding, limit, hierarchy_path, versions)
+            response = self._search_partition("near_vector", lambda: collection.query.near_vector(**args))
+            # Convert distance to similarity score
+            score = lambda metadata: 1 - metadata.distance
+        return self._query_results(response, score, versions) if response is not None else []
+
+    def _settled(self, search):
+        """Runs search(versions), first with no version filter: for documents not being updated that is the
+        only round trip. If it met chunks of unfinished updates, the search runs again with the active
+        versions of those documents, which hides the versions queries must not see yet."""
+        try:
+            return search(None)
+        except _UnsettledResults as e:
+            return search(self._active_versions(e.document_ids))
+
+    def query_document(self, document_id: str, query_embedding: List[float], limit: int = 6, hierarchy_path: str = None) -> List[QueryResult]:
+        """Query document chunks using vector search, optionally within one JSON subtree"""
+        self._ensure_connected()
+        if document_id == "" and self.multi_tenant:
+            return self.query_scope(None, "vector", None, query_embedding, limit, hierarchy_path).results
+        return self._settled(partial(self._search, self._partition(document_id), "vector", document_id, None, query_embedding,
+                                     limit, hierarchy_path))
+
+    def query_keyword(self, document_id: str, query_text: str, limit: int = 6, hierarchy_path: str = None) -> List[QueryResult]:
+        """Query document chunks with BM25 over content_chunk; needs no embedding. Scores are BM25 scores
+        (with partitioned documents, term statistics are per document)."""
+        self._ensure_connected()
+        if document_id == "" and self.multi_tenant:
+            return self.query_scope(None, "keyword", query_text, None, limit, hierarchy_path).results
+        return self._settled(partial(self._search, self._partition(document_id), "keyword", document_id, query_text, None,
+                                     limit, hierarchy_path))
+
+    def query_hybrid(self, document_id: str, query_text: str, query_embedding: List[float], limit: int = 6,
+                     hierarchy_path: str = None) -> List[QueryResult]:
+        """Query document chunks with BM25 and vector search fused by rank (Weaviate's ranked fusion is
+        reciprocal rank fusion). HYBRID_ALPHA weights the vector side."""
+        self._ensure_connected()
+        if document_id == "" and self.multi_tenant:
+            return self.query_scope(None, "hybrid", query_text, query_embedding, limit, hierarchy_path).results
+        return self._settled(partial(self._search, self._partition(document_id), "hybrid", document_id, query_text, query_embedding,
+                                     limit, hierarchy_path))
+
+    # Queries over several documents. Without tenants they are one search of the shared index with a
+    # document filter. With tenants every tenant is searched in parallel (QUERY_SCATTER_PER_REQUEST at a
+    # time) and the results are merged here: vector scores are cosine similarities and merge as they are,
+    # but Weaviate keeps BM25 statistics per tenant and cannot score with the corpus-wide ones, so raw
+    # BM25 scores of different tenants do not compare. Keyword rankings therefore merge by reciprocal rank
+    # (1 / (HYBRID_RRF_K + rank), raw BM25 only breaking ties), hybrid fuses the merged vector and keyword
+    # rankings the same way, and both report scoring "rank_fusion".
+
+    def _scope_tenants(self, document_ids: Optional[List[str]], tenants) -> Dict[str, str]:
+        """{name reported when missing: tenant} for the given documents, or every tenant. Refuses a
+        corpus of more than QUERY_SCOPE_MAX_DOCUMENTS tenants."""
+        if document_ids is None:
+            check_scope(len(tenants), self.config.QUERY_SCOPE_MAX_DOCUMENTS)
+            return {tenant: tenant for tenant in tenants}
+        return {document_id: partition_name(document_id) for document_id in dict.fromkeys(document_ids)}
+
+    def _scoring(self, mode: str) -> str:
+        if mode == "vector":
+            return "cosine"
+        return "bm25" if mode == "keyword" and not self.multi_tenant else "rank_fusion"
+
+    def _merge_keyword(self, rankings: List[List[QueryResult]], limit: int) -> List[QueryResult]:
+        """Merges per-tenant BM25 rankings by reciprocal rank; `score` becomes the fused rank score."""
+        entries = [
+            (1.0 / (self.config.HYBRID_RRF_K + rank), result.score, position, result)
+            for position, ranking in enumerate(rankings) for rank, result in enumerate(ranking, start=1)
+        ]
+        return [replace(result, score=fused) for fused, _, _, result in heapq.nlargest(limit, entries, key=lambda e: e[:3])]
+
+    def _merge_tenants(self, found: List[Tuple[List[QueryResult], List[QueryResult]]], mode: str, limit: int) -> List[QueryResult]:
+        """Merges per-tenant (vector results, keyword results) into one ranking of `limit` results."""
+        depth = max(limit, self.config.HYBRID_CANDIDATES) if mode == "hybrid" else limit
+        # Every tenant returns at most `depth` results, so the merge keeps a bounded heap of `depth`.
+        vector = heapq.nlargest(depth, (result for results, _ in found for result in results), key=lambda result: result.score)
+        keyword = self._merge_keyword([results for _, results in found], depth)
+        if mode == "vector":
+            return vector
+        if mode == "keyword":
+            return keyword
+        results = {}
+        rankings = []
+        for ranking in (vector, keyword):
+            keys = []
+            for result in ranking:
+                key = (result.document_id, result.chunk_order_key)
+                results.setdefault(key, result)
+                keys.append(key)
+            rankings.append(keys)
+        return [replace(results[key], score=score) for key, score in rrf_fuse(rankings, k=self.config.HYBRID_RRF_K)[:limit]]
+
+    def _search_tenant(self, collection, mode: str, query_text: str, query_embedding: Optional[List[float]],
+                       limit: int, hierarchy_path: str = None) -> Tuple[List[QueryResult], List[QueryResult]]:
+        depth = max(limit, self.config.HYBRID_CANDIDATES) if mode == "hybrid" else limit
+
+        def search(versions):
+            vector = self._search(collection, "vector", "", None, query_embedding, depth, hierarchy_path, versions) if mode != "keyword" else []
+            keyword = self._search(collection, "keyword", "", query_text, None, depth, hierarchy_path, versions) if mode != "vector" else []
+            return vector, keyword
+        return self._settled(search)
+
+    def query_scope(self, document_ids: Optional[List[str]], mode: str, query_text: str,
+                    query_embedding: Optional[List[float]], limit: int = 6, hierarchy_path: str = None,
+                    timeout: float = None) -> GatheredResults:
+        """Queries several documents, or every document for document_ids None, in one merged ranking.
+        Searches still running `timeout` seconds in are left out and reported as missing."""
+        self._ensure_connected()
+        limit = limit or 6
+        deadline = deadline_after(timeout)
+        if not self.multi_tenant:
+            scope = list(dict.fromkeys(document_ids)) if document_ids is not None else ""
+            found, missing = scatter(self._scatter_executor, {self.class_name: partial(self._settled, partial(
+                self._search, self.collection, mode, scope, query_text, query_embedding, limit, hierarchy_path,
+            ))}, deadline, 1)
+            if missing:
+                return GatheredResults(results=[], partial=True, missing=scope or [self.class_name], scoring=self._scoring(mode))
+            return GatheredResults(results=found[self.class_name], scoring=self._scoring(mode))
+        tenants = ()
+        if document_ids is None:
+            with weaviate_call("get_tenants"):
+                tenants = self.collection.tenants.get()
+        found, missing = scatter(self._scatter_executor, {
+            name: partial(self._search_tenant, self.collection.with_tenant(tenant), mode, query_text, query_embedding,
+                          limit, hierarchy_path)
+            for name, tenant in self._scope_tenants(document_ids, tenants).items()
+        }, deadline, self.config.QUERY_SCATTER_PER_REQUEST)
+        return GatheredResults(results=self._merge_tenants(list(found.values()), mode, limit), partial=bool(missing),
+                               missing=missing, scoring=self._scoring(mode))
+
+    def query_hierarchical_json(self, document_id: str, query_embedding: List[float],
+                                hierarchy_filter: str = None, limit: int = 6) -> List[QueryResult]:
+        """Query JSON document chunks, restricted to the subtree at `hierarchy_filter` (e.g. "company.employees")."""
+        return self.query_document(document_id, query_embedding, limit, hierarchy_path=hierarchy_filter)
+
+    def delete_document(self, document_id: str):
+        """Delete all chunks associated with a document: drops its tenant, or deletes by filter"""
+        self._ensure_connected()
+        if self.multi_tenant:
+            with weaviate_call("remove_tenant"):
+                self.collection.tenants.remove([partition_name(document_id)])
+        else:
+            with weaviate_call("delete_many"):
+                self.collection.data.delete_many(
+                    where=Filter.by_property("original_document_id").equal(document_id)
+                )
+        self._drop_head(document_id)
         return document_id
     
+    # Async variants for the ASGI app. Queries, inserts and deletes go through the async client;
+    # updates (manifest + diff) are rare and run the sync methods in a worker thread.
+
+    @staticmethod
+    async def _search_partition_async(operation: str, search):
+        try:
+            with weaviate_call(operation):
+                return await search()
+        except Exception as e:
+            if _is_missing_tenant(e):
+                return None
+            raise
+
+    async def _search_async(self, collection, mode: str, document_id: Union[str, List[str]], query_text: str,
+                            query_embedding: Optional[List[float]], limit: int, hierarchy_path: str = None,
+                            versions: Optional[Dict[str, int]] = None) -> List[QueryResult]:
+        if mode == "keyword":
+            args = self._bm25_args(document_id, query_text, limit, hierarchy_path, versions)
+            response = await self._search_partition_async("bm25", lambda: collection.query.bm25(**args))
+            score = lambda metadata: metadata.score
+        elif mode == "hybrid":
+            args = self._hybrid_args(document_id, query_text, query_embedding, limit, hierarchy_path, versions)
+            response = await self._search_partition_async("hybrid", lambda: collection.query.hybrid(**args))
+            score = lambda metadata: metadata.score
+        else:
+            args = self._near_vector_args(document_id, query_embedding, limit, hierarchy_path, versions)
+            response = await self._search_partition_async("near_vector", lambda: collection.query.near_vector(**args))
+            score = lambda metadata: 1 - metadata.distance
+        return self._query_results(response, score, versions) if response is not None else []
+
+    async def _settled_async(self, search):
+        try:
+            return await search(None)
+        except _UnsettledResults as e:
+            return await search(await self._active_versions_async(e.document_ids))
+
+    async def query_document_async(self, document_id: str, query_embedding: List[float], limit: int = 6,
+                                   hierarchy_path: str = None) -> List[QueryResult]:
+        if document_id == "" and self.multi_tenant:
+            return (await self.query_scope_async(None, "vector", None, query_embedding, limit, hierarchy_path)).results
+        return await self._settled_async(partial(self._search_async, await self._partition_async(document_id), "vector",
+                                                 document_id, None, query_embedding, limit, hierarchy_path))
+
+    async def query_keyword_async(self, document_id: str, query_text: str, limit: int = 6,
+                                  hierarchy_path: str = None) -> List[QueryResult]:
+        if document_id == "" and self.multi_tenant:
+            return (await self.query_scope_async(None, "keyword", query_text, None, limit, hierarchy_path)).results
+        return await self._settled_async(partial(self._search_async, await self._partition_async(document_id), "keyword",
+                                                 document_id, query_text, None, limit, hierarchy_path))
+
+    async def query_hybrid_async(self, document_id: str, query_text: str, query_embedding: List[float], limit: int = 6,
+                                 hierarchy_path: str = None) -> List[QueryResult]:
+        if document_id == "" and self.multi_tenant:
+            return (await self.query_scope_async(None, "hybrid", query_text, query_embedding, limit, hierarchy_path)).results
+        return await self._settled_async(partial(self._search_async, await self._partition_async(document_id), "hybrid",
+                                                 document_id, query_text, query_embedding, limit, hierarchy_path))
+
+    async def _search_tenant_async(self, collection, mode: str, query_text: str, query_embedding: Optional[List[float]],
+                                   limit: int, hierarchy_path: str = None) -> Tuple[List[QueryResult], List[QueryResult]]:
+        depth = max(limit, self.config.HYBRID_CANDIDATES) if mode == "hybrid" else limit
+
+        async def search(versions):
+            vector = await self._search_async(collection, "vector", "", None, query_embedding, depth, hierarchy_path, versions) if mode != "keyword" else []
+            keyword = await self._search_async(collection, "keyword", "", query_text, None, depth, hierarchy_path, versions) if mode != "vector" else []
+            return vector, keyword
+        return await self._settled_async(search)
+
+    async def query_scope_async(self, document_ids: Optional[List[str]], mode: str, query_text: str,
+                                query_embedding: Optional[List[float]], limit: int = 6, hierarchy_path: str = None,
+                                timeout: float = None) -> GatheredResults:
+        limit = limit or 6
+        deadline = deadline_after(timeout)
+        collection = await self._collection_async()
+        concurrency = self.config.QUERY_SCATTER_PER_REQUEST
+        if not self.multi_tenant:
+            scope = list(dict.fromkeys(document_ids)) if document_ids is not None else ""
+            found, missing = await scatter_async({self.class_name: partial(self._settled_async, partial(
+                self._search_async, collection, mode, scope, query_text, query_embedding, limit, hierarchy_path,
+            ))}, deadline, concurrency)
+            if missing:
+                return GatheredResults(results=[], partial=True, missing=scope or [self.class_name], scoring=self._scoring(mode))
+            return GatheredResults(results=found[self.class_name], scoring=self._scoring(mode))
+        tenants = ()
+        if document_ids is None:
+            with weaviate_call("get_tenants"):
+                tenants = await collection.tenants.get()
+        found, missing = await scatter_async({
+            name: partial(self._search_tenant_async, collection.with_tenant(tenant), mode, query_text, query_embedding,
+                          limit, hierarchy_path)
+            for name, tenant in self._scope_tenants(document_ids, tenants).items()
+        }, deadline, concurrency)
+        return GatheredResults(results=self._merge_tenants(list(found.values()), mode, limit), partial=bool(missing),
+                               missing=missing, scoring=self._scoring(mode))
+
+    async def index_document_async(self, document: Document, embeddings: List[List[float]], start_index: int = 0,
+                                   identities=None) -> str:
+        """index_document on the async client, with the same batching, retries and rollback."""
+        await self._write_objects_async(document.id, self._chunk_objects(document, embeddings, start_index, identities))
+        return document.id
+
+    async def _write_objects_async(self, document_id: str, objects: List[DataObject]):
+        collection = await self._partition_async(document_id)
+        slots = asyncio.Semaphore(self.config.WEAVIATE_BATCH_CONCURRENCY)
+
+        async def insert(indices: List[int]) -> Dict[int, str]:
+            async with slots:
+                try:
+                    with weaviate_call("insert_many"):
+                        response = await collection.data.insert_many([objects[i] for i in indices])
+                except Exception as e:
+                    return {i: str(e) for i in indices}
+            return self._batch_failures(response, indices)
+
+        pending = list(range(len(objects)))
+        for attempt in range(self.config.WEAVIATE_MAX_RETRIES + 1):
+            failures = {}
+            for batch_failures in await asyncio.gather(*(insert(batch) for batch in self._batches(pending))):
+                failures.update(batch_failures)
+            if not failures:
+                return
+            pending = sorted(failures)
+            delay = self._retry_delay(document_id, failures, attempt)
+            if delay is not None:
+                await asyncio.sleep(delay)
+
+        await self._delete_objects_async(collection, [obj.uuid for obj in objects])
+        raise self._indexing_error(document_id, objects, failures)
+
+    @classmethod
+    async def _delete_objects_async(cls, collection, object_ids: List[str]):
+        for ids in cls._id_slices(object_ids):
+            with weaviate_call("delete_many"):
+                await collection.data.delete_many(where=Filter.by_id().contains_any(ids))
+
+    async def get_chunk_manifest_async(self, document_id: str) -> List[StoredChunk]:
+        return await asyncio.to_thread(self.get_chunk_manifest, document_id)
+
+    async def apply_chunk_diff_async(self, document: Document, diff: ChunkDiff, embeddings: List[List[float]]) -> str:
+        return await asyncio.to_thread(self.apply_chunk_diff, document, diff, embeddings)
+
+    async def delete_document_async(self, document_id: str):
+        collection = await self._collection_async()
+        if self.multi_tenant:
+            with weaviate_call("remove_tenant"):
+                await collection.tenants.remove([partition_name(document_id)])
+        else:
+            with weaviate_call("delete_many"):
+                await collection.data.delete_many(where=Filter.by_property("original_document_id").equal(document_id))
+        with weaviate_call("delete_by_id"):
+            await self._async_versions.data.delete_by_id(self._head_id(document_id))
+        return document_id
+
+    async def aclose(self):
+        """Closes the async client; call from the event loop that used it."""
+        if self.async_client is not None:
+            await self.async_client.close()
+            self.async_client = None
+            self._async_collection = None
+            self._async_versions = None
+
     def close(self):
-        """Close the client connection"""
+        """Stop health checks and close the client connection"""
+        self._stop_health_checks.set()
+        if self._health_thread is not None:
+            self._health_thread.join(timeout=5)
+            self._health_thread = None
+        self._batch_executor.shutdown(wait=False)
+        self._scatter_executor.shutdown(wait=False)
         self.client.close()
 
 # def main():
@@ -0,0 +1,280 @@
+import bisect
+import json
+import re
+from collections import deque
+from typing import Iterable, Iterator, List, Tuple
+
+import ijson
+import numpy as np
+
+
+def _iter_pieces(blocks: Iterable[str], separator: str, max_piece: int) -> Iterator[str]:
+    """Splits streamed text into pieces that start at `separator` (kept with the text after it).
+
+    A piece never exceeds `max_piece` characters, so text without separators still streams in
+    bounded memory.
+    """
+    buffer = ""
+    for block in blocks:
+        buffer += block
+        start = 0
+        while True:
+            index = buffer.find(separator, start + 1)
+            if index == -1:
+                break
+            yield buffer[start:index]
+            start = index
+        buffer = buffer[start:]
+        while len(buffer) > max_piece:
+            yield buffer[:max_piece]
+            buffer = buffer[max_piece:]
+    if buffer:
+        yield buffer
+
+
+def iter_text_chunks(blocks: Iterable[str], chunk_size: int, chunk_overlap: int = 0, separator: str = ".") -> Iterator[str]:
+    """Streaming equivalent of RecursiveCharacterTextSplitter(separators=[separator]).
+
+    Consumes text blocks lazily and yields chunks as soon as they are complete, so memory use depends on
+    `chunk_size`, not on the length of the input.
+    """
+    current = deque()
+    total = 0
+    for piece in _iter_pieces(blocks, separator, max_piece=max(chunk_size * 8, 65536)):
+        length = len(piece)
+        if length >= chunk_size:
+            # Oversized pieces cannot be split further; they become chunks of their own.
+            if current:
+                chunk = "".join(current).strip()
+                if chunk:
+                    yield chunk
+                current.clear()
+                total = 0
+            yield piece
+            continue
+        if total + length > chunk_size and current:
+            chunk = "".join(current).strip()
+            if chunk:
+                yield chunk
+            while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                total -= len(current.popleft())
+        current.append(piece)
+        total += length
+    if current:
+        chunk = "".join(current).strip()
+        if chunk:
+            yield chunk
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    """Groups an iterable into lists of at most `size` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _path_prefixes(components) -> List[str]:
+    """Every path from the root down to a leaf: ("a", "b", 0) -> ["a", "a.b", "a.b[0]"]."""
+    prefixes = []
+    path = ""
+    for component in components:
+        if isinstance(component, int):
+            path += f"[{component}]"
+        else:
+            path += f".{component}" if path else component
+        prefixes.append(path)
+    return prefixes
+
+
+def iter_json_leaves(stream) -> Iterator[tuple]:
+    """Yields (path components, value) for every scalar of a JSON document, parsing incrementally.
+
+    Components are keys (str) and array indices (int), e.g. ("a", "b", 0, "c") for a.b[0].c.
+    """
+    frames = []  # [components of the container, next array index or current key, is_array]
+    for _, event, value in ijson.parse(stream, use_float=True):
+        if event == "map_key":
+            frames[-1][1] = value
+            continue
+        if event in ("end_map", "end_array"):
+            frames.pop()
+            continue
+        if frames:
+            parent = frames[-1]
+            components = parent[0] + (parent[1],)
+            if parent[2]:
+                parent[1] += 1
+        else:
+            components = ()
+        if event == "start_map":
+            frames.append([components, None, False])
+        elif event == "start_array":
+            frames.append([components, 0, True])
+        else:
+            yield components, value
+
+
+def iter_json_chunks(stream, chunk_size: int) -> Iterator[tuple]:
+    """Groups the leaves of a streamed JSON document into chunks of at most `chunk_size` characters.
+
+    Yields (chunk text, hierarchy paths): the text has one "path: value" line per leaf, the paths are
+    every leaf path of the chunk plus all their ancestors, so "is anything under a.b[0] in this chunk"
+    is a single membership test. Leaves under different top-level keys never share a chunk; elements
+    of a top-level array are packed together. A single leaf longer than `chunk_size` is its own chunk.
+    """
+    lines = []
+    paths = {}  # insertion-ordered set
+    size = 0
+    section = None
+    for components, value in iter_json_leaves(stream):
+        prefixes = _path_prefixes(components)
+        text = value if isinstance(value, str) else json.dumps(value)
+        line = f"{prefixes[-1]}: {text}" if prefixes else text
+        new_section = bool(components) and isinstance(components[0], str) and components[0] != section
+        if lines and (size + len(line) + 1 > chunk_size or new_section):
+            yield "\n".join(lines), list(paths)
+            lines, paths, size = [], {}, 0
+        section = components[0] if components else None
+        lines.append(line)
+        paths.update(dict.fromkeys(prefixes))
+        size += len(line) + 1
+    if lines:
+        yield "\n".join(lines), list(paths)
+
+
+# ASCII lookup tables for token_starts; index 128 stands for every non-ASCII character.
+_WORD = np.zeros(129, dtype=bool)
+_WORD[[ord(c) for c in "0123456789_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"] + [128]] = True
+_SPACE = np.zeros(129, dtype=bool)
+_SPACE[[ord(c) for c in " \t\n\r\f\v"]] = True
+
+
+def token_starts(text: str, block_size: int = 1 << 20) -> np.ndarray:
+    """Offsets where a token starts: a run of word characters or a single punctuation mark (like the
+    regex \\w+|[^\\w\\s], counting non-ASCII characters as word characters).
+
+    Vectorized over code points, `block_size` characters at a time, so sizing in tokens costs a
+    fraction of a regex scan and no Python object per token.
+    """
+    starts = []
+    previous_word = False
+    for offset in range(0, len(text), block_size):
+        codes = np.minimum(np.frombuffer(text[offset:offset + block_size].encode("utf-32-le"), dtype=np.uint32), 128)
+        word = _WORD[codes]
+        start = ~word & ~_SPACE[codes]
+        start[0] |= word[0] and not previous_word
+        start[1:] |= word[1:] & ~word[:-1]
+        starts.append(np.flatnonzero(start) + offset)
+        previous_word = bool(word[-1])
+    return np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count used for token-based chunk sizes (see token_starts)."""
+    return len(token_starts(text))
+
+
+class MarkdownChunker:
+    """Single-pass chunker for markdown and plain text that returns (start, end) offsets into the text.
+
+    Two regex scans collect the places a chunk may end: sentence ends and line/paragraph breaks, and
+    markdown headers up to `max_header_level` (outside fenced code), which a chunk never crosses.
+    Chunks are then packed greedily with bisect over those offsets, one step per chunk rather than
+    per sentence, up to `chunk_size` measured in characters or, with unit="tokens", in token_starts
+    tokens. A sentence longer than that is cut at whitespace. Overlap is made of whole trailing
+    sentences of at most `chunk_overlap`, so no chunk starts mid-sentence.
+    """
+
+    # Sentence end or line break followed by whitespace (so also blank lines); kept simple so the
+    # regex engine can skip ahead to the next [.!?\n] quickly.
+    _BREAK = re.compile(r"[.!?\n][\"')\]]*\s+")
+
+    def __init__(self, chunk_size: int, chunk_overlap: int = 0, unit: str = "chars", max_header_level: int = 4):
+        if unit not in ("chars", "tokens"):
+            raise ValueError(f"Unknown chunk size unit: {unit}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.unit = unit
+        # Anchored on the newline instead of ^ with re.M, which is several times slower to scan.
+        self._block = re.compile(rf"\n(?:(?P<fence>[ \t]*(?:```|~~~))|#{{1,{max_header_level}}}[ \t])")
+
+    def _headers(self, text: str) -> List[int]:
+        """Offsets of the header lines outside fenced code."""
+        lines = [(match.start() + 1, match.group("fence")) for match in self._block.finditer(text)]
+        first = self._block.match("\n" + text[:64])  # the first line has no newline before it
+        if first:
+            lines.insert(0, (0, first.group("fence")))
+        headers = []
+        in_code = False
+        for start, fence in lines:
+            if fence:
+                in_code = not in_code
+            elif not in_code:
+                headers.append(start)
+        return headers
+
+    def _cut(self, text: str, start: int, end: int) -> Iterator[Tuple[int, int]]:
+        """Cuts an oversized span into pieces of at most chunk_size, preferring whitespace."""
+        if self.unit == "tokens":
+            starts = token_starts(text[start:end]) + start
+            for cut in starts[self.chunk_size::self.chunk_size].tolist():
+                yield start, cut
+                start = cut
+            yield start, end
+            return
+        while end - start > self.chunk_size:
+            limit = start + self.chunk_size
+            cut = max(text.rfind(" ", start + self.chunk_size // 2, limit), text.rfind("\n", start + self.chunk_size // 2, limit))
+            cut = limit if cut == -1 else cut + 1
+            yield start, cut
+            start = cut
+        yield start, end
+
+    @staticmethod
+    def _strip(text: str, start: int, end: int) -> Tuple[int, int]:
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return start, end
+
+    def spans(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yields the (start, end) offsets of the chunks of `text`, in order; text[start:end] is a chunk."""
+        headers = self._headers(text)
+        bounds = sorted({0, len(text), *headers, *(match.end() for match in self._BREAK.finditer(text))})
+        if self.unit == "tokens":
+            # Tokens starting before each bound, so a span's size is a difference of two weights.
+            weights = np.searchsorted(token_starts(text), np.asarray(bounds, dtype=np.int64)).tolist()
+        else:
+            weights = bounds
+        header_index = [bisect.bisect_left(bounds, header) for header in headers]
+        last = len(bounds) - 1
+        i = 0
+        while i < last:
+            h = bisect.bisect_right(headers, bounds[i])
+            stop = header_index[h] if h < len(headers) else last
+            j = bisect.bisect_right(weights, weights[i] + self.chunk_size, i + 1, stop + 1) - 1
+            if j == i:  # a single sentence over chunk_size
+                for piece in self._cut(text, bounds[i], bounds[i + 1]):
+                    span = self._strip(text, *piece)
+                    if span[0] < span[1]:
+                        yield span
+                i += 1
+                continue
+            span = self._strip(text, bounds[i], bounds[j])
+            if span[0] < span[1]:
+                yield span
+            if self.chunk_overlap > 0 and j < stop:
+                # Restart at the earliest sentence within the overlap that still leaves room for the next one.
+                floor = max(weights[j] - self.chunk_overlap, weights[j + 1] - self.chunk_size)
+                i = bisect.bisect_left(weights, floor, i + 1, j)
+            else:
+                i = j
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.spans(text)]
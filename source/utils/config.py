@@ -12,4 +12,146 @@ class Config:
     LLAMA_PARSE_API=os.environ.get('LLAMA_CLOUD_API_KEY')
     # Add other configurations as needed (e.g., chunk size, overlap)
     CHUNK_SIZE = 1000
-    CHUNK_OVERLAP = 10
\ No newline at end of file
+    CHUNK_OVERLAP = 10
+    CHUNKER = os.environ.get('CHUNKER', 'native')  # PDF/DOCX markdown: 'native' (MarkdownChunker) or 'langchain'
+    CHUNK_SIZE_UNIT = os.environ.get('CHUNK_SIZE_UNIT', 'chars')  # native chunker: 'chars' or 'tokens' (CHUNK_SIZE/OVERLAP unit)
+
+    # Shared service / connection settings (see source/services/container.py)
+    WEAVIATE_POOL_CONNECTIONS = int(os.environ.get('WEAVIATE_POOL_CONNECTIONS', 20))
+    WEAVIATE_POOL_MAXSIZE = int(os.environ.get('WEAVIATE_POOL_MAXSIZE', 100))
+    WEAVIATE_QUERY_TIMEOUT = int(os.environ.get('WEAVIATE_QUERY_TIMEOUT', 30))
+    WEAVIATE_INSERT_TIMEOUT = int(os.environ.get('WEAVIATE_INSERT_TIMEOUT', 90))
+    WEAVIATE_HEALTH_CHECK_INTERVAL = int(os.environ.get('WEAVIATE_HEALTH_CHECK_INTERVAL', 30))  # seconds, 0 disables
+    WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', 'False').lower() in ['true', '1', 't']
+
+    # Embeddings
+    EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'gemini')  # 'gemini' or 'fake' (deterministic, offline)
+    EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'text-embedding-004')
+    EMBEDDING_DIMENSIONS = int(os.environ.get('EMBEDDING_DIMENSIONS', 768))
+    EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 100))  # texts per embed_content call
+    EMBEDDING_MAX_CONCURRENCY = int(os.environ.get('EMBEDDING_MAX_CONCURRENCY', 4))  # batches in flight per process
+    EMBEDDING_MAX_RETRIES = int(os.environ.get('EMBEDDING_MAX_RETRIES', 3))
+    EMBEDDING_RETRY_BASE_DELAY = float(os.environ.get('EMBEDDING_RETRY_BASE_DELAY', 0.5))  # seconds
+    # Cross-request micro-batching: small embedding requests from concurrent callers share one backend call
+    EMBEDDING_MICROBATCH_ENABLED = os.environ.get('EMBEDDING_MICROBATCH_ENABLED', 'True').lower() in ['true', '1', 't']
+    EMBEDDING_MICROBATCH_WINDOW_MS = float(os.environ.get('EMBEDDING_MICROBATCH_WINDOW_MS', 3))  # longest wait for more requests
+    EMBEDDING_MICROBATCH_MAX_SIZE = int(os.environ.get('EMBEDDING_MICROBATCH_MAX_SIZE', 100))  # texts per coalesced call
+    # Quota-aware scheduling: one token bucket per API key and model, shared by all processes on the host
+    EMBEDDING_BUDGET_PATH = os.environ.get('EMBEDDING_BUDGET_PATH', 'data/cache/embedding_budget.sqlite3')
+    EMBEDDING_RATE_LIMIT_RPM = float(os.environ.get('EMBEDDING_RATE_LIMIT_RPM', 0))  # embedding calls per minute, 0 = no limit
+    EMBEDDING_RATE_BURST = float(os.environ.get('EMBEDDING_RATE_BURST', 10))  # calls that may go out back to back
+    EMBEDDING_QUERY_RESERVE = float(os.environ.get('EMBEDDING_QUERY_RESERVE', 2))  # tokens only queries may use
+    EMBEDDING_LATENCY_TARGET_MS = float(os.environ.get('EMBEDDING_LATENCY_TARGET_MS', 5000))  # slower calls shrink concurrency, 0 = off
+    EMBEDDING_RATE_LIMIT_MAX_WAIT = float(os.environ.get('EMBEDDING_RATE_LIMIT_MAX_WAIT', 120))  # seconds of 429s before giving up
+    FAKE_EMBEDDING_RPM = float(os.environ.get('FAKE_EMBEDDING_RPM', 0))  # fake backend answers 429 above this rate, 0 = never
+    FAKE_EMBEDDING_LATENCY_MS = float(os.environ.get('FAKE_EMBEDDING_LATENCY_MS', 0))
+    FAKE_EMBEDDING_LATENCY_PER_ITEM_MS = float(os.environ.get('FAKE_EMBEDDING_LATENCY_PER_ITEM_MS', 0))
+
+    # Bulk writes
+    WEAVIATE_BATCH_SIZE = int(os.environ.get('WEAVIATE_BATCH_SIZE', 100))  # objects per insert_many call
+    WEAVIATE_BATCH_CONCURRENCY = int(os.environ.get('WEAVIATE_BATCH_CONCURRENCY', 2))
+    WEAVIATE_MAX_RETRIES = int(os.environ.get('WEAVIATE_MAX_RETRIES', 3))
+
+    # Weaviate vector index (HNSW) and compression. ef, dynamic ef, the flat-search cutoff, rescore limits and
+    # turning on a quantizer are applied to an existing collection at startup; max connections, ef construction
+    # and switching quantizers need a rebuild (scripts/migrate_vector_index.py)
+    WEAVIATE_COLLECTION = os.environ.get('WEAVIATE_COLLECTION', 'Document')  # collection or alias name
+    WEAVIATE_HNSW_EF = int(os.environ.get('WEAVIATE_HNSW_EF', -1))  # query candidate list, -1 = dynamic (see below)
+    WEAVIATE_HNSW_DYNAMIC_EF_MIN = int(os.environ.get('WEAVIATE_HNSW_DYNAMIC_EF_MIN', 100))
+    WEAVIATE_HNSW_DYNAMIC_EF_MAX = int(os.environ.get('WEAVIATE_HNSW_DYNAMIC_EF_MAX', 500))
+    WEAVIATE_HNSW_DYNAMIC_EF_FACTOR = int(os.environ.get('WEAVIATE_HNSW_DYNAMIC_EF_FACTOR', 8))  # dynamic ef = limit * factor
+    WEAVIATE_HNSW_EF_CONSTRUCTION = int(os.environ.get('WEAVIATE_HNSW_EF_CONSTRUCTION', 128))
+    WEAVIATE_HNSW_MAX_CONNECTIONS = int(os.environ.get('WEAVIATE_HNSW_MAX_CONNECTIONS', 32))
+    WEAVIATE_HNSW_FLAT_SEARCH_CUTOFF = int(os.environ.get('WEAVIATE_HNSW_FLAT_SEARCH_CUTOFF', 40000))  # filters matching fewer objects scan them
+    WEAVIATE_QUANTIZATION = os.environ.get('WEAVIATE_QUANTIZATION', 'none')  # 'none', 'pq', 'bq', 'sq' or 'rq'
+    WEAVIATE_QUANTIZATION_RESCORE_LIMIT = int(os.environ.get('WEAVIATE_QUANTIZATION_RESCORE_LIMIT', 0))  # bq/sq/rq candidates re-ranked with full vectors, 0 = Weaviate default
+    WEAVIATE_QUANTIZATION_TRAINING_LIMIT = int(os.environ.get('WEAVIATE_QUANTIZATION_TRAINING_LIMIT', 100000))  # pq/sq/rq: objects the codebook is trained on
+    WEAVIATE_PQ_SEGMENTS = int(os.environ.get('WEAVIATE_PQ_SEGMENTS', 0))  # must divide EMBEDDING_DIMENSIONS, 0 = Weaviate default
+    WEAVIATE_PQ_CENTROIDS = int(os.environ.get('WEAVIATE_PQ_CENTROIDS', 256))
+    # Each document is its own tenant with its own small HNSW index, so document queries never filter a
+    # shared graph and deleting a document drops its tenant. Fixed when the collection is created.
+    WEAVIATE_MULTI_TENANCY = os.environ.get('WEAVIATE_MULTI_TENANCY', 'True').lower() in ['true', '1', 't']
+
+    # Persistent embedding cache, shared by all workers on the host
+    EMBEDDING_CACHE_ENABLED = os.environ.get('EMBEDDING_CACHE_ENABLED', 'True').lower() in ['true', '1', 't']
+    EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', 'data/cache/embeddings.sqlite3')
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 200000))
+
+    # Parsing: parsed-markdown cache for PDF/DOCX and parser time limits
+    PARSE_CACHE_ENABLED = os.environ.get('PARSE_CACHE_ENABLED', 'True').lower() in ['true', '1', 't']
+    PARSE_CACHE_PATH = os.environ.get('PARSE_CACHE_PATH', 'data/cache/parsed.sqlite3')
+    PARSE_CACHE_MAX_BYTES = int(os.environ.get('PARSE_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # compressed markdown
+    PARSER_TIMEOUT = float(os.environ.get('PARSER_TIMEOUT', 300))  # seconds for LlamaParse, 0 = no limit
+    FALLBACK_PARSER_TIMEOUT = float(os.environ.get('FALLBACK_PARSER_TIMEOUT', 120))  # seconds for MarkItDown
+    PARSER_MAX_STALLED = int(os.environ.get('PARSER_MAX_STALLED', 4))  # timed-out parser calls still running per process before parses fail fast
+    PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', 0))  # processes for page/section-parallel MarkItDown, 0/1 = serial
+    PARSE_PARALLEL_MIN_UNITS = int(os.environ.get('PARSE_PARALLEL_MIN_UNITS', 16))  # smaller files (pages / DOCX blocks) parse serially
+
+    # Asynchronous ingest jobs (POST /documents with async=true, GET /jobs/<id>)
+    INGEST_ASYNC_DEFAULT = os.environ.get('INGEST_ASYNC_DEFAULT', 'False').lower() in ['true', '1', 't']
+    INGEST_QUEUE_MAX = int(os.environ.get('INGEST_QUEUE_MAX', 32))  # accepted but unfinished jobs; more get 429
+    INGEST_PARSE_WORKERS = int(os.environ.get('INGEST_PARSE_WORKERS', 2))  # processes for parsing + chunking
+    INGEST_INDEX_WORKERS = int(os.environ.get('INGEST_INDEX_WORKERS', 4))  # threads for embedding + indexing
+    JOB_HISTORY_MAX = int(os.environ.get('JOB_HISTORY_MAX', 1000))
+
+    # Query embedding / result cache
+    QUERY_CACHE_ENABLED = os.environ.get('QUERY_CACHE_ENABLED', 'True').lower() in ['true', '1', 't']
+    QUERY_CACHE_MAX_ENTRIES = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 10000))
+    QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', 300))  # seconds a result stays cached
+    QUERY_EMBEDDING_CACHE_TTL = float(os.environ.get('QUERY_EMBEDDING_CACHE_TTL', 3600))
+    # Optional shared backend (needs `redis`). Without it every worker caches and invalidates on its own, so a
+    # document written through another worker or scripts/bulk_ingest.py can serve stale results for QUERY_CACHE_TTL
+    QUERY_CACHE_REDIS_URL = os.environ.get('QUERY_CACHE_REDIS_URL')
+
+    # Batch queries (POST /queries/batch)
+    QUERY_BATCH_MAX_ITEMS = int(os.environ.get('QUERY_BATCH_MAX_ITEMS', 100))
+    QUERY_BATCH_CONCURRENCY = int(os.environ.get('QUERY_BATCH_CONCURRENCY', 8))  # vector searches in flight per batch
+
+    # Queries over several documents or the whole corpus (document_ids / scope=corpus): partitions searched
+    # in parallel, and the time after which the partitions that answered are returned as partial results
+    QUERY_SCOPE_MAX_DOCUMENTS = int(os.environ.get('QUERY_SCOPE_MAX_DOCUMENTS', 1000))  # also caps the partitions of scope=corpus
+    QUERY_SCATTER_CONCURRENCY = int(os.environ.get('QUERY_SCATTER_CONCURRENCY', 8))  # search threads per process
+    QUERY_SCATTER_PER_REQUEST = int(os.environ.get('QUERY_SCATTER_PER_REQUEST', 4))  # searches in flight per request
+    QUERY_TIME_BUDGET_MS = int(os.environ.get('QUERY_TIME_BUDGET_MS', 2000))  # per request; bodies may ask for less
+
+    # Query modes: 'vector' (embedding search), 'keyword' (BM25, no embedding call) or 'hybrid' (both, rank-fused)
+    QUERY_MODE_DEFAULT = os.environ.get('QUERY_MODE_DEFAULT', 'vector')
+    HYBRID_ALPHA = float(os.environ.get('HYBRID_ALPHA', 0.5))  # Weaviate: weight of the vector side, 0 = pure BM25
+    HYBRID_RRF_K = int(os.environ.get('HYBRID_RRF_K', 60))  # local store: reciprocal rank fusion constant
+    HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', 50))  # local store: hits taken from each side
+
+    # Logging and metrics
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() in ['true', '1', 't']  # serve /metrics
+
+    # Vector store backend
+    VECTOR_BACKEND = os.environ.get('VECTOR_BACKEND', 'weaviate')  # 'weaviate' (cloud) or 'local' (in-process)
+    LOCAL_VECTOR_STORE_PATH = os.environ.get('LOCAL_VECTOR_STORE_PATH', 'data/vectors')
+    LOCAL_ANN_MIN_ROWS = int(os.environ.get('LOCAL_ANN_MIN_ROWS', 20000))  # partitions this large use the IVF index
+    LOCAL_ANN_NPROBE = int(os.environ.get('LOCAL_ANN_NPROBE', 8))  # IVF buckets scanned per query
+
+    # Streaming ingest: chunks embedded and written per step, and bytes read from an upload per step
+    STREAM_WINDOW_CHUNKS = int(os.environ.get('STREAM_WINDOW_CHUNKS', 256))
+    STREAM_READ_BYTES = int(os.environ.get('STREAM_READ_BYTES', 65536))
+
+
+def local_config(directory: str, **overrides) -> type:
+    """A Config subclass with the fake embedder and the in-process vector store, keeping every file under
+    `directory`: what scripts/bench_service.py and the tests run on, with no API keys or network."""
+    settings = {
+        "EMBEDDING_BACKEND": "fake",
+        "FAKE_EMBEDDING_LATENCY_MS": 0.0,
+        "FAKE_EMBEDDING_LATENCY_PER_ITEM_MS": 0.0,
+        "EMBEDDING_CACHE_PATH": os.path.join(directory, "embeddings.sqlite3"),
+        "EMBEDDING_BUDGET_PATH": os.path.join(directory, "embedding_budget.sqlite3"),
+        "PARSE_CACHE_PATH": os.path.join(directory, "parsed.sqlite3"),
+        "VECTOR_BACKEND": "local",
+        "LOCAL_VECTOR_STORE_PATH": os.path.join(directory, "vectors"),
+        "UPLOAD_FOLDER": os.path.join(directory, "uploads"),
+        "QUERY_CACHE_REDIS_URL": None,
+        "INGEST_ASYNC_DEFAULT": False,
+        "WARMUP_ON_STARTUP": False,
+        "WEAVIATE_HEALTH_CHECK_INTERVAL": 0,
+    }
+    settings.update(overrides)
+    return type("LocalConfig", (Config,), settings)
@@ -1,14 +1,117 @@
-import json
 import os  # Import the 'os' module
-from typing import Optional
+import logging
+import uuid
+import codecs
+import threading
+from importlib.metadata import version, PackageNotFoundError
+from typing import BinaryIO, Callable, Iterator, Optional
 from markitdown import MarkItDown  # Assuming you have this installed
 from llama_cloud_services import LlamaParse
-from llama_index.core import SimpleDirectoryReader
+from source.utils.parallel_parse import parse_in_parallel
 from dotenv import load_dotenv
 load_dotenv()
 
-def read_and_parse_file(file_path: str, content_type: Optional[str] = None) -> str:
-    """Reads and parses a file with fallback parsing and content type validation."""
+logger = logging.getLogger(__name__)
+
+PARSED_CONTENT_TYPES = ("application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+
+
+def _package_version(name: str) -> str:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return "unknown"
+
+
+# Part of every parse cache key: bump the leading revision when the parsing logic here changes.
+PARSER_VERSION = f"1/llama-cloud-services={_package_version('llama-cloud-services')}/markitdown={_package_version('markitdown')}"
+
+# Parsers are built once per process and reused by every call.
+_parsers = {}
+_parsers_lock = threading.Lock()
+
+
+def _parser(name: str, factory: Callable):
+    with _parsers_lock:
+        parser = _parsers.get(name)
+        if parser is None:
+            parser = _parsers[name] = factory()
+        return parser
+
+
+# Parser threads that outlived their timeout. They cannot be interrupted and still hold their file and
+# memory, so once `max_stalled` of them are alive new parses fail fast instead of piling up more.
+_stalled = set()
+_stalled_lock = threading.Lock()
+
+
+def _run_with_timeout(fn: Callable, timeout: Optional[float], what: str, max_stalled: int = 4):
+    """Runs fn() and gives up after `timeout` seconds (None waits forever).
+
+    The work runs on a daemon thread: a stalled parser call cannot be interrupted, but it no longer
+    holds up the caller and does not keep the process alive on exit. Raises RuntimeError without
+    starting `fn` while `max_stalled` earlier calls are still running past their timeout.
+    """
+    if not timeout:
+        return fn()
+    with _stalled_lock:
+        _stalled.difference_update([thread for thread in _stalled if not thread.is_alive()])
+        if len(_stalled) >= max_stalled:
+            raise RuntimeError(f"{len(_stalled)} timed-out parser calls are still running; not starting {what}")
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = fn()
+        except BaseException as e:
+            outcome["error"] = e
+
+    worker = threading.Thread(target=run, name=f"parse-{what}", daemon=True)
+    worker.start()
+    worker.join(timeout)
+    if worker.is_alive():
+        with _stalled_lock:
+            _stalled.add(worker)
+        raise TimeoutError(f"{what} did not finish within {timeout}s")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+def upload_path(upload_folder: str, filename: str) -> str:
+    """A path under `upload_folder` unique to this request."""
+    os.makedirs(upload_folder, exist_ok=True)
+    return os.path.join(upload_folder, f"{uuid.uuid4().hex}_{filename}")
+
+def save_upload(file, upload_folder: str, filename: str) -> str:
+    """Saves an uploaded file under a name unique to this request and returns its path."""
+    file_path = upload_path(upload_folder, filename)
+    file.save(file_path)
+    return file_path
+
+def iter_text_blocks(stream: BinaryIO, block_size: int = 65536) -> Iterator[str]:
+    """Decodes a binary stream as UTF-8 one block at a time (multi-byte characters may span blocks)."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+            return
+        text = decoder.decode(data)
+        if text:
+            yield text
+
+def read_and_parse_file(file_path: str, content_type: Optional[str] = None,
+                        timeout: Optional[float] = None, fallback_timeout: Optional[float] = None,
+                        parallel_workers: int = 0, parallel_min_units: int = 16, max_stalled: int = 4) -> str:
+    """Reads and parses a file with fallback parsing and content type validation.
+
+    `timeout` and `fallback_timeout` bound the LlamaParse and MarkItDown calls in seconds. With
+    `parallel_workers` > 1, the MarkItDown fallback converts PDFs with at least `parallel_min_units`
+    pages (DOCX: top-level blocks) in page/section ranges on that many processes. Parser calls that
+    time out keep running in the background; while `max_stalled` of them are alive, parsing fails fast.
+    """
 
     # 1. Validate/Determine Content Type
     valid_content_types = {
@@ -32,28 +135,32 @@ def read_and_parse_file(file_path: str, content_type: Optional[str] = None) -> s
 
     # 2. Parsing Logic (with Fallback)
     try:
-        if content_type in ("application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"):
+        if content_type in PARSED_CONTENT_TYPES:
             try:
                 # Primary: LlamaParse
-                parser = LlamaParse(result_type="markdown")
-                file_extractor = {".pdf": parser, ".docx": parser}
-                documents = SimpleDirectoryReader(input_files=[file_path], file_extractor=file_extractor).load_data()
+                parser = _parser("llamaparse", lambda: LlamaParse(result_type="markdown", max_timeout=int(timeout) if timeout else 2000))
+                documents = _run_with_timeout(lambda: parser.load_data(file_path), timeout, "LlamaParse", max_stalled)
                 return "\n".join([doc.text for doc in documents]) #access text directly.
 
             except Exception as e:
-                print(f"LlamaParse failed: {e}. Attempting fallback...")
+                logger.warning("LlamaParse failed: %s. Attempting fallback...", e)
                 try:
-                    md = MarkItDown()
-                    result = md.convert(file_path)
-                    return result.text_content
+                    md = _parser("markitdown", MarkItDown)
+
+                    def convert():
+                        text = parse_in_parallel(file_path, content_type, parallel_workers, parallel_min_units,
+                                                 timeout=fallback_timeout)
+                        return text if text is not None else md.convert(file_path).text_content
+
+                    return _run_with_timeout(convert, fallback_timeout, "MarkItDown", max_stalled)
                 except Exception as fallback_e:
                     raise Exception(f"Fallback parsing also failed: {fallback_e}")
                 # raise Exception("Fallback not installed; LlamaParse Failed.") # Remove when you install MarkItDown
 
         elif content_type == "application/json":
+            # Returned as is: the chunker parses it incrementally, so a load/dump round trip is wasted work.
             with open(file_path, "r") as file:
-                data = json.load(file)
-                return json.dumps(data)  # Return as a JSON string
+                return file.read()
 
         elif content_type == "text/plain":
             with open(file_path, "r") as file:
@@ -0,0 +1,40 @@
+import hashlib
+import re
+import uuid
+from typing import Dict, List, Tuple
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of a chunk's text, used to recognise unchanged chunks across versions."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_uuid(document_id: str, chunk_hash: str, occurrence: int = 0) -> str:
+    """Stable object id for a chunk, derived from its document and content.
+
+    `occurrence` tells apart identical chunks within one document (0 for the first copy).
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{document_id}:{chunk_hash}:{occurrence}"))
+
+
+def chunk_identities(document_id: str, chunks: List[str], seen: Dict[str, int] = None) -> List[Tuple[str, str]]:
+    """Returns (content hash, object id) for each chunk, in order.
+
+    Pass the same `seen` dict for consecutive slices of one document to number duplicates across them.
+    """
+    seen = {} if seen is None else seen
+    identities = []
+    for chunk in chunks:
+        digest = content_hash(chunk)
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        identities.append((digest, chunk_uuid(document_id, digest, occurrence)))
+    return identities
+
+
+def partition_name(document_id: str) -> str:
+    """Name of a document's partition (local store directory, Weaviate tenant): the id itself when it is
+    a safe name of up to 64 characters, else a digest of it."""
+    if re.fullmatch(r"[A-Za-z0-9_-]{1,64}", document_id):
+        return document_id
+    return "h-" + hashlib.sha256(document_id.encode("utf-8")).hexdigest()[:32]
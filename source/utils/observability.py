@@ -0,0 +1,156 @@
+import contextvars
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+_trace_id = contextvars.ContextVar("trace_id", default="-")
+
+# Latency buckets from 1 ms to 5 min: stages range from cache lookups to parsing large PDFs.
+_SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "docquery_stage_seconds", "Time spent in each ingest and query stage", ["stage"], buckets=_SECONDS
+)
+DOCUMENT_CHUNKS = Histogram(
+    "docquery_document_chunks", "Chunks written per indexed document",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000),
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "docquery_embedding_batch_size", "Texts per embedding backend call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 100, 128, 256, 512),
+)
+EMBEDDING_REQUEST_SECONDS = Histogram(
+    "docquery_embedding_request_seconds", "Latency of one embedding backend call", buckets=_SECONDS
+)
+EMBEDDING_MICROBATCH_CALLERS = Histogram(
+    "docquery_embedding_microbatch_callers", "Embedding requests coalesced into one backend call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+EMBEDDING_MICROBATCH_FILL = Histogram(
+    "docquery_embedding_microbatch_fill", "Texts per coalesced call as a fraction of EMBEDDING_MICROBATCH_MAX_SIZE",
+    buckets=(0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 0.75, 1),
+)
+EMBEDDING_MICROBATCH_WAIT_SECONDS = Histogram(
+    "docquery_embedding_microbatch_wait_seconds", "Delay a request spent waiting for its coalesced call to be sent",
+    buckets=(0.0005, 0.001, 0.002, 0.003, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+EMBEDDING_RETRIES = Counter("docquery_embedding_retries_total", "Embedding batches retried after an error")
+EMBEDDING_SCHEDULER_WAIT_SECONDS = Histogram(
+    "docquery_embedding_scheduler_wait_seconds", "Time an embedding call queued for a rate token and a slot",
+    ["priority"], buckets=_SECONDS,
+)
+EMBEDDING_RATE_LIMITED = Counter("docquery_embedding_rate_limited_total", "Embedding calls answered with 429")
+EMBEDDING_CONCURRENCY_LIMIT = Gauge(
+    "docquery_embedding_concurrency_limit", "Adaptive limit on embedding calls in flight in this process"
+)
+EMBEDDING_SHARED_RATE = Gauge(
+    "docquery_embedding_shared_rate_rpm", "Embedding calls per minute currently allowed across all processes"
+)
+QUERY_SCATTER_PARTITIONS = Histogram(
+    "docquery_query_scatter_partitions", "Partitions searched by one multi-document or corpus-wide query",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+)
+QUERY_SCATTER_MISSING = Counter(
+    "docquery_query_scatter_missing_total", "Partitions left out of a query result by its time budget or an error"
+)
+CACHE_LOOKUPS = Counter("docquery_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+WEAVIATE_REQUEST_SECONDS = Histogram(
+    "docquery_weaviate_request_seconds", "Latency of Weaviate round trips", ["operation"], buckets=_SECONDS
+)
+WEAVIATE_ERRORS = Counter("docquery_weaviate_errors_total", "Weaviate round trips that raised", ["operation"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "docquery_http_request_seconds", "HTTP request latency", ["endpoint", "method", "status"], buckets=_SECONDS
+)
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds the trace id of the current request or job to every log record as %(trace_id)s."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id.get()
+        return True
+
+
+def configure_logging(level: str = "INFO"):
+    """Logs to stderr with the trace id in every line. Safe to call more than once per process."""
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    if any(getattr(handler, "_docquery", False) for handler in root.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler._docquery = True
+    handler.addFilter(TraceIdFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"))
+    root.addHandler(handler)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def get_trace_id() -> Optional[str]:
+    value = _trace_id.get()
+    return None if value == "-" else value
+
+
+def set_trace_id(trace_id: Optional[str]) -> contextvars.Token:
+    """Sets the trace id of the current context; pass the returned token to reset_trace_id."""
+    return _trace_id.set(trace_id or new_trace_id())
+
+
+def reset_trace_id(token: contextvars.Token):
+    _trace_id.reset(token)
+
+
+@contextmanager
+def trace(trace_id: Optional[str]):
+    """Runs a block (e.g. a background job) under `trace_id`, or a fresh one."""
+    token = set_trace_id(trace_id)
+    try:
+        yield
+    finally:
+        reset_trace_id(token)
+
+
+@contextmanager
+def stage(name: str):
+    """Times one pipeline stage into docquery_stage_seconds{stage=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        logger.debug("stage %s took %.1f ms", name, elapsed * 1000)
+
+
+def observe_stages(timings: Dict[str, float]):
+    """Records stage timings measured elsewhere, e.g. in a parse worker process."""
+    for name, seconds in timings.items():
+        STAGE_SECONDS.labels(name).observe(seconds)
+
+
+@contextmanager
+def weaviate_call(operation: str):
+    """Times one Weaviate round trip and counts it as an error if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        WEAVIATE_ERRORS.labels(operation).inc()
+        raise
+    finally:
+        WEAVIATE_REQUEST_SECONDS.labels(operation).observe(time.perf_counter() - start)
+
+
+def record_cache(cache: str, hits: int = 0, misses: int = 0):
+    if hits:
+        CACHE_LOOKUPS.labels(cache, "hit").inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache, "miss").inc(misses)
@@ -0,0 +1,173 @@
+import io
+import multiprocessing
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from lxml import etree
+from markitdown import MarkItDown
+from pypdf import PdfReader, PdfWriter
+
+PDF = "application/pdf"
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+_HEADING_STYLE = re.compile(r"^(heading|title)", re.IGNORECASE)
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+_markitdown = None
+
+
+def _converter() -> MarkItDown:
+    """One MarkItDown per worker process."""
+    global _markitdown
+    if _markitdown is None:
+        _markitdown = MarkItDown()
+    return _markitdown
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # spawn: the parent may hold threads and client connections that must not be forked.
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def split_ranges(total: int, parts: int, starts: Optional[List[int]] = None) -> List[Tuple[int, int]]:
+    """Splits [0, total) into at most `parts` contiguous ranges of similar size.
+
+    With `starts`, every cut is moved to the closest allowed start (e.g. a heading), so ranges keep
+    whole sections; without allowed starts near a cut, the range is simply larger.
+    """
+    parts = max(1, min(parts, total))
+    cuts = set()
+    for k in range(1, parts):
+        ideal = round(k * total / parts)
+        if starts:
+            ideal = min(starts, key=lambda start: abs(start - ideal))
+        if 0 < ideal < total:
+            cuts.add(ideal)
+    bounds = [0] + sorted(cuts) + [total]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def pdf_page_count(file_path: str) -> int:
+    return len(PdfReader(file_path).pages)
+
+
+def convert_pdf_pages(file_path: str, start: int, end: int) -> str:
+    """Converts pages [start, end) of a PDF to markdown with MarkItDown (runs in a worker process)."""
+    reader = PdfReader(file_path)
+    writer = PdfWriter()
+    for index in range(start, end):
+        writer.add_page(reader.pages[index])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+    return _converter().convert_stream(buffer, file_extension=".pdf").text_content
+
+
+def _docx_body(file_path: str):
+    with zipfile.ZipFile(file_path) as archive:
+        root = etree.fromstring(archive.read("word/document.xml"))
+    body = root.find(f"{{{_W}}}body")
+    blocks = [child for child in body if child.tag != f"{{{_W}}}sectPr"]
+    return root, body, blocks
+
+
+def docx_sections(file_path: str) -> Tuple[int, List[int]]:
+    """Returns (number of top-level body blocks, indices of the blocks that are headings)."""
+    _, _, blocks = _docx_body(file_path)
+    headings = []
+    for index, block in enumerate(blocks):
+        style = block.find(f"{{{_W}}}pPr/{{{_W}}}pStyle")
+        if style is not None and _HEADING_STYLE.match(style.get(f"{{{_W}}}val", "")):
+            headings.append(index)
+    return len(blocks), headings
+
+
+def convert_docx_blocks(file_path: str, start: int, end: int) -> str:
+    """Converts top-level body blocks [start, end) of a DOCX to markdown (runs in a worker process).
+
+    The range is written as a copy of the original package with the other blocks removed, so styles,
+    numbering and relationships still resolve.
+    """
+    root, body, blocks = _docx_body(file_path)
+    for index, block in enumerate(blocks):
+        if not start <= index < end:
+            body.remove(block)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(file_path) as source, zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            if item.filename == "word/document.xml":
+                target.writestr(item, etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True))
+            else:
+                target.writestr(item, source.read(item.filename))
+    buffer.seek(0)
+    return _converter().convert_stream(buffer, file_extension=".docx").text_content
+
+
+def parse_in_parallel(file_path: str, content_type: str, workers: int, min_units: int,
+                      timeout: Optional[float] = None) -> Optional[str]:
+    """Converts a PDF (by page ranges) or DOCX (by heading-aligned block ranges) on `workers` processes.
+
+    Ranges are converted independently and joined in order with blank lines; DOCX ranges start at
+    headings so the markdown header structure chunk_pdf_docx splits on is unchanged. Returns None
+    when the file has fewer than `min_units` pages/blocks and a serial parse is cheaper.
+    """
+    if workers < 2:
+        return None
+    if content_type == PDF:
+        total, starts, convert = pdf_page_count(file_path), None, convert_pdf_pages
+    elif content_type == DOCX:
+        (total, starts), convert = docx_sections(file_path), convert_docx_blocks
+    else:
+        return None
+    if total < max(min_units, 2):
+        return None
+
+    # Two ranges per worker evens out pages of very different cost.
+    ranges = split_ranges(total, workers * 2, starts)
+    pool = _get_pool(workers)
+    deadline = time.monotonic() + timeout if timeout else None
+    futures = [pool.submit(convert, file_path, start, end) for start, end in ranges]
+    try:
+        parts = [
+            future.result(timeout=max(0.0, deadline - time.monotonic()) if deadline else None)
+            for future in futures
+        ]
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        raise
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return "\n\n".join(part.strip() for part in parts if part and part.strip())
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,97 @@
+import math
+import re
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"[0-9a-z]+")
+
+# (rows, total token count, rows containing each query term): what BM25 needs to know about a corpus.
+Statistics = Tuple[int, float, Dict[str, int]]
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased alphanumeric runs, like Weaviate's `word` tokenization."""
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """Inverted index over a fixed list of texts, scored with Okapi BM25.
+
+    Postings live in flat NumPy arrays (rows and term frequencies grouped by term id) instead of
+    per-term dicts, so building the index allocates few Python objects.
+    """
+
+    def __init__(self, texts: Iterable[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {}
+        term_ids = []
+        lengths = []
+        for text in texts:
+            ids = [self.vocabulary.setdefault(token, len(self.vocabulary)) for token in tokenize(text)]
+            lengths.append(len(ids))
+            term_ids.extend(ids)
+        rows = len(lengths)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.average_length = float(self.lengths.mean()) if rows else 0.0
+        # One (term, row) key per token occurrence; counting the unique keys gives term frequencies.
+        keys = np.asarray(term_ids, dtype=np.int64) * max(rows, 1) + np.repeat(np.arange(rows, dtype=np.int64), lengths)
+        keys, counts = np.unique(keys, return_counts=True)
+        terms = keys // max(rows, 1)
+        self.rows = keys % max(rows, 1)
+        self.frequencies = counts.astype(np.float32)
+        self.bounds = np.searchsorted(terms, np.arange(len(self.vocabulary) + 1))
+
+    def statistics(self, query_text: str) -> Statistics:
+        """This index's share of the corpus statistics for `query_text`; see merge_statistics."""
+        frequencies = {}
+        for token in set(tokenize(query_text)):
+            term = self.vocabulary.get(token)
+            frequencies[token] = 0 if term is None else int(self.bounds[term + 1] - self.bounds[term])
+        return len(self.lengths), float(self.lengths.sum()), frequencies
+
+    def scores(self, query_text: str, statistics: Optional[Statistics] = None) -> np.ndarray:
+        """BM25 score of every row for `query_text`; rows sharing no term with it score 0.
+
+        With `statistics` (merged over several indexes), idf and the average length come from them
+        instead of this index, so scores are comparable across the indexes.
+        """
+        rows = len(self.lengths)
+        scores = np.zeros(rows, dtype=np.float32)
+        if not rows:
+            return scores
+        corpus_rows, total_length, frequencies = statistics or (rows, self.average_length * rows, {})
+        average_length = total_length / max(corpus_rows, 1)
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / max(average_length, 1e-9))
+        for token in set(tokenize(query_text)):
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            start, end = self.bounds[term], self.bounds[term + 1]
+            matched, tf = self.rows[start:end], self.frequencies[start:end]
+            df = frequencies.get(token, len(matched))
+            idf = math.log(1 + (corpus_rows - df + 0.5) / (df + 0.5))
+            scores[matched] += idf * tf * (self.k1 + 1) / (tf + norm[matched])
+        return scores
+
+
+def merge_statistics(parts: Iterable[Statistics]) -> Statistics:
+    """Corpus statistics of several indexes searched as one, e.g. every partition of a corpus-wide query."""
+    rows, total_length, frequencies = 0, 0.0, {}
+    for part_rows, part_length, part_frequencies in parts:
+        rows += part_rows
+        total_length += part_length
+        for token, count in part_frequencies.items():
+            frequencies[token] = frequencies.get(token, 0) + count
+    return rows, total_length, frequencies
+
+
+def rrf_fuse(rankings: List[List[Hashable]], k: int = 60) -> List[Tuple[Hashable, float]]:
+    """Reciprocal rank fusion: each item scores sum(1 / (k + rank)) over the rankings it appears in
+    (rank starting at 1). Returns (item, score) best first."""
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda entry: entry[1], reverse=True)
@@ -0,0 +1,43 @@
+import io
+
+import pytest
+
+from app import create_app
+from source.services.container import ServiceContainer
+from source.utils.config import local_config
+
+
+def make_config(directory, **overrides) -> type:
+    """The offline configuration (fake embedder, local vector store) under `directory`."""
+    settings = {"EMBEDDING_CACHE_ENABLED": False, "QUERY_CACHE_ENABLED": True, "LOG_LEVEL": "WARNING"}
+    settings.update(overrides)
+    return local_config(str(directory), **settings)
+
+
+def upload_form(content: bytes, filename: str = "doc.txt", content_type: str = "text/plain", **fields) -> dict:
+    """A multipart /documents form for the Flask test client."""
+    return {"content_type": content_type, "file": (io.BytesIO(content), filename), **fields}
+
+
+@pytest.fixture
+def config(tmp_path):
+    return make_config(tmp_path)
+
+
+@pytest.fixture
+def services(config):
+    container = ServiceContainer(config)
+    yield container
+    container.close()
+
+
+@pytest.fixture
+def app(config):
+    app = create_app(config)
+    yield app
+    app.extensions["services"].close()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
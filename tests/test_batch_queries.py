@@ -0,0 +1,41 @@
+import pytest
+
+from conftest import upload_form
+
+
+def test_batch_query_answers_every_item_in_order(client):
+    document_ids = []
+    for text in (b"Apples are red. Pears are green.", b"The sky is blue. Grass is green."):
+        response = client.post("/documents", data=upload_form(text, action="upload", **{"async": "false"}),
+                               content_type="multipart/form-data")
+        assert response.status_code == 201
+        document_ids.append(response.get_json()["document_id"])
+
+    response = client.post("/queries/batch", json={"queries": [
+        {"document_id": document_ids[0], "query": "apples", "mode": "keyword", "num_chunks_return": 1},
+        {"document_id": document_ids[1], "query": "sky", "mode": "vector", "num_chunks_return": 1},
+        {"document_id": document_ids[1], "query": "grass", "mode": "hybrid", "num_chunks_return": 1},
+        {"document_id": document_ids[0], "query": "x", "mode": "bad"},
+        {"query": "no document"},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [len(item.get("results", [])) for item in results[:3]] == [1, 1, 1]
+    assert results[0]["results"][0]["document_id"] == document_ids[0]
+    assert results[1]["results"][0]["document_id"] == document_ids[1]
+    assert "error" in results[3] and "error" in results[4]
+
+
+@pytest.mark.parametrize("body", [{}, {"queries": []}, {"queries": "nope"}])
+def test_batch_query_rejects_malformed_bodies(client, body):
+    assert client.post("/queries/batch", json=body).status_code == 400
+
+
+def test_batch_query_failure_is_a_json_500(app, client, monkeypatch):
+    def fail(queries):
+        raise RuntimeError("vector store down")
+
+    monkeypatch.setattr(app.extensions["services"].document_service, "query_documents", fail)
+    response = client.post("/queries/batch", json={"queries": [{"document_id": "d", "query": "apples"}]})
+    assert response.status_code == 500
+    assert response.get_json() == {"error": "vector store down"}
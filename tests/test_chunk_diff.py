@@ -0,0 +1,283 @@
+import types
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from weaviate.collections.classes.filters import _FilterAnd, _FilterOr
+
+from source.models import Document, StoredChunk
+from source.services.document_service import DocumentService
+from source.services.weaviate_service import WeaviateService
+from source.utils.hashing import chunk_identities
+
+
+def stored_chunks(document_id, chunks, versions=None):
+    return [
+        StoredChunk(uuid=object_id, content_hash=digest, chunk_sort_key=i, filename="doc.txt", metadata="{}",
+                    doc_version=None if versions is None else versions[i])
+        for i, (digest, object_id) in enumerate(chunk_identities(document_id, chunks))
+    ]
+
+
+def document(document_id, chunks, filename="doc.txt"):
+    return Document(id=document_id, filename=filename, content=chunks, content_type="text/plain", metadata={})
+
+
+def test_diff_keeps_unchanged_chunks_and_renumbers_moved_ones():
+    stored = stored_chunks("d", ["a", "b", "c", "c"], versions=[0, 0, 2, 2])
+    diff = DocumentService.diff_chunks(None, document("d", ["b", "x", "c"]), stored)
+    assert diff.new_indices == [1]
+    assert diff.updates == {stored[1].uuid: {"chunk_sort_key": 0}}
+    # The second copy of "c" is gone; the first keeps its id and position.
+    assert sorted(diff.removed_uuids) == sorted([stored[0].uuid, stored[3].uuid])
+    assert diff.stored_version == 2
+    assert diff.unversioned_uuids == []
+
+
+def test_diff_patches_filename_and_reports_unversioned_chunks():
+    stored = stored_chunks("d", ["a", "b"])
+    diff = DocumentService.diff_chunks(None, document("d", ["a", "b"], filename="renamed.txt"), stored)
+    assert diff.new_indices == [] and diff.removed_uuids == []
+    assert all(patch == {"filename": "renamed.txt"} for patch in diff.updates.values())
+    assert diff.stored_version == 0
+    assert diff.unversioned_uuids == [chunk.uuid for chunk in stored]
+
+
+def test_update_embeds_only_new_chunks(services, monkeypatch):
+    document_service = services.document_service
+    document_id = document_service.index_chunks("doc", "doc.txt", "text/plain", {}, ["One.", "Two.", "Three."])
+    before = {chunk.content_hash: chunk.uuid for chunk in services.weaviate_service.get_chunk_manifest(document_id)}
+
+    embedded = []
+    generate = services.embedding_service.generate_embeddings
+
+    def spy(texts, *args, **kwargs):
+        embedded.extend(texts)
+        return generate(texts, *args, **kwargs)
+
+    monkeypatch.setattr(services.embedding_service, "generate_embeddings", spy)
+    document_service.update_chunks(document_id, "doc.txt", "text/plain", {}, ["One.", "Four.", "Three.", "Two."])
+
+    assert embedded == ["Four."]
+    manifest = sorted(services.weaviate_service.get_chunk_manifest(document_id), key=lambda chunk: chunk.chunk_sort_key)
+    after = chunk_identities(document_id, ["One.", "Four.", "Three.", "Two."])
+    assert [chunk.uuid for chunk in manifest] == [object_id for _, object_id in after]
+    assert all(before[digest] == object_id for digest, object_id in after if digest in before)
+    results = document_service.query_document(document_id, "Four", limit=10, mode="keyword")
+    assert [result.snippet for result in results] == ["Four."]
+
+
+# A stand-in for a Weaviate collection that stores properties and evaluates query filters, enough to
+# watch what queries see at every step of a chunk-diff update.
+
+def matches(condition, object_id, properties) -> bool:
+    if isinstance(condition, _FilterAnd):
+        return all(matches(c, object_id, properties) for c in condition.filters)
+    if isinstance(condition, _FilterOr):
+        return any(matches(c, object_id, properties) for c in condition.filters)
+    value = str(object_id) if condition.target == "_id" else properties.get(condition.target)
+    operator = condition.operator.value
+    if operator == "NotEqual":
+        return value != condition.value
+    if value is None:
+        return False
+    if operator == "ContainsAny":
+        return bool((set(value) if isinstance(value, list) else {value}) & set(condition.value))
+    return {
+        "Equal": value == condition.value,
+        "GreaterThan": value > condition.value,
+        "GreaterThanEqual": value >= condition.value,
+        "LessThanEqual": value <= condition.value,
+    }[operator]
+
+
+class FakeCollection:
+    def __init__(self):
+        self.objects = {}
+        # "retire", "switch", "settle" or "delete": raise at that step of an update, as if the process died
+        self.fail_on = None
+        self.max_results = 10000
+        self.calls = Counter()
+        self.data = self.query = self
+
+    def insert_many(self, objects):
+        if self.fail_on == "switch" and any(obj.properties["active_version"] == obj.properties["pending_version"]
+                                            for obj in objects):
+            raise RuntimeError("interrupted")
+        for obj in objects:
+            self.objects[str(obj.uuid)] = dict(obj.properties)
+        return types.SimpleNamespace(errors={})
+
+    def update(self, uuid, properties):
+        if self.fail_on == "retire" and properties.get("retired_version"):
+            raise RuntimeError("interrupted")
+        if self.fail_on == "settle" and properties.get("update_version", 1) == 0:
+            raise RuntimeError("interrupted")
+        self.objects[str(uuid)].update(properties)
+
+    def delete_many(self, where):
+        if self.fail_on == "delete":
+            raise RuntimeError("interrupted")
+        for object_id in [k for k, p in self.objects.items() if matches(where, k, p)]:
+            del self.objects[object_id]
+
+    def delete_by_id(self, uuid):
+        self.objects.pop(str(uuid), None)
+
+    def fetch_objects(self, filters=None, limit=None, offset=0, after=None, sort=None, return_properties=None, **kwargs):
+        self.calls["fetch_objects"] += 1
+        return self._find(filters, limit, offset, after, sort)
+
+    def _find(self, filters, limit, offset=0, after=None, sort=None):
+        # Like Weaviate: offset paging stops at max_results, and the cursor (`after`) cannot be filtered.
+        assert offset + limit <= self.max_results
+        assert after is None or filters is None
+        found = sorted((k, p) for k, p in self.objects.items() if filters is None or matches(filters, k, p))
+        if sort is not None:
+            found.sort(key=lambda item: item[1][sort.sorts[0].prop])
+        if after is not None:
+            found = [(k, p) for k, p in found if k > str(after)]
+        return types.SimpleNamespace(objects=[
+            types.SimpleNamespace(uuid=k, properties=dict(p), metadata=types.SimpleNamespace(distance=0.0, score=1.0))
+            for k, p in found[offset:offset + limit]
+        ])
+
+    def fetch_object_by_id(self, uuid):
+        properties = self.objects.get(str(uuid))
+        return None if properties is None else types.SimpleNamespace(properties=dict(properties))
+
+    def near_vector(self, filters=None, limit=10, **kwargs):
+        self.calls["near_vector"] += 1
+        return self._find(filters, limit)
+
+
+@pytest.fixture(params=[False, True], ids=["shared", "tenants"])
+def weaviate(config, request):
+    service = object.__new__(WeaviateService)
+    service.config = config
+    service.class_name = "Chunks"
+    service.multi_tenant = request.param
+    service._batch_executor = ThreadPoolExecutor(2)
+    service.chunks, service.versions = FakeCollection(), FakeCollection()
+    service._partition = lambda document_id: service.chunks
+    service._ensure_connected = lambda: None
+    yield service
+    service._batch_executor.shutdown()
+
+
+def visible(service, document_id="d"):
+    return sorted(result.snippet for result in service.query_document(document_id, [0.1], limit=100))
+
+
+def positions(service, document_id="d"):
+    return sorted((result.chunk_order_key, result.snippet) for result in service.query_document(document_id, [0.1], limit=100))
+
+
+def update(service, document_id, chunks):
+    new = document(document_id, chunks)
+    diff = DocumentService.diff_chunks(None, new, service.get_chunk_manifest(document_id))
+    return service.apply_chunk_diff(new, diff, [[0.1]] * len(diff.new_indices))
+
+
+def test_interrupted_update_stays_invisible_and_is_undone(weaviate):
+    weaviate.index_document(document("d", ["a", "b", "c"]), [[0.1]] * 3)
+    for properties in weaviate.chunks.objects.values():  # written before chunks had versions
+        del properties["doc_version"], properties["retired_version"]
+    update(weaviate, "d", ["a", "x", "c"])
+    assert visible(weaviate) == ["a", "c", "x"]
+    assert weaviate.versions.objects == {}
+
+    weaviate.chunks.fail_on = "retire"  # new chunks written, switch not reached
+    with pytest.raises(RuntimeError):
+        update(weaviate, "d", ["a", "y"])
+    weaviate.chunks.fail_on = None
+    assert visible(weaviate) == ["a", "c", "x"]
+    assert len(weaviate.get_chunk_manifest("d")) == 3
+
+    update(weaviate, "d", ["a", "y"])
+    assert visible(weaviate) == ["a", "y"]
+    assert len(weaviate.chunks.objects) == 2
+    assert weaviate.versions.objects == {}
+
+
+def test_update_interrupted_after_the_switch_shows_the_new_version(weaviate):
+    weaviate.index_document(document("d", ["a", "b"]), [[0.1]] * 2)
+    weaviate.chunks.fail_on = "delete"
+    with pytest.raises(RuntimeError):
+        update(weaviate, "d", ["z"])
+    weaviate.chunks.fail_on = None
+    assert visible(weaviate) == ["z"]
+    assert len(weaviate.chunks.objects) == 3
+
+    update(weaviate, "d", ["z", "q"])
+    assert visible(weaviate) == ["q", "z"]
+    assert len(weaviate.chunks.objects) == 2
+
+
+def test_queries_of_settled_documents_make_one_search(weaviate):
+    weaviate.index_document(document("d", ["a", "b"]), [[0.1]] * 2)
+    update(weaviate, "d", ["b", "c"])
+    weaviate.chunks.calls.clear()
+    assert visible(weaviate) == ["b", "c"]
+    assert weaviate.chunks.calls == {"near_vector": 1}
+    assert weaviate.versions.calls["fetch_objects"] == 0
+
+    weaviate.chunks.fail_on = "retire"
+    with pytest.raises(RuntimeError):
+        update(weaviate, "d", ["c", "x"])
+    weaviate.chunks.calls.clear()
+    assert visible(weaviate) == ["b", "c"]  # met chunk "x", looked the version up and searched again
+    assert weaviate.chunks.calls == {"near_vector": 2}
+    assert weaviate.versions.calls["fetch_objects"] == 1
+
+
+@pytest.mark.parametrize("fail_on", ["retire", "switch"])
+def test_kept_chunks_move_with_the_switch(weaviate, fail_on):
+    weaviate.index_document(document("d", ["a", "b", "c"]), [[0.1]] * 3)
+    weaviate.versions.fail_on = weaviate.chunks.fail_on = fail_on
+    with pytest.raises(RuntimeError):
+        update(weaviate, "d", ["b", "c"])
+    assert positions(weaviate) == [(0, "a"), (1, "b"), (2, "c")]
+    assert [chunk.chunk_sort_key for chunk in sorted(weaviate.get_chunk_manifest("d"), key=lambda c: c.chunk_sort_key)] == [0, 1, 2]
+
+
+def test_kept_chunks_read_their_new_positions_before_they_are_settled(weaviate):
+    weaviate.index_document(document("d", ["a", "b", "c"]), [[0.1]] * 3)
+    weaviate.chunks.fail_on = "settle"
+    with pytest.raises(RuntimeError):
+        update(weaviate, "d", ["b", "c", "x"])
+    weaviate.chunks.fail_on = None
+    assert positions(weaviate) == [(0, "b"), (1, "c"), (2, "x")]
+    assert sorted((c.chunk_sort_key, c.content_hash) for c in weaviate.get_chunk_manifest("d")) == [
+        (i, digest) for i, (digest, _) in enumerate(chunk_identities("d", ["b", "c", "x"]))
+    ]
+
+    update(weaviate, "d", ["b", "c", "x"])
+    assert positions(weaviate) == [(0, "b"), (1, "c"), (2, "x")]
+    assert not any(weaviate._unsettled(properties) for properties in weaviate.chunks.objects.values())
+    assert weaviate.versions.objects == {}
+
+
+def test_corpus_queries_hide_only_documents_being_updated(weaviate):
+    if weaviate.multi_tenant:
+        pytest.skip("corpus queries over tenants go through query_scope")
+    weaviate.index_document(document("d", ["a"]), [[0.1]])
+    weaviate.index_document(document("e", ["m"]), [[0.1]])
+    weaviate.chunks.fail_on = "retire"
+    with pytest.raises(RuntimeError):
+        update(weaviate, "d", ["b"])
+    weaviate.chunks.fail_on = None
+    assert visible(weaviate, "") == ["a", "m"]
+    update(weaviate, "d", ["b"])
+    assert visible(weaviate, "") == ["b", "m"]
+
+
+def test_document_objects_page_past_the_result_cap(weaviate):
+    weaviate.index_document(document("d", list("abcdefg")), [[0.1]] * 7)
+    weaviate.chunks.fail_on = "retire"  # leaves new chunks sharing sort keys with the old ones
+    with pytest.raises(RuntimeError):
+        update(weaviate, "d", list("xbydefz"))
+    weaviate.chunks.fail_on = None
+    weaviate.chunks.max_results = 4
+    found = [str(obj.uuid) for obj in weaviate._document_objects(weaviate.chunks, "d", [], page_size=2)]
+    assert sorted(found) == sorted(weaviate.chunks.objects)
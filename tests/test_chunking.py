@@ -0,0 +1,68 @@
+import io
+import json
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from scripts.bench_chunking import synthetic_markdown, synthetic_text
+from source.services.document_service import DocumentService
+from source.utils.chunking import MarkdownChunker, iter_json_chunks, iter_text_chunks
+from source.utils.file_utils import iter_text_blocks
+
+
+def blocks(text: str, size: int):
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(80, 30), (200, 0), (500, 50), (1000, 10)])
+@pytest.mark.parametrize("block_size", [7, 100, 4096])
+def test_text_chunks_match_recursive_splitter(chunk_size, chunk_overlap, block_size):
+    splitter = RecursiveCharacterTextSplitter(separators=["."], chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                              length_function=len)
+    for seed in range(3):
+        text = synthetic_text(20000, seed)
+        assert list(iter_text_chunks(blocks(text, block_size), chunk_size, chunk_overlap)) == splitter.split_text(text)
+
+
+def test_text_chunks_without_separators_stay_bounded():
+    text = "x" * 200_000
+    chunks = list(iter_text_chunks(blocks(text, 1000), 100))
+    assert "".join(chunks) == text
+    assert max(map(len, chunks)) <= 65536
+
+
+def test_text_blocks_decode_characters_split_across_reads():
+    text = "naïve café — ünïcødé. " * 50
+    assert "".join(iter_text_blocks(io.BytesIO(text.encode("utf-8")), block_size=3)) == text
+
+
+def test_json_chunks_keep_sections_and_paths():
+    document = {"company": {"name": "Acme", "employees": [{"name": "Ann"}, {"name": "Bob"}]}, "year": 2024}
+    chunks = list(iter_json_chunks(io.BytesIO(json.dumps(document).encode()), chunk_size=1000))
+    assert [text for text, _ in chunks] == [
+        "company.name: Acme\ncompany.employees[0].name: Ann\ncompany.employees[1].name: Bob",
+        "year: 2024",
+    ]
+    paths = chunks[0][1]
+    assert {"company", "company.employees", "company.employees[1]", "company.employees[1].name"} <= set(paths)
+
+
+@pytest.mark.parametrize("content_type,content", [
+    ("text/plain", synthetic_text(50000, 1).encode()),
+    ("application/json", json.dumps({"a": [{"b": i, "c": "x" * (i % 40)} for i in range(500)], "d": "e"}).encode()),
+])
+def test_streamed_uploads_chunk_like_parsed_files(config, content_type, content):
+    config.STREAM_READ_BYTES = 1024
+    service = DocumentService(embedding_service=None, weaviate_service=None, config=config)
+    streamed = list(service._stream_chunks(io.BytesIO(content), content_type))
+    assert streamed == list(service.chunk_content(content.decode(), content_type))
+
+
+def test_markdown_chunks_never_cross_headers():
+    text = synthetic_markdown(100000, 2)
+    chunker = MarkdownChunker(chunk_size=500, chunk_overlap=50)
+    chunks = chunker.split_text(text)
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    for chunk in chunks:
+        lines = chunk.split("\n")
+        assert not any(line.startswith("#") for line in lines[1:]), chunk
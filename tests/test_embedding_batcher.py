@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+from source.services.embedding_batcher import MicroBatcher
+
+
+class Backend:
+    """Embeds a text as [len(text)] and records every call."""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        if self.fail:
+            raise RuntimeError("backend down")
+        return [[float(len(text))] for text in texts]
+
+    async def embed_async(self, texts):
+        return self.embed(texts)
+
+
+def embed_concurrently(batcher, requests):
+    results = [None] * len(requests)
+    errors = [None] * len(requests)
+    start = threading.Barrier(len(requests))
+
+    def call(i):
+        start.wait()
+        try:
+            results[i] = batcher.embed(requests[i])
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_callers_share_one_backend_call():
+    backend = Backend()
+    batcher = MicroBatcher(backend.embed, backend.embed_async, window=0.2, max_size=100)
+    requests = [["a"], ["bb", "a"], ["ccc"], ["dddd", "bb"]]
+    results, errors = embed_concurrently(batcher, requests)
+    assert errors == [None] * 4
+    assert results == [[[float(len(text))] for text in texts] for texts in requests]
+    assert len(backend.calls) == 1
+    assert sorted(backend.calls[0]) == ["a", "bb", "ccc", "dddd"]  # equal texts are sent once
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    backend = Backend()
+    batcher = MicroBatcher(backend.embed, backend.embed_async, window=10, max_size=2)
+    results, _ = embed_concurrently(batcher, [["a"], ["b"]])
+    assert results == [[[1.0]], [[1.0]]]
+    assert len(backend.calls) == 1
+
+
+def test_backend_error_reaches_every_caller_of_the_batch():
+    backend = Backend(fail=True)
+    batcher = MicroBatcher(backend.embed, backend.embed_async, window=0.2, max_size=100)
+    _, errors = embed_concurrently(batcher, [["a"], ["b"], ["c"]])
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert len(backend.calls) == 1
+
+
+def test_async_callers_share_a_batch():
+    backend = Backend()
+    batcher = MicroBatcher(backend.embed, backend.embed_async, window=0.05, max_size=100)
+
+    async def run():
+        return await asyncio.gather(*(batcher.embed_async([text]) for text in ("x", "yy", "zzz")))
+
+    assert asyncio.run(run()) == [[[1.0]], [[2.0]], [[3.0]]]
+    assert len(backend.calls) == 1
+
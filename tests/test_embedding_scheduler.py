@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from source.services.embedding_scheduler import EmbeddingScheduler, rate_limit_delay
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+@pytest.fixture
+def scheduler(config, tmp_path):
+    config.EMBEDDING_MAX_CONCURRENCY = 2
+    config.EMBEDDING_RATE_LIMIT_RPM = 0
+    config.EMBEDDING_RETRY_BASE_DELAY = 0.2
+    config.EMBEDDING_LATENCY_TARGET_MS = 0
+    scheduler = EmbeddingScheduler(config, name="test")
+    yield scheduler
+    scheduler.close()
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_waiters_are_admitted_by_priority(scheduler):
+    held = [scheduler.acquire("query") for _ in range(2)]
+    order = []
+
+    def call(priority):
+        ticket = scheduler.acquire(priority)
+        order.append(priority)
+        time.sleep(0.01)
+        scheduler.release(ticket)
+
+    threads = [threading.Thread(target=call, args=(priority,)) for priority in ("backfill", "ingest", "query")]
+    for count, thread in enumerate(threads, start=1):
+        thread.start()
+        wait_until(lambda: len(scheduler._waiting) == count)
+    for ticket in held:
+        scheduler.release(ticket)
+    for thread in threads:
+        thread.join()
+    assert order == ["query", "ingest", "backfill"]
+
+
+def test_lower_priorities_leave_a_slot_for_queries(scheduler):
+    ingest = scheduler.acquire("ingest")
+    blocked = threading.Event()
+
+    def second_ingest():
+        scheduler.release(scheduler.acquire("ingest"))
+        blocked.set()
+
+    thread = threading.Thread(target=second_ingest)
+    thread.start()
+    wait_until(lambda: len(scheduler._waiting) == 1)
+    assert not blocked.is_set()
+    scheduler.release(scheduler.acquire("query"))  # the reserved slot is still free
+    scheduler.release(ingest)
+    thread.join()
+    assert blocked.is_set()
+
+
+def test_limit_halves_on_429_and_grows_back_additively(scheduler):
+    assert rate_limit_delay(RateLimited()) == 0.0
+    assert rate_limit_delay(ValueError()) is None
+
+    wait = scheduler.release(scheduler.acquire("query"), RateLimited())
+    assert scheduler.limit == 1.0
+    assert 0.2 <= wait <= 0.4
+
+    started = time.monotonic()
+    ticket = scheduler.acquire("query")  # waits out the shared cooldown
+    assert time.monotonic() - started >= 0.15
+    scheduler.release(ticket)
+    assert scheduler.limit == 2.0
+    scheduler.release(scheduler.acquire("query"))
+    assert scheduler.limit == 2.0  # capped at EMBEDDING_MAX_CONCURRENCY
+
+
+def test_slow_calls_shrink_the_limit(scheduler):
+    scheduler.latency_target = 0.01
+    ticket = scheduler.acquire("query")
+    time.sleep(0.02)
+    scheduler.release(ticket)
+    assert scheduler.limit == pytest.approx(1.8)
+
+
+def test_failed_calls_that_are_not_429_leave_the_limit(scheduler):
+    assert scheduler.release(scheduler.acquire("query"), ValueError("boom")) is None
+    assert scheduler.limit == 2.0
+
+
+def test_cancelled_async_waiter_gives_its_place_back(scheduler):
+    async def run():
+        held = [await scheduler.acquire_async("query") for _ in range(2)]
+        waiter = asyncio.create_task(scheduler.acquire_async("query"))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        for ticket in held:
+            await scheduler.release_async(ticket)
+        await scheduler.release_async(await scheduler.acquire_async("ingest"))
+
+    asyncio.run(run())
+    assert (scheduler._in_flight, scheduler._waiting, scheduler._claimed) == (0, [], None)
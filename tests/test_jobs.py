@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import create_app
+from conftest import make_config, upload_form
+from scripts.bench_service import Server
+from scripts.monitor_uploads import ProcessedIndex, UploadMonitor
+
+
+def post_async(client, content: bytes, **fields):
+    return client.post("/documents", data=upload_form(content, **{"async": "true", **fields}),
+                       content_type="multipart/form-data")
+
+
+def finished_job(client, status_url: str, timeout: float = 60) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(status_url).get_json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        assert time.monotonic() < deadline, f"job still {job['status']}"
+        time.sleep(0.05)
+
+
+def hold_parsing(app) -> threading.Event:
+    """Parses in one thread that is kept busy until the returned event is set, so new jobs stay queued."""
+    manager = app.extensions["services"].job_manager
+    release = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parse")
+    pool.submit(release.wait)
+    manager._parse_pool, manager._parse_in_threads = pool, True
+    return release
+
+
+@pytest.fixture
+def small_queue_app(tmp_path):
+    app = create_app(make_config(tmp_path, INGEST_QUEUE_MAX=1))
+    release = hold_parsing(app)
+    yield app, release
+    release.set()
+    app.extensions["services"].close()
+
+
+def test_async_upload_is_accepted_with_202_and_indexed(client):
+    response = post_async(client, b"Apples are red. Pears are green.", action="upload")
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body["status_url"] == f"/jobs/{body['job_id']}"
+
+    job = finished_job(client, body["status_url"])
+    assert job["status"] == "succeeded", job["error"]
+    assert job["document_id"] == body["document_id"]
+    results = client.post("/queries", json={"document_id": body["document_id"], "query": "apples", "mode": "keyword"})
+    assert [result["snippet"] for result in results.get_json()] == ["Apples are red. Pears are green."]
+
+
+def test_parse_pool_starts_with_the_first_job(app, client):
+    manager = app.extensions["services"].job_manager
+    assert manager._parse_pool is None and manager._parse_started is None
+
+    body = post_async(client, b"One. Two.", action="upload").get_json()
+    assert finished_job(client, body["status_url"])["status"] == "succeeded"
+    assert manager._parse_pool is not None
+
+
+def test_job_stays_queued_until_a_parse_worker_takes_it(app, client):
+    release = hold_parsing(app)
+    body = post_async(client, b"One. Two.", action="upload").get_json()
+    time.sleep(0.1)
+    assert client.get(body["status_url"]).get_json()["status"] == "queued"
+    release.set()
+    assert finished_job(client, body["status_url"])["status"] == "succeeded"
+
+
+def test_full_queue_answers_429_without_keeping_the_upload(small_queue_app):
+    app, release = small_queue_app
+    client = app.test_client()
+    accepted = post_async(client, b"One.", action="upload")
+    assert accepted.status_code == 202
+
+    for fields in ({"action": "upload"}, {"action": "update", "document_id": accepted.get_json()["document_id"]}):
+        rejected = post_async(client, b"Two.", **fields)
+        assert rejected.status_code == 429
+        assert rejected.headers["Retry-After"] == "5"
+    assert len(os.listdir(app.config["UPLOAD_FOLDER"])) == 1  # only the accepted job's file
+
+    release.set()
+    assert finished_job(client, accepted.get_json()["status_url"])["status"] == "succeeded"
+    assert post_async(client, b"Three.", action="upload").status_code == 202
+
+
+def test_async_update_applies_the_new_version(client):
+    document_id = client.post("/documents", data=upload_form(b"Apples are red.", action="upload", **{"async": "false"}),
+                              content_type="multipart/form-data").get_json()["document_id"]
+    response = post_async(client, b"Apples are green.", action="update", document_id=document_id)
+    assert response.status_code == 202
+    assert finished_job(client, response.get_json()["status_url"])["status"] == "succeeded"
+    results = client.post("/queries", json={"document_id": document_id, "query": "apples", "mode": "keyword"})
+    assert [result["snippet"] for result in results.get_json()] == ["Apples are green."]
+
+
+def test_unknown_job_is_404(client):
+    assert client.get("/jobs/nope").status_code == 404
+
+
+@pytest.mark.parametrize("content,succeeds", [(b'{"a": 1}', True), (b"{not json", False)])
+def test_monitor_records_a_queued_file_only_once_its_job_succeeds(tmp_path, content, succeeds):
+    app = create_app(make_config(tmp_path, INGEST_ASYNC_DEFAULT=True))
+    watched, processed = tmp_path / "watched", tmp_path / "processed"
+    watched.mkdir()
+    processed.mkdir()
+    path = watched / "doc.json"
+    path.write_bytes(content)
+    try:
+        with Server(app) as server:
+            monitor = UploadMonitor(server.url, str(watched), str(processed), ProcessedIndex(str(tmp_path / "index.sqlite3")),
+                                    workers=1, stable_seconds=0)
+            try:
+                monitor.process_file(str(path))
+            finally:
+                monitor.stop()
+    finally:
+        app.extensions["services"].close()
+    if succeeds:
+        assert monitor.counts["uploaded"] == 1
+        assert monitor.index.get("doc.json") is not None
+        assert (processed / "doc.json").exists()
+    else:
+        assert monitor.counts["failed"] == 1
+        assert monitor.index.get("doc.json") is None
+        assert path.exists()  # left in place to be retried
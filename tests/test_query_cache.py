@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+from source.services.query_cache import LRUTTLCache, QueryCache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUTTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c"), len(cache)) == (1, 3, 2)
+
+
+def test_entries_expire_after_their_ttl():
+    cache = LRUTTLCache(max_entries=10, ttl=60)
+    cache.set("short", 1, ttl=0.01)
+    cache.set("long", 2)
+    time.sleep(0.02)
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+
+
+def test_invalidation_hides_results_of_the_document_and_the_corpus(config):
+    cache = QueryCache(config)
+    generations = {scope: cache.generation(scope) for scope in ("d", "e", QueryCache.CORPUS_SCOPE)}
+    for scope, generation in generations.items():
+        cache.put_results(scope, generation, "q", 5, [scope])
+
+    cache.invalidate_document("d")
+
+    assert cache.get_results("d", cache.generation("d"), "q", 5) is None
+    assert cache.get_results("", cache.generation(""), "q", 5) is None
+    assert cache.get_results("e", cache.generation("e"), "q", 5) == ["e"]
+
+
+def test_results_stored_under_an_old_generation_are_never_served(config):
+    cache = QueryCache(config)
+    generation = cache.generation("d")
+    cache.invalidate_document("d")  # a write finished while the search was running
+    cache.put_results("d", generation, "q", 5, ["stale"])
+    assert cache.get_results("d", cache.generation("d"), "q", 5) is None
+
+
+def test_generations_stay_within_the_bounded_cache(config):
+    config.QUERY_CACHE_MAX_ENTRIES = 10
+    cache = QueryCache(config)
+    for i in range(100):
+        cache.invalidate_document(f"doc-{i}")
+    assert len(cache.backend) <= 10
+
+
+def test_counters_add_up_across_threads(config):
+    cache = QueryCache(config)
+    cache.put_results("d", 0, "hit", 5, ["r"])
+
+    def lookups():
+        for _ in range(2000):
+            cache.get_results("d", 0, "hit", 5)
+            cache.get_results("d", 0, "miss", 5)
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.hits, cache.misses) == (16000, 16000)
+
+
+def test_writes_through_the_service_invalidate_cached_queries(services):
+    document_service = services.document_service
+    cache = services.query_cache
+    document_id = document_service.index_chunks("doc", "doc.txt", "text/plain", {}, ["Apples are red.", "Sky is blue."])
+
+    def query():
+        return [result.snippet for result in document_service.query_document(document_id, "apples", limit=1, mode="keyword")]
+
+    assert query() == ["Apples are red."]
+    assert query() == ["Apples are red."]
+    assert cache.hits == 1
+
+    document_service.update_chunks(document_id, "doc.txt", "text/plain", {}, ["Apples are green.", "Sky is blue."])
+    assert query() == ["Apples are green."]
+
+    document_service.delete_document(document_id)
+    assert query() == []
+
+
+def test_async_queries_use_the_cache_off_the_event_loop(services, monkeypatch):
+    document_service = services.document_service
+    cache = services.query_cache
+    document_id = document_service.index_chunks("doc", "doc.txt", "text/plain", {}, ["Apples are red."])
+    loop_threads = []
+    for name in ("generation", "get_results", "put_results"):
+        method = getattr(cache, name)
+
+        def on_worker(*args, _method=method, **kwargs):
+            loop_threads.append(threading.current_thread() is threading.main_thread())
+            return _method(*args, **kwargs)
+
+        monkeypatch.setattr(cache, name, on_worker)
+
+    async def query():
+        return await document_service.query_document_async(document_id, "apples", limit=1, mode="keyword")
+
+    assert [result.snippet for result in asyncio.run(query())] == ["Apples are red."]
+    assert asyncio.run(query())[0].snippet == "Apples are red."
+    assert cache.hits == 1
+    assert loop_threads and not any(loop_threads)
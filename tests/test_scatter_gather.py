@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import upload_form
+from source.services.scatter_gather import ScopeTooLarge, check_scope, deadline_after, scatter, scatter_async
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=8)
+    yield executor
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def sleeper(seconds, value):
+    def task():
+        time.sleep(seconds)
+        return value
+    return task
+
+
+def test_scatter_returns_finished_results_and_names_the_late_ones(executor):
+    tasks = {"fast": sleeper(0, 1), "slow": sleeper(1, 2), "also fast": sleeper(0.01, 3)}
+    found, missing = scatter(executor, tasks, deadline_after(0.2), concurrency=3)
+    assert found == {"fast": 1, "also fast": 3}
+    assert missing == ["slow"]
+
+
+def test_scatter_never_starts_tasks_after_the_deadline(executor):
+    started = []
+
+    def task(name):
+        def run():
+            started.append(name)
+            time.sleep(0.1)
+            return name
+        return run
+
+    found, missing = scatter(executor, {name: task(name) for name in "abcd"}, deadline_after(0.05), concurrency=1)
+    assert started == ["a"]
+    assert found == {} and missing == list("abcd")
+
+
+def test_scatter_keeps_at_most_concurrency_tasks_in_flight(executor):
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def task():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+        return True
+
+    found, missing = scatter(executor, {str(i): task for i in range(12)}, None, concurrency=3)
+    assert len(found) == 12 and missing == []
+    assert max(peak) <= 3
+
+
+def test_scatter_reports_failed_partitions_unless_all_fail(executor):
+    def fail():
+        raise RuntimeError("partition down")
+
+    found, missing = scatter(executor, {"ok": sleeper(0, 1), "bad": fail}, None, concurrency=2)
+    assert found == {"ok": 1} and missing == ["bad"]
+    with pytest.raises(RuntimeError):
+        scatter(executor, {"bad": fail, "worse": fail}, None, concurrency=2)
+
+
+def test_scatter_async_cancels_late_tasks():
+    async def task(seconds, value):
+        await asyncio.sleep(seconds)
+        return value
+
+    async def run():
+        tasks = {"fast": lambda: task(0, 1), "slow": lambda: task(1, 2)}
+        return await scatter_async(tasks, deadline_after(0.1), concurrency=2)
+
+    assert asyncio.run(run()) == ({"fast": 1}, ["slow"])
+
+
+def test_check_scope():
+    check_scope(3, 3)
+    with pytest.raises(ScopeTooLarge):
+        check_scope(4, 3)
+
+
+def upload(client, text: bytes) -> str:
+    response = client.post("/documents", data=upload_form(text, action="upload", **{"async": "false"}),
+                           content_type="multipart/form-data")
+    assert response.status_code == 201
+    return response.get_json()["document_id"]
+
+
+def test_scoped_query_merges_documents(client):
+    first = upload(client, b"Apples are red. Bananas are yellow.")
+    second = upload(client, b"Apples fall from trees. The sky is blue.")
+    response = client.post("/queries", json={"document_ids": [first, second], "query": "apples", "mode": "keyword",
+                                             "num_chunks_return": 5})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["partial"] is False and body["missing"] == []
+    assert body["scoring"] == "bm25"
+    assert {result["document_id"] for result in body["results"]} == {first, second}
+
+
+def test_scoped_query_past_its_budget_is_partial(client, app, monkeypatch):
+    first = upload(client, b"Apples are red.")
+    second = upload(client, b"Apples are green.")
+    partition = app.extensions["services"].weaviate_service._partition(second)
+    statistics = partition.keyword_statistics
+
+    def slow_statistics(*args, **kwargs):
+        time.sleep(0.5)
+        return statistics(*args, **kwargs)
+
+    monkeypatch.setattr(partition, "keyword_statistics", slow_statistics)
+    response = client.post("/queries", json={"document_ids": [first, second], "query": "apples", "mode": "keyword",
+                                             "time_budget_ms": 200})
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body["partial"] is True and body["missing"] == [second]
+    assert [result["document_id"] for result in body["results"]] == [first]
+
+
+def test_corpus_query_over_the_scope_limit_is_rejected(config, tmp_path):
+    from app import create_app
+    config.QUERY_SCOPE_MAX_DOCUMENTS = 1
+    app = create_app(config)
+    try:
+        client = app.test_client()
+        upload(client, b"Apples are red.")
+        upload(client, b"Apples are green.")
+        response = client.post("/queries", json={"scope": "corpus", "query": "apples", "mode": "keyword"})
+        assert response.status_code == 400
+        assert client.post("/queries", json={"document_ids": ["a", "b"], "query": "x"}).status_code == 400
+    finally:
+        app.extensions["services"].close()